@@ -1,172 +1,380 @@
 import streamlit as st
 import pandas as pd
 from db_manager import DBManager
-from pdf_parser import extract_trip_data
-from visualization import create_financial_chart, create_trip_timeline, create_trip_summary, create_daily_trip_mileage_chart, create_expense_vs_revenue_chart, create_trip_efficiency_chart, create_expense_forecast_chart
 import datetime
+import uuid
+from constants import LEDGER_CATEGORIES
+from downsample import CHART_MAX_POINTS
+from instrumentation import finish_run, span, span_stats, start_run
 from session import authenticate_user, has_permission
 
-db_manager = DBManager()
+# Everything below is timed as one rerun; admins see the breakdown in the
+# sidebar.
+run = start_run()
 
-st.session_state["authenticated"], st.session_state["role"] = authenticate_user()
+# Heavy modules (plotly, PyPDF2, pyarrow, the ledger importer) are imported
+# where they are first used so a cold start only pays for what is rendered.
 
-if not st.session_state.get("authenticated", False):
-    st.error("Authentication failed. Please try again.")
-else:
-    st.title("RoadTrip Insights")
+@st.cache_resource
+def get_db_manager():
+    # One DBManager per process. Retention policies, when configured, are
+    # applied in the background.
+    from retention import get_retention_scheduler
 
-    tabs = st.tabs(["Cashflow Tracking", "GPS Reporting", "Analysis", "Management"])
+    db_manager = DBManager()
+    get_retention_scheduler(db_manager)
+    return db_manager
 
-    with tabs[0]:
-        if has_permission(st.session_state.get("role", "user"), "Cashflow Tracking"):
-            st.header("Daily Income and Expenses")
-            date = st.date_input("Date")
-            vehicle = st.selectbox("Vehicle", [vehicle[1] for vehicle in db_manager.list_vehicles()])
-            category = st.selectbox("Category", ["Revenue", "Fuel costs", "Repair costs", "Spare parts costs", "Maintenance", "Tolls", "Driver Allowance", "Insurance", "Permits"])
-            amount = st.number_input("Amount", min_value=0, step=100, format="%d")
+db_manager = get_db_manager()
+# Cheap once migrations succeeded; until then every run retries them.
+if db_manager.auto_migrate:
+    db_manager.ensure_schema()
 
-            if st.button("Add Entry"):
-                if date and vehicle and category and amount:
-                    db_manager.insert_daily_data(date.strftime("%Y-%m-%d"), vehicle, category, amount)
-                    st.success("Entry added successfully!")
-                else:
-                    st.error("Please fill all fields.")
+SECTIONS = ["Cashflow Tracking", "GPS Reporting", "Analysis", "Management"]
 
-            daily_data = db_manager.get_daily_data()
-            if daily_data:
-                fig = create_financial_chart(daily_data)
-                st.plotly_chart(fig)
+# Datasets shared by several panels are fetched at most once per script run,
+# and only when a panel that needs them is actually rendered.
+DATASETS = {
+    "vehicles": lambda: db_manager.list_vehicles() or [],
+    "daily_totals": lambda: db_manager.get_daily_totals(freq="day"),
+    "monthly_totals": lambda: db_manager.get_daily_totals(freq="month"),
+    "trip_stats": lambda days: db_manager.get_trip_stats(start=f"-{days}d", every="1d"),
+    "trips": lambda days: db_manager.get_trips(start=f"-{days}d"),
+}
+_loaded = {}
+
+TRIP_RANGES = {"Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "Last year": 365}
+
+def load(name, *args):
+    results = _loaded.setdefault(name, {})
+    if args not in results:
+        results[args] = DATASETS[name](*args)
+    return results[args]
 
-                if st.button("Export Financial Report as Image"):
-                    fig.write_image("financial_report.png")
-                    st.success("Financial report exported as image successfully!")
+def zoom_window(times, key):
+    # Large datasets are drawn downsampled; the slider drills into a window
+    # that is then rendered at full detail once it fits the point budget.
+    times = pd.to_datetime(pd.Series(times), errors="coerce").dropna()
+    if len(times) <= CHART_MAX_POINTS or times.min() == times.max():
+        return None
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert("UTC").dt.tz_localize(None)
+    low, high = times.min().to_pydatetime(), times.max().to_pydatetime()
+    return st.slider("Zoom", min_value=low, max_value=high, value=(low, high), key=key)
+
+def render_cashflow():
+    st.header("Daily Income and Expenses")
+    date = st.date_input("Date")
+    vehicle = st.selectbox("Vehicle", [vehicle[1] for vehicle in load("vehicles")])
+    category = st.selectbox("Category", db_manager.list_categories() or LEDGER_CATEGORIES)
+    amount = st.number_input("Amount", min_value=0, step=100, format="%d")
+
+    if st.button("Add Entry"):
+        if date and vehicle and category and amount:
+            db_manager.insert_daily_data(date.strftime("%Y-%m-%d"), vehicle, category, amount)
+            _loaded.pop("daily_totals", None)
+            st.success("Entry added successfully!")
         else:
-            st.error("You do not have permission to access this section.")
-
-    with tabs[1]:
-        if has_permission(st.session_state.get("role", "user"), "GPS Reporting"):
-            st.header("Trip Data Upload")
-            file_type = st.radio("Choose file type", ["CSV", "PDF"], index=0)
-            uploaded_file = st.file_uploader("Choose a file", type=["pdf", "csv"])
-
-            if file_type == "CSV":
-                st.markdown("**Expected CSV Header Titles:** Vehicle Plate Number, Trip State, Start Time, End Time, Mileage (km), Duration, Start Location, End Location")
-
-            if uploaded_file is not None:
-                try:
-                    with open("temp_file", "wb") as f:
-                        f.write(uploaded_file.read())
-                    if file_type == "PDF":
-                        file_type = "pdf"
-                    elif file_type == "CSV":
-                        file_type = "csv"
-                    else:
-                        st.error("Unsupported file type. Please upload a PDF or CSV file.")
-                        file_type = None
-
-                    if file_type:
-                        trip_data = extract_trip_data("temp_file", file_type)
-                        if trip_data:
-                            db_manager.write_influx_data(trip_data)
-                            st.success("Trip data uploaded successfully!")
-                            trip_summary = create_trip_summary(trip_data)
-                            st.dataframe(trip_summary)
-                            fig = create_trip_timeline(trip_data)
-                            if fig:
-                                st.plotly_chart(fig)
-                            else:
-                                st.error("Could not generate trip timeline. Check file format.")
-                        else:
-                            if "Error: CSV file is missing required columns:" in str(trip_data):
-                                st.error(str(trip_data))
-                            else:
-                                st.error("Could not extract trip data from the file.")
-                except Exception as e:
-                    st.error(f"An error occurred: {e}")
+            st.error("Please fill all fields.")
+
+    with st.expander("Bulk import from CSV/Excel"):
+        st.markdown("**Expected columns:** date, vehicle, category, amount")
+        ledger_file = st.file_uploader("Choose a ledger file", type=["csv", "xlsx", "xls"], key="ledger_file")
+        if ledger_file is not None and st.button("Import Entries"):
+            from ledger_import import import_ledger
+
+            try:
+                result = import_ledger(db_manager, ledger_file, ledger_file.name)
+                _loaded.pop("daily_totals", None)
+                st.success(f"Imported {result.imported} entries in {result.elapsed:.2f}s.")
+                if len(result.rejected):
+                    st.warning(f"{len(result.rejected)} rows were rejected.")
+                    st.dataframe(result.rejected)
+            except Exception as e:
+                st.error(f"An error occurred: {e}")
+
+    daily_data = load("daily_totals")
+    if daily_data:
+        from visualization import create_financial_chart
+
+        fig = create_financial_chart(daily_data)
+        st.plotly_chart(fig)
+
+        render_export(fig, "financial_report", "Export Financial Report")
+
+def render_export(fig, name, label):
+    # Rendering runs on the export pool; the job handle lives in session
+    # state and the download button appears on a later rerun once it's done.
+    from report_export import get_export, submit_export
+
+    owner = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+    fmt = st.radio("Export format", ["png", "pdf"], horizontal=True, key=f"{name}_format")
+    if st.button(label, key=f"{name}_export"):
+        st.session_state[f"{name}_job"] = submit_export(fig, owner, name=name, fmt=fmt).id
+
+    job = get_export(st.session_state.get(f"{name}_job"), owner)
+    if job is None:
+        return
+    if not job.done():
+        st.info("Rendering report... refresh to check again.")
+        if st.button("Refresh", key=f"{name}_refresh"):
+            st.rerun()
+    elif job.error() is not None:
+        st.error(f"Export failed: {job.error()}")
+    else:
+        st.download_button("Download report", job.read(), file_name=job.file_name, mime=job.mime, key=f"{name}_download")
+
+@st.fragment(run_every=1)
+def ingest_progress(job_id):
+    # Only this fragment reruns while the upload is processed; the rest of
+    # the page stays usable. Once the job finishes the whole page reruns to
+    # show its result.
+    from ingest_jobs import get_ingest_job
+
+    job = get_ingest_job(job_id)
+    if job is None or job.done():
+        st.rerun()
+    progress = job.progress()
+    st.info(f"Processing upload ({progress['status']}, {progress['elapsed']:.0f}s)...")
+    stages = pd.DataFrame.from_dict(progress["stages"], orient="index")
+    stages.columns = ["Rows", "Seconds", "Rows/s"]
+    st.dataframe(stages.round({"Seconds": 2, "Rows/s": 0}))
+
+def render_ingest_result(job, retry):
+    if job.error is not None:
+        st.error(f"An error occurred: {job.error}")
+        if st.button("Retry upload"):
+            retry()
+            st.rerun()
+        return
+
+    from visualization import create_trip_summary, create_trip_timeline
+
+    trip_data = job.result
+    if job.duplicate:
+        st.info("This file has already been uploaded; showing the stored trips.")
+    if trip_data and not job.duplicate:
+        st.success(f"Trip data uploaded successfully in {job.progress()['elapsed']:.1f}s!")
+    if trip_data:
+        from trip_metrics import get_trip_metrics
+
+        # Only the first chunk of an upload comes back; the fleet summary
+        # covers every trip.
+        st.subheader("Upload Preview")
+        total = job.progress()["stages"]["parse"]["rows"]
+        if len(trip_data) < total:
+            st.caption(f"Showing the first {len(trip_data):,} of {total:,} trips.")
+        elif job.duplicate:
+            st.caption(f"Showing up to the first {len(trip_data):,} trips of the upload.")
+        trip_summary = create_trip_summary(trip_data)
+        st.dataframe(trip_summary)
+        st.subheader("Fleet Summary")
+        st.dataframe(get_trip_metrics().summary())
+        window = zoom_window([trip["Start Time"] for trip in trip_data], key="timeline_zoom")
+        fig = create_trip_timeline(trip_data, window=window)
+        if fig:
+            st.plotly_chart(fig)
         else:
-            st.error("You do not have permission to access this section.")
-
-    with tabs[2]:
-        if has_permission(st.session_state.get("role", "user"), "Analysis"):
-            st.header("Trip Data Analysis")
-            daily_trip_data = db_manager.get_daily_trip_data()
-            if daily_trip_data is not None:
-                fig = create_daily_trip_mileage_chart(daily_trip_data)
-                if fig:
-                    st.plotly_chart(fig)
+            st.error("Could not generate trip timeline. Check file format.")
+    else:
+        st.error("Could not extract trip data from the file.")
+
+def render_gps_reporting():
+    st.header("Trip Data Upload")
+    file_type = st.radio("Choose file type", ["CSV", "PDF"], index=0)
+    uploaded_file = st.file_uploader("Choose a file", type=["pdf", "csv"])
+
+    if file_type == "CSV":
+        st.markdown("**Expected CSV Header Titles:** Vehicle Plate Number, Trip State, Start Time, End Time, Mileage (km), Duration, Start Location, End Location")
+
+    if uploaded_file is not None:
+        try:
+            if file_type == "PDF":
+                file_type = "pdf"
+            elif file_type == "CSV":
+                file_type = "csv"
+            else:
+                st.error("Unsupported file type. Please upload a PDF or CSV file.")
+                file_type = None
+
+            if file_type:
+                from ingest_jobs import submit_ingest
+
+                # Parsing and writing run on the ingest pool. The job is keyed
+                # by the file's content, so reruns while it is in progress
+                # reattach to it instead of starting the upload again.
+                upload_id = uploaded_file.file_id
+                job = submit_ingest(db_manager, uploaded_file.getvalue(), file_type, upload_id=upload_id)
+                if job.done():
+                    render_ingest_result(job, lambda: submit_ingest(db_manager, uploaded_file.getvalue(), file_type,
+                                                                    retry=True, upload_id=upload_id))
                 else:
-                    st.info("No trip data available for visualization.")
+                    ingest_progress(job.id)
+        except Exception as e:
+            st.error(f"An error occurred: {e}")
+
+def render_analysis():
+    from visualization import create_daily_trip_mileage_chart, create_expense_forecast_chart, create_expense_vs_revenue_chart, create_trip_efficiency_chart
+
+    st.header("Trip Data Analysis")
+    days = TRIP_RANGES[st.selectbox("Range", list(TRIP_RANGES), index=1, key="trip_range")]
+    daily_trip_data = load("trip_stats", days)
+    if daily_trip_data is not None:
+        fig = create_daily_trip_mileage_chart(daily_trip_data)
+        if fig:
+            st.plotly_chart(fig)
         else:
-            st.error("You do not have permission to access this section.")
-
-    with tabs[2]:
-        if has_permission(st.session_state.get("role", "user"), "Analysis"):
-            st.header("Data Analysis")
-
-            col1, col2 = st.columns(2)
-
-            with col1:
-                st.subheader("Expense vs Revenue Analysis")
-                expense_vs_revenue_data = db_manager.get_daily_data()
-                if expense_vs_revenue_data:
-                    fig = create_expense_vs_revenue_chart(expense_vs_revenue_data)
-                    st.plotly_chart(fig)
-
-            with col2:
-                st.subheader("Trip Efficiency Metrics")
-                trip_efficiency_data = db_manager.get_daily_trip_data()
-                if trip_efficiency_data:
-                    fig = create_trip_efficiency_chart(trip_efficiency_data)
-                    st.plotly_chart(fig)
-
-            st.subheader("Expense Forecasting")
-            expense_forecast_data = db_manager.get_daily_data()
-            if expense_forecast_data:
-                fig = create_expense_forecast_chart(expense_forecast_data)
+            st.info("No trip data available for visualization.")
+
+    st.header("Data Analysis")
+    monthly_totals = load("monthly_totals")
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("Expense vs Revenue Analysis")
+        if monthly_totals:
+            fig = create_expense_vs_revenue_chart(monthly_totals)
+            st.plotly_chart(fig)
+
+    with col2:
+        st.subheader("Trip Efficiency Metrics")
+        trip_efficiency_data = load("trips", days)
+        if trip_efficiency_data is not None and not trip_efficiency_data.empty:
+            window = zoom_window(trip_efficiency_data["Start Time"], key="efficiency_zoom")
+            fig = create_trip_efficiency_chart(trip_efficiency_data, window=window)
+            if fig:
                 st.plotly_chart(fig)
-        else:
-            st.error("You do not have permission to access this section.")
-
-    with tabs[3]:
-        if has_permission(st.session_state.get("role", "user"), "Management"):
-            st.header("Vehicle Management")
-            st.subheader("Add New Vehicle")
-            plate = st.text_input("Vehicle Plate Number")
-            model = st.text_input("Vehicle Model")
-            if st.button("Add Vehicle"):
-                if plate and model:
-                    db_manager.add_vehicle(plate, model)
-                    st.success("Vehicle added successfully!")
-                else:
-                    st.error("Please fill all fields.")
 
-            st.subheader("List Vehicles")
-            vehicles = db_manager.list_vehicles()
-            if vehicles:
-                st.table(pd.DataFrame(vehicles, columns=["ID", "Plate Number", "Model"]))
-            else:
-                st.info("No vehicles found.")
+    st.subheader("Expense Forecasting")
+    if monthly_totals:
+        fig = create_expense_forecast_chart(monthly_totals)
+        st.plotly_chart(fig)
+
+    st.subheader("Predicted Revenue")
+    from revenue_model import get_revenue_model
+
+    model = get_revenue_model()
+    trips = load("trips", days)
+    if model is None:
+        st.info("No revenue model has been trained yet. Run `python revenue_model.py --start YYYY-MM-DD`.")
+    elif trips is not None and not trips.empty:
+        predictions = model.predict_trips(trips).groupby("vehicle", as_index=False)["Predicted Revenue"].sum()
+        st.dataframe(predictions)
+        st.caption(f"Model {model.version}, test RMSE {model.metadata.get('test_rmse') or 0:,.2f} per vehicle-day")
+
+def render_management():
+    st.header("Vehicle Management")
+    st.subheader("Add New Vehicle")
+    plate = st.text_input("Vehicle Plate Number")
+    model = st.text_input("Vehicle Model")
+    if st.button("Add Vehicle"):
+        if plate and model:
+            db_manager.add_vehicle(plate, model)
+            _loaded.pop("vehicles", None)
+            st.success("Vehicle added successfully!")
         else:
-            st.error("You do not have permission to access this section.")
+            st.error("Please fill all fields.")
+
+    st.subheader("List Vehicles")
+    vehicles = load("vehicles")
+    if vehicles:
+        st.table(pd.DataFrame(vehicles, columns=["ID", "Plate Number", "Model"]))
+    else:
+        st.info("No vehicles found.")
+
+def render_performance(run):
+    # Latency of the rerun that just finished, span by span in the order
+    # they ran; nested spans are indented under the ones that called them.
+    from figure_cache import figure_cache_stats
+    from query_cache import get_query_cache
+
+    st.sidebar.header("Performance")
+    st.sidebar.caption(f"Rerun took {run.seconds * 1000:.0f} ms across {len(run.spans)} spans.")
+    breakdown = run.breakdown()
+    if not breakdown.empty:
+        breakdown["name"] = ["· " * depth + name for depth, name in zip(breakdown["depth"], breakdown["name"])]
+        breakdown["ms"] = (breakdown["seconds"] * 1000).round(1)
+        st.sidebar.dataframe(breakdown[["name", "kind", "ms", "rows", "bytes", "error"]], hide_index=True)
+
+    with st.sidebar.expander("Process totals"):
+        totals = pd.DataFrame.from_dict(span_stats(), orient="index")
+        if not totals.empty:
+            totals["mean_ms"] = (totals["seconds"] / totals["count"] * 1000).round(1)
+            totals["max_ms"] = (totals["max_seconds"] * 1000).round(1)
+            st.dataframe(totals.sort_values("seconds", ascending=False)[
+                ["kind", "count", "mean_ms", "max_ms", "rows", "bytes", "errors"]
+            ])
+        caches = {"query_cache": get_query_cache().stats(), "figure_cache": figure_cache_stats()}
+        try:
+            caches["postgres_pool"] = db_manager.pool_stats()
+        except Exception as e:
+            caches["postgres_pool"] = str(e)
+        st.json(caches)
+
+RENDERERS = {
+    "Cashflow Tracking": render_cashflow,
+    "GPS Reporting": render_gps_reporting,
+    "Analysis": render_analysis,
+    "Management": render_management,
+}
+
+st.session_state["authenticated"], st.session_state["role"] = authenticate_user()
+
+if not st.session_state.get("authenticated", False):
+    st.error("Authentication failed. Please try again.")
+else:
+    st.title("RoadTrip Insights")
+
+    # Unlike st.tabs, which executes every tab body on each run, only the
+    # selected section queries data and builds figures.
+    section = st.radio("Section", SECTIONS, horizontal=True, key="section", label_visibility="collapsed")
+
+    if has_permission(st.session_state.get("role", "user"), section):
+        with span(f"section.{section}", kind="section"):
+            RENDERERS[section]()
+    else:
+        st.error("You do not have permission to access this section.")
 
     st.sidebar.header("Reset")
 
     if has_permission(st.session_state.get("role", "user"), "Reset"):
         if st.sidebar.button("Clear Cashflow"):
-            db_manager.clear_sqlite_data()
-            st.sidebar.success("Cashflow cleared successfully!")
+            report = db_manager.clear_sqlite_data()
+            _loaded.pop("daily_totals", None)
+            _loaded.pop("monthly_totals", None)
+            if report is not None:
+                st.sidebar.success(f"Cashflow cleared: {report.rows} entries removed in {report.seconds:.1f}s.")
 
         st.sidebar.markdown('----')
         st.sidebar.subheader("Clear Trips")
         start_date = st.sidebar.date_input("Start Date", value=datetime.date.today() - datetime.timedelta(days=30))
         end_date = st.sidebar.date_input("End Date", value=datetime.date.today())
+        clear_vehicles = st.sidebar.multiselect("Vehicles (all if empty)", [vehicle[1] for vehicle in load("vehicles")])
 
         if st.sidebar.button("Clear"):
-            if db_manager.clear_influxdb_data(start_date, end_date):
-                st.sidebar.success("Trips cleared successfully!")
-            else:
-                st.error("Error clearing InfluxDB data.")
+            # Deleted window by window; the ingest cache and the fleet
+            # metrics are brought in line with the remaining trips.
+            try:
+                report = db_manager.clear_influxdb_data(start_date, end_date, vehicles=clear_vehicles or None)
+                st.sidebar.success(f"Trips cleared: {report.rows} trips removed in {report.seconds:.1f}s.")
+            except Exception as e:
+                st.sidebar.error(f"Error clearing InfluxDB data: {e}")
+
+        from retention import retention_policies, retention_reports
+
+        policies = retention_policies()
+        if policies:
+            st.sidebar.caption("Retention: " + ", ".join(f"{store} {days} days" for store, days in policies.items()))
+        reports = retention_reports()
+        if reports:
+            with st.sidebar.expander("Recent purges"):
+                st.dataframe(pd.DataFrame(reports)[["finished_at", "store", "rows", "partitions", "batches", "seconds"]])
     else:
         st.sidebar.error("You do not have permission to access this section.")
 
 db_manager.close_influx_connection()
+finish_run(run)
+
+if st.session_state.get("authenticated", False) and has_permission(st.session_state.get("role", "user"), "Performance"):
+    render_performance(run)
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "constants", "session", "db_manager", "pdf_parser", "ingest", "ledger_import",
+    "visualization", "streamlit", "pandas", "plotly.express", "influxdb_client",
+]
+
+
+def time_import(module, repeat):
+    # Each sample runs in a fresh interpreter so nothing is already in
+    # sys.modules; only the import itself is timed, not interpreter start-up.
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1] if result.stderr else "failed"}
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return {"median_s": statistics.median(samples), "min_s": min(samples)}
+
+
+def time_first_render(timeout):
+    from streamlit.testing.v1 import AppTest
+
+    started = time.perf_counter()
+    app = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=timeout)
+    app.run()
+    first = time.perf_counter() - started
+
+    started = time.perf_counter()
+    app.run()
+    rerun = time.perf_counter() - started
+    return {
+        "first_render_s": first,
+        "rerun_s": rerun,
+        "exceptions": [str(exception.value) for exception in app.exception],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time and first render of the dashboard.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--skip-render", action="store_true")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    results = {
+        "benchmark": "cold_start",
+        "python": platform.python_version(),
+        "imports": {module: time_import(module, args.repeat) for module in MODULES},
+    }
+    if not args.skip_render:
+        results["render"] = time_first_render(args.timeout)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
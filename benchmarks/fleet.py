@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic_fleet import generate_fleet, plates  # noqa: E402
+
+CHARTS = [
+    "create_financial_chart", "create_expense_vs_revenue_chart", "create_expense_forecast_chart",
+    "create_trip_timeline", "create_daily_trip_mileage_chart", "create_trip_efficiency_chart",
+]
+
+
+class _DiscardingWriteApi:
+    # In-process stand-in for the InfluxDB write API: batches go through the
+    # real BatchWriter (queue, batching, line protocol) and are dropped here.
+    def __init__(self):
+        self.records = 0
+
+    def write(self, bucket, org, record, **options):
+        self.records += len(record) if isinstance(record, list) else 1
+
+    def close(self):
+        pass
+
+
+class _StandInClient:
+    def __init__(self):
+        self.api = _DiscardingWriteApi()
+
+    def write_api(self, write_options=None):
+        return self.api
+
+
+def timed(fn, repeat=3, rows=None, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    result = {"median_s": statistics.median(samples), "min_s": min(samples), "repeat": repeat}
+    if rows:
+        result["rows"] = rows
+        result["rows_per_s"] = rows / result["median_s"] if result["median_s"] else None
+    return result
+
+
+def git_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def _ledger_rows(ledger, freq):
+    # The rows DBManager.get_daily_totals returns, aggregated in-process.
+    period = pd.to_datetime(ledger["date"]).dt.to_period("M" if freq == "month" else "D").dt.to_timestamp()
+    totals = ledger.assign(date=period.dt.date).groupby(["date", "vehicle", "category"], as_index=False)["amount"].sum()
+    return list(totals.itertuples(index=False, name=None))
+
+
+def _trip_stats(trips):
+    # The frame DBManager.get_trip_stats returns for every="1d".
+    daily = trips.set_index("Start Time").resample("D")["Mileage (km)"].agg(["sum", "count"])
+    return pd.DataFrame({"_time": daily.index, "Mileage (km)": daily["sum"].values,
+                         "Trip Count": daily["count"].astype("float64").values})
+
+
+def bench_ingest(trips, ledger, repeat, chunk_size, db_manager=None, postgres=False, influx=False):
+    from influx_writer import BatchWriter
+    from pdf_parser import iter_csv_chunks
+    from trip_ingest import to_line_protocol
+    from trip_metrics import TripMetrics, add_derived_fields
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trips.csv")
+        trips.to_csv(path, index=False)
+        results["parse_csv"] = timed(lambda: sum(len(chunk) for chunk in iter_csv_chunks(path, chunk_size)),
+                                     repeat, rows=len(trips))
+        chunks = list(iter_csv_chunks(path, chunk_size))
+
+    results["derive_fields"] = timed(lambda: [add_derived_fields(chunk) for chunk in chunks], repeat, rows=len(trips))
+    chunks = [add_derived_fields(chunk) for chunk in chunks]
+    results["line_protocol"] = timed(lambda: [to_line_protocol(chunk) for chunk in chunks], repeat, rows=len(trips))
+    results["metrics_update"] = timed(lambda: [TripMetrics(path=os.devnull).update(chunk) for chunk in chunks],
+                                      repeat, rows=len(trips))
+
+    lines = [to_line_protocol(chunk) for chunk in chunks]
+    if influx:
+        writer = db_manager.influx_writer
+        results["influx_write"] = dict(timed(lambda: ([writer.write(batch) for batch in lines], writer.flush()),
+                                             1, rows=len(trips)), backend="influxdb")
+    else:
+        # A short flush interval keeps the last partial batch from waiting
+        # out the timer, so the timing is queueing and batching overhead.
+        writer = BatchWriter(_StandInClient(), "benchmark", "benchmark", flush_interval=0.01)
+        results["influx_write"] = dict(timed(lambda: ([writer.write(batch) for batch in lines], writer.flush()),
+                                             repeat, rows=len(trips)), backend="stand-in")
+        writer.close()
+
+    if postgres:
+        results["ledger_copy"] = timed(lambda: db_manager.copy_daily_data(ledger), 1, rows=len(ledger))
+    return results
+
+
+def bench_queries(trips, ledger, repeat, start, stop, db_manager=None, postgres=False, influx=False):
+    from expense_forecast import ExpenseForecaster
+    from query_cache import get_query_cache
+    from revenue_model import daily_trip_features
+    from trip_metrics import add_derived_fields
+
+    results = {}
+    derived = add_derived_fields(trips)
+    results["daily_trip_features"] = timed(lambda: daily_trip_features(derived), repeat, rows=len(trips))
+    monthly = _ledger_rows(ledger, "month")
+    results["expense_forecast_fit"] = timed(lambda: ExpenseForecaster().update(monthly).forecast(), repeat,
+                                            rows=len(monthly))
+
+    vehicles = plates(trips["Vehicle Plate Number"].nunique())
+    clear = get_query_cache().clear
+    if postgres:
+        for freq in ("day", "month"):
+            results[f"daily_totals_{freq}"] = timed(
+                lambda: db_manager.get_daily_totals(freq=freq, start_date=start, end_date=stop, vehicles=vehicles),
+                repeat, setup=clear
+            )
+    if influx:
+        db_manager.influx_writer.flush()
+        results["trip_stats_1d"] = timed(
+            lambda: db_manager.get_trip_stats(start=start, stop=stop, every="1d", vehicles=vehicles), repeat, setup=clear
+        )
+        window_stop = min(pd.Timestamp(stop), pd.Timestamp(start) + pd.Timedelta(days=30))
+        results["trips_30d"] = timed(
+            lambda: db_manager.get_trips(start=start, stop=window_stop.date(), vehicles=vehicles), repeat, setup=clear
+        )
+    return results
+
+
+def bench_charts(trips, ledger, repeat):
+    import visualization
+    from figure_cache import clear_figures
+
+    inputs = {
+        "create_financial_chart": _ledger_rows(ledger, "day"),
+        "create_expense_vs_revenue_chart": _ledger_rows(ledger, "month"),
+        "create_expense_forecast_chart": _ledger_rows(ledger, "month"),
+        "create_trip_timeline": trips,
+        "create_daily_trip_mileage_chart": _trip_stats(trips),
+        "create_trip_efficiency_chart": trips,
+    }
+    results = {}
+    for name in CHARTS:
+        chart = getattr(visualization, name)
+        data = inputs[name]
+        # Cold builds the figure from scratch; warm is a rerun with the
+        # same data, answered by the figure cache.
+        cold = timed(lambda: chart(data), repeat, rows=len(data), setup=clear_figures)
+        chart(data)
+        warm = timed(lambda: chart(data), repeat)
+        fig = chart(data)
+        results[name] = {
+            "cold": cold,
+            "warm": warm,
+            "json_bytes": len(fig.to_json()) if fig is not None else None,
+        }
+    return results
+
+
+def cleanup(db_manager, vehicles, start, stop, postgres, influx):
+    from retention import purge_ledger, purge_trips
+
+    if influx:
+        span = f"{(pd.Timestamp(stop) - pd.Timestamp(start)).days + 1}d"
+        purge_trips(db_manager, start, stop, vehicles=vehicles, step=span)
+    if postgres:
+        purge_ledger(db_manager, start, stop, vehicles=vehicles)
+        with db_manager.connection() as conn:
+            if conn is not None:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM vehicles WHERE plate_number = ANY(%s)", (list(vehicles),))
+
+
+def compare(baseline_path, current_path):
+    # Prints current/baseline median ratios for every timing the two files
+    # share; > 1 means the current run is slower.
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+
+    def timings(results, prefix=""):
+        for key, value in results.items():
+            if isinstance(value, dict) and "median_s" in value:
+                yield prefix + key, value["median_s"]
+            elif isinstance(value, dict):
+                yield from timings(value, f"{prefix}{key}.")
+
+    before = dict(timings(baseline["results"]))
+    after = dict(timings(current["results"]))
+    rows = [
+        {"benchmark": name, "baseline_s": before[name], "current_s": after[name],
+         "ratio": after[name] / before[name] if before[name] else None}
+        for name in sorted(before.keys() & after.keys())
+    ]
+    print(json.dumps({"baseline": baseline.get("commit"), "current": current.get("commit"), "timings": rows}, indent=2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time ingestion, queries and charts on a synthetic fleet. Without --postgres/--influx only "
+                    "in-process paths run and InfluxDB writes go to a stand-in."
+    )
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--trips-per-day", type=float, default=6.0)
+    parser.add_argument("--start", default="2001-01-01", help="first synthetic day; keep it clear of real data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--chunk-size", type=int, default=10_000)
+    parser.add_argument("--postgres", action="store_true",
+                        help="also load and query the ledger in the configured PostgreSQL database")
+    parser.add_argument("--influx", action="store_true",
+                        help="also write and query trips in the configured InfluxDB bucket")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic rows in the databases")
+    parser.add_argument("--skip-charts", action="store_true")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    started = time.perf_counter()
+    trips, ledger = generate_fleet(args.vehicles, args.days, args.trips_per_day, args.start, args.seed)
+    generate_s = time.perf_counter() - started
+    start = pd.Timestamp(args.start).date()
+    stop = (pd.Timestamp(args.start) + pd.Timedelta(days=args.days)).date()
+    vehicles = plates(args.vehicles)
+
+    db_manager = None
+    if args.postgres or args.influx:
+        from db_manager import DBManager
+
+        # Synthetic plates are registered so ledger rows satisfy the
+        # vehicles foreign key; cleanup removes them again.
+        db_manager = DBManager(auto_migrate=args.postgres)
+        if args.postgres:
+            for plate in vehicles:
+                db_manager.add_vehicle(plate, "Benchmark")
+
+    results = {"generate": {"median_s": generate_s, "trips": len(trips), "ledger_entries": len(ledger)}}
+    try:
+        results["ingest"] = bench_ingest(trips, ledger, args.repeat, args.chunk_size, db_manager,
+                                         postgres=args.postgres, influx=args.influx)
+        results["query"] = bench_queries(trips, ledger, args.repeat, start, stop, db_manager,
+                                         postgres=args.postgres, influx=args.influx)
+        if not args.skip_charts:
+            results["charts"] = bench_charts(trips, ledger, args.repeat)
+    finally:
+        if db_manager is not None and not args.keep:
+            cleanup(db_manager, vehicles, start, stop, args.postgres, args.influx)
+            db_manager.close_influx_connection()
+
+    output = json.dumps({
+        "benchmark": "fleet",
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "params": {"vehicles": args.vehicles, "days": args.days, "trips_per_day": args.trips_per_day,
+                   "seed": args.seed, "repeat": args.repeat, "chunk_size": args.chunk_size},
+        "backends": {"postgres": args.postgres, "influxdb": "influxdb" if args.influx else "stand-in"},
+        "results": results,
+    }, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from constants import CSV_COLUMNS  # noqa: E402
+
+FUEL_PRICE = 1.6
+# Recurring costs as (category, day of month, amount).
+MONTHLY_COSTS = [("Insurance", 1, 120.0), ("Permits", 15, 35.0)]
+# Occasional costs as (category, daily probability, mean amount).
+RANDOM_COSTS = [("Maintenance", 0.02, 180.0), ("Repair costs", 0.01, 400.0),
+                ("Spare parts costs", 0.015, 90.0), ("Tolls", 0.3, 6.0)]
+
+
+def plates(vehicles, prefix="BENCH"):
+    return [f"{prefix}{index:04d}" for index in range(vehicles)]
+
+
+def generate_trips(vehicles, days, trips_per_day=6.0, start="2001-01-01", seed=0, prefix="BENCH"):
+    # Trips in the CSV_COLUMNS schema plus "Fuel (l)", generated with NumPy
+    # so millions of rows take seconds. Trips start mostly in daytime, and
+    # distance follows speed times a log-normal duration.
+    rng = np.random.default_rng(seed)
+    names = np.array(plates(vehicles, prefix))
+    counts = rng.poisson(trips_per_day, size=(vehicles, days))
+    total = int(counts.sum())
+    vehicle = np.repeat(np.repeat(np.arange(vehicles), days), counts.ravel())
+    day = np.repeat(np.tile(np.arange(days), vehicles), counts.ravel())
+
+    hour = np.clip(rng.normal(13, 4, total), 0, 23.99)
+    start_time = pd.Timestamp(start) + pd.to_timedelta(day * 86400 + (hour * 3600).astype("int64"), unit="s")
+    minutes = np.clip(rng.lognormal(3.2, 0.6, total), 2, 600).round()
+    speed = np.clip(rng.normal(38, 9, total), 5, 110)
+    mileage = (speed * minutes / 60).round(1)
+    efficiency = rng.uniform(8, 14, vehicles)[vehicle]
+    states = np.where(rng.random(total) < 0.95, "Completed", "Cancelled")
+
+    lat, lon = rng.uniform(-1.8, -0.8, (2, total)), rng.uniform(36.1, 37.3, (2, total))
+    seconds = (minutes * 60).astype("int64")
+    trips = pd.DataFrame({
+        "Vehicle Plate Number": names[vehicle],
+        "Trip State": states,
+        "Start Time": start_time,
+        "End Time": start_time + pd.to_timedelta(seconds, unit="s"),
+        "Mileage (km)": mileage,
+        "Duration": [f"{s // 3600}:{s // 60 % 60:02d}:{s % 60:02d}" for s in seconds],
+        "Start Location": [f"{a:.6f}, {b:.6f}" for a, b in zip(lat[0], lon[0])],
+        "End Location": [f"{a:.6f}, {b:.6f}" for a, b in zip(lat[1], lon[1])],
+        "Fuel (l)": (mileage / efficiency).round(2),
+    })
+    return trips[CSV_COLUMNS + ["Fuel (l)"]].sort_values("Start Time", ignore_index=True)
+
+
+def generate_ledger(trips, days, start="2001-01-01", seed=0):
+    # daily_data rows (date, vehicle, category, amount): revenue and fuel
+    # follow each vehicle's trips that day; other costs are recurring or
+    # random.
+    rng = np.random.default_rng(seed + 1)
+    trips = trips[trips["Trip State"] == "Completed"]
+    daily = trips.assign(date=trips["Start Time"].dt.normalize()).groupby(
+        ["date", "Vehicle Plate Number"], as_index=False
+    )[["Mileage (km)", "Fuel (l)"]].sum()
+    frames = [
+        pd.DataFrame({"date": daily["date"], "vehicle": daily["Vehicle Plate Number"], "category": "Revenue",
+                      "amount": (daily["Mileage (km)"] * rng.uniform(0.9, 1.4, len(daily))).round(2)}),
+        pd.DataFrame({"date": daily["date"], "vehicle": daily["Vehicle Plate Number"], "category": "Fuel costs",
+                      "amount": (daily["Fuel (l)"] * FUEL_PRICE).round(2)}),
+    ]
+
+    vehicles = trips["Vehicle Plate Number"].unique()
+    calendar = pd.date_range(start, periods=days, freq="D")
+    grid = pd.MultiIndex.from_product([calendar, vehicles], names=["date", "vehicle"]).to_frame(index=False)
+    for category, day_of_month, amount in MONTHLY_COSTS:
+        due = grid[grid["date"].dt.day == day_of_month]
+        frames.append(due.assign(category=category, amount=amount))
+    for category, probability, mean in RANDOM_COSTS:
+        hit = grid[rng.random(len(grid)) < probability]
+        frames.append(hit.assign(category=category, amount=rng.exponential(mean, len(hit)).round(2)))
+
+    ledger = pd.concat(frames, ignore_index=True)
+    ledger["date"] = ledger["date"].dt.date
+    return ledger.sort_values(["date", "vehicle", "category"], ignore_index=True)
+
+
+def generate_fleet(vehicles, days, trips_per_day=6.0, start="2001-01-01", seed=0, prefix="BENCH"):
+    trips = generate_trips(vehicles, days, trips_per_day, start, seed, prefix)
+    return trips, generate_ledger(trips, days, start, seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic fleet as a trip CSV and a ledger CSV.")
+    parser.add_argument("--vehicles", type=int, default=50)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--trips-per-day", type=float, default=6.0)
+    parser.add_argument("--start", default="2001-01-01")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default="benchmarks/data")
+    args = parser.parse_args(argv)
+
+    trips, ledger = generate_fleet(args.vehicles, args.days, args.trips_per_day, args.start, args.seed)
+    os.makedirs(args.output_dir, exist_ok=True)
+    trips_path = os.path.join(args.output_dir, f"trips-{args.vehicles}x{args.days}.csv")
+    ledger_path = os.path.join(args.output_dir, f"ledger-{args.vehicles}x{args.days}.csv")
+    trips.to_csv(trips_path, index=False)
+    ledger.to_csv(ledger_path, index=False)
+    print(f"Wrote {len(trips)} trips to {trips_path} and {len(ledger)} ledger entries to {ledger_path}")
+
+
+if __name__ == "__main__":
+    main()
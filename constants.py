@@ -2,3 +2,54 @@ CSV_COLUMNS = [
     "Vehicle Plate Number", "Trip State", "Start Time", "End Time",
     "Mileage (km)", "Duration", "Start Location", "End Location"
 ]
+
+LEDGER_CATEGORIES = [
+    "Revenue", "Fuel costs", "Repair costs", "Spare parts costs", "Maintenance",
+    "Tolls", "Driver Allowance", "Insurance", "Permits"
+]
+
+TRIP_MEASUREMENT = "trip_data"
+TRIP_TAG_COLUMNS = ["Vehicle Plate Number", "Trip State"]
+TRIP_TIME_COLUMN = "Start Time"
+TRIP_ROLLUP_MEASUREMENT = "trip_rollup"
+TRIP_ROLLUP_FIELDS = ["Mileage (km)", "Duration", "Fuel (l)"]
+TRIP_STATES = ["In Progress", "Completed", "Cancelled", "Canceled", "Scheduled", "Ongoing", "Pending", "Aborted"]
+
+# Header aliases seen in telematics exports, keyed by the normalized
+# lower-case header with any trailing "(unit)" removed.
+COLUMN_SYNONYMS = {
+    "vehicle plate number": "Vehicle Plate Number",
+    "vehicle plate": "Vehicle Plate Number",
+    "plate number": "Vehicle Plate Number",
+    "plate": "Vehicle Plate Number",
+    "registration": "Vehicle Plate Number",
+    "vehicle": "Vehicle Plate Number",
+    "trip state": "Trip State",
+    "trip status": "Trip State",
+    "state": "Trip State",
+    "status": "Trip State",
+    "start time": "Start Time",
+    "departure time": "Start Time",
+    "trip start": "Start Time",
+    "end time": "End Time",
+    "arrival time": "End Time",
+    "trip end": "End Time",
+    "mileage": "Mileage (km)",
+    "distance": "Mileage (km)",
+    "duration": "Duration",
+    "trip duration": "Duration",
+    "start location": "Start Location",
+    "origin": "Start Location",
+    "end location": "End Location",
+    "destination": "End Location",
+    "fuel": "Fuel (l)",
+    "fuel used": "Fuel (l)",
+}
+
+DURATION_UNITS = {
+    "s": "s", "sec": "s", "secs": "s", "seconds": "s",
+    "min": "min", "mins": "min", "minutes": "min",
+    "h": "h", "hr": "h", "hrs": "h", "hours": "h",
+}
+
+DISTANCE_UNITS = {"km": 1.0, "m": 0.001, "mi": 1.609344, "miles": 1.609344}
@@ -1,174 +1,380 @@
 import psycopg2
 from psycopg2 import sql
+import io
 import json
 import os
+import threading
+import pandas as pd
+from contextlib import ExitStack, contextmanager
 from dotenv import load_dotenv
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
+from constants import TRIP_ROLLUP_MEASUREMENT
+from db_pool import get_pool
+from migrations import migrate
+from query_cache import cached, get_query_cache, invalidates
+from retention import purge_ledger, purge_trips
+from influx_writer import get_batch_writer, get_influx_client
+from instrumentation import measure_count, traced
+from trip_ingest import to_line_protocol
+from trip_queries import parse_duration, query_params, to_frame, trip_stats_query, trips_query
+from trip_rollups import INFLUXDB_ROLLUPS, choose_rollup, get_rollup_refresher, parse_rollups
 
 load_dotenv()
 
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+
+_migrated = set()
+_migrated_lock = threading.Lock()
+
 class DBManager:
-    def __init__(self):
+    def __init__(self, auto_migrate=AUTO_MIGRATE):
         self.db_name = os.getenv("POSTGRES_DB")
         self.db_user = os.getenv("POSTGRES_USER")
         self.db_password = os.getenv("POSTGRES_PASSWORD")
         self.db_host = os.getenv("POSTGRES_HOST")
         self.db_port = os.getenv("POSTGRES_PORT")
+        self.pool_min_size = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1"))
+        self.pool_max_size = int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10"))
+        self.pool_checkout_timeout = float(os.getenv("POSTGRES_POOL_TIMEOUT", "30"))
+        self.pool_health_check_interval = float(os.getenv("POSTGRES_POOL_HEALTH_CHECK_INTERVAL", "30"))
         self.influx_url = os.getenv("INFLUXDB_URL")
         self.influx_token = os.getenv("INFLUXDB_TOKEN")
         self.influx_org = os.getenv("INFLUXDB_ORG")
         self.influx_bucket = os.getenv("INFLUXDB_BUCKET")
-        self.create_tables()
+        self.influx_batch_size = int(os.getenv("INFLUXDB_BATCH_SIZE", "5000"))
+        self.influx_flush_interval = float(os.getenv("INFLUXDB_FLUSH_INTERVAL", "1.0"))
+        self.influx_max_pending = int(os.getenv("INFLUXDB_MAX_PENDING", "100000"))
+        self.influx_max_retries = int(os.getenv("INFLUXDB_MAX_RETRIES", "5"))
+        self.influx_flush_timeout = float(os.getenv("INFLUXDB_FLUSH_TIMEOUT", "120"))
+        self.influx_rollups = parse_rollups(INFLUXDB_ROLLUPS, self.influx_bucket or "")
+        self._influx_writer = None
+        self.auto_migrate = auto_migrate
+        if auto_migrate:
+            self.ensure_schema()
 
-    def create_conn(self):
-        conn_params = {
-            'dbname': self.db_name,
-            'user': self.db_user,
-            'password': self.db_password,
-            'host': self.db_host,
-            'port': self.db_port
-        }
+    @property
+    def pool(self):
+        return get_pool(
+            self.pool_min_size,
+            self.pool_max_size,
+            checkout_timeout=self.pool_checkout_timeout,
+            health_check_interval=self.pool_health_check_interval,
+            dbname=self.db_name,
+            user=self.db_user,
+            password=self.db_password,
+            host=self.db_host,
+            port=self.db_port
+        )
 
-        print(f"Connecting to database with params: {conn_params}")
+    @contextmanager
+    def connection(self):
+        # Callers get None when no connection can be had (pool creation, a
+        # checkout timeout, a dead server) and degrade instead of raising;
+        # errors from their own statements still propagate.
+        with ExitStack() as stack:
+            try:
+                conn = stack.enter_context(self.pool.connection())
+            except psycopg2.Error as e:
+                print(f"Failed to connect to the database: {e}")
+                conn = None
+            yield conn
 
-        try:
-            conn = psycopg2.connect(**conn_params)
-            return conn
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            return None
+    def pool_stats(self):
+        return self.pool.stats()
+
+    def ensure_schema(self):
+        # Migrations run once per process and database; later calls are a set
+        # lookup, so the app calls this on every run and a failed attempt
+        # (e.g. PostgreSQL not up yet) is retried on the next one.
+        key = (self.db_host, self.db_port, self.db_name)
+        with _migrated_lock:
+            if key in _migrated:
+                return
+            if self.create_tables() is not None:
+                _migrated.add(key)
 
+    @traced(kind="postgres")
     def create_tables(self):
         try:
-            commands = (
-                """
-                CREATE TABLE IF NOT EXISTS vehicles (
-                    id SERIAL PRIMARY KEY,
-                    plate_number VARCHAR(255) NOT NULL,
-                    model VARCHAR(255) NOT NULL
+            with self.connection() as conn:
+                if conn is None:
+                    return
+
+                applied = migrate(conn)
+                if applied:
+                    get_query_cache().clear()
+                return applied
+        except psycopg2.Error as e:
+            print(f"An error occurred: {e}")
+
+    @traced(kind="postgres")
+    @invalidates("daily_data")
+    def insert_daily_data(self, date, vehicle, category, amount):
+        sql = """INSERT INTO daily_data (date, vehicle, category_id, amount)
+                 SELECT %s, %s, id, %s FROM ledger_categories WHERE name = %s"""
+        with self.connection() as conn:
+            if conn is None:
+                return
+
+            with conn.cursor() as cur:
+                cur.execute("SELECT ensure_daily_data_partition(%s)", (date,))
+                cur.execute(sql, (date, vehicle, amount, category))
+                if cur.rowcount == 0:
+                    raise ValueError(f"Unknown category: {category}")
+
+    @traced(kind="postgres")
+    @cached("daily_data")
+    def get_daily_data(self):
+        with self.connection() as conn:
+            if conn is None:
+                return
+
+            with conn.cursor() as cur:
+                cur.execute(
+                    """SELECT d.id, d.date, d.vehicle, c.name, d.amount::double precision
+                       FROM daily_data d
+                       JOIN ledger_categories c ON c.id = d.category_id"""
                 )
-                """,
-                """
-                CREATE TABLE IF NOT EXISTS daily_data (
-                    id SERIAL PRIMARY KEY,
-                    date DATE NOT NULL,
-                    vehicle VARCHAR(255) NOT NULL,
-                    category VARCHAR(255) NOT NULL,
-                    amount REAL NOT NULL
+                return cur.fetchall()
+
+    @traced(kind="postgres", measure=measure_count)
+    @invalidates("daily_data")
+    def copy_daily_data(self, df):
+        # Loads a validated ledger frame (date, vehicle, category, amount)
+        # with COPY in a single transaction; nothing is kept if any row fails.
+        if df.empty:
+            return 0
+
+        with self.connection() as conn:
+            if conn is None:
+                return
+
+            with conn.cursor() as cur:
+                cur.execute("SELECT name, id FROM ledger_categories")
+                category_ids = dict(cur.fetchall())
+
+                months = pd.to_datetime(df["date"]).dt.to_period("M").drop_duplicates()
+                for month in months:
+                    cur.execute("SELECT ensure_daily_data_partition(%s)", (month.start_time.date(),))
+
+                rows = pd.DataFrame({
+                    "date": pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d"),
+                    "vehicle": df["vehicle"],
+                    "category_id": df["category"].map(category_ids),
+                    "amount": df["amount"]
+                })
+                buffer = io.StringIO()
+                rows.to_csv(buffer, index=False, header=False)
+                buffer.seek(0)
+                cur.copy_expert(
+                    "COPY daily_data (date, vehicle, category_id, amount) FROM STDIN WITH (FORMAT csv)",
+                    buffer
                 )
-                """
-            )
+                return cur.rowcount
 
-            conn = self.create_conn()
+    @traced(kind="postgres")
+    @cached("categories")
+    def list_categories(self):
+        with self.connection() as conn:
             if conn is None:
-                print("Failed to connect to the database")
                 return
 
-            cur = conn.cursor()
+            with conn.cursor() as cur:
+                cur.execute("SELECT name FROM ledger_categories ORDER BY id")
+                return [row[0] for row in cur.fetchall()]
 
-            for command in commands:
-                print(f"Executing command: {command}")
-                cur.execute(command)
+    @traced(kind="postgres")
+    @cached("daily_data")
+    def get_daily_totals(self, freq="day", start_date=None, end_date=None, vehicles=None, categories=None):
+        # Sums per period, vehicle and category are computed in PostgreSQL so
+        # the charts receive one row per bucket instead of the whole ledger.
+        if freq not in ("day", "month"):
+            raise ValueError(f"Unsupported aggregation frequency: {freq}")
 
-            conn.commit()
-            cur.close()
-            conn.close()
-        except psycopg2.Error as e:
-            print(f"An error occurred: {e}")
+        conditions = []
+        params = [freq]
+        if start_date is not None:
+            conditions.append(sql.SQL("d.date >= %s"))
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append(sql.SQL("d.date <= %s"))
+            params.append(end_date)
+        if vehicles:
+            conditions.append(sql.SQL("d.vehicle = ANY(%s)"))
+            params.append(list(vehicles))
+        if categories:
+            conditions.append(sql.SQL("c.name = ANY(%s)"))
+            params.append(list(categories))
 
-    def insert_daily_data(self, date, vehicle, category, amount):
-        sql = """INSERT INTO daily_data (date, vehicle, category, amount)
-                 VALUES (%s, %s, %s, %s)"""
-        conn = self.create_conn()
-        if conn is None:
-            print("Failed to connect to the database")
-            return
-
-        cur = conn.cursor()
-        cur.execute(sql, (date, vehicle, category, amount))
-        conn.commit()
-        cur.close()
-        conn.close()
+        query = sql.SQL(
+            """SELECT date_trunc(%s, d.date)::date AS period, d.vehicle, c.name AS category,
+                      SUM(d.amount)::double precision AS amount
+               FROM daily_data d
+               JOIN ledger_categories c ON c.id = d.category_id
+               {where}
+               GROUP BY period, d.vehicle, c.name
+               ORDER BY period, d.vehicle, c.name"""
+        ).format(where=sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""))
 
-    def get_daily_data(self):
-        conn = self.create_conn()
-        if conn is None:
-            print("Failed to connect to the database")
-            return
-
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM daily_data")
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        return rows
-
-    def get_daily_trip_data(self):
-        client = InfluxDBClient(url=self.influx_url, token=self.influx_token, org=self.influx_org)
-        query_api = client.query_api()
-        query = f'from(bucket:"{self.influx_bucket}") |> range(start: -1d)'
-        tables = query_api.query(query)
-        client.close()
-        return tables
+        with self.connection() as conn:
+            if conn is None:
+                return
+
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                return cur.fetchall()
+
+    @property
+    def influx_client(self):
+        return get_influx_client(self.influx_url, self.influx_token, self.influx_org)
+
+    @property
+    def influx_writer(self):
+        self._influx_writer = get_batch_writer(
+            self.influx_client,
+            self.influx_bucket,
+            self.influx_org,
+            batch_size=self.influx_batch_size,
+            flush_interval=self.influx_flush_interval,
+            max_pending=self.influx_max_pending,
+            max_retries=self.influx_max_retries,
+            flush_timeout=self.influx_flush_timeout,
+            on_write=self._on_trips_written
+        )
+        return self._influx_writer
+
+    @property
+    def rollup_refresher(self):
+        if not self.influx_rollups:
+            return None
+        return get_rollup_refresher(
+            self.influx_client,
+            self.influx_bucket,
+            self.influx_org,
+            self.influx_rollups,
+            on_refresh=lambda: get_query_cache().invalidate("trips")
+        )
+
+    def _on_trips_written(self, batch):
+        get_query_cache().invalidate("trips")
+        if self.influx_rollups:
+            self.rollup_refresher.mark_batch(batch)
+
+    @traced(kind="influxdb")
+    @cached("trips")
+    def get_trip_stats(self, start="-30d", stop=None, every="1d", vehicles=None, group_by_vehicle=False):
+        # Filtering, windowing, counting and summing run inside InfluxDB; only
+        # one row per window (and vehicle) comes back, already pivoted. When a
+        # rollup tiles the interval the query reads that instead of raw trips.
+        rollup = choose_rollup(self.influx_rollups, every)
+        query = trip_stats_query(vehicles=vehicles, stop=stop, group_by_vehicle=group_by_vehicle, rollup=rollup is not None)
+        if rollup is None:
+            params = query_params(self.influx_bucket, start, stop=stop, every=every, vehicles=vehicles)
+        else:
+            params = query_params(rollup.bucket, start, stop=stop, every=every, vehicles=vehicles,
+                                  measurement=TRIP_ROLLUP_MEASUREMENT)
+        df = to_frame(self.influx_client.query_api().query_data_frame(query, params=params))
+        for column in ("Trip Count", "Mileage (km)"):
+            if column not in df.columns:
+                df[column] = pd.Series(dtype="float64")
+        return df
+
+    @traced(kind="influxdb")
+    @cached("trips")
+    def get_trips(self, start="-30d", stop=None, vehicles=None):
+        return self._query_trips(start, stop, vehicles)
+
+    @traced(kind="influxdb")
+    def iter_trip_chunks(self, start, stop, step="30d", vehicles=None):
+        # Streams raw trips window by window without going through the query
+        # cache, for jobs that read far more history than a chart does.
+        step = parse_duration(step)
+        window_start = pd.Timestamp(start)
+        stop = pd.Timestamp(stop)
+        while window_start < stop:
+            window_stop = min(window_start + step, stop)
+            yield window_start, window_stop, self._query_trips(
+                window_start.to_pydatetime(), window_stop.to_pydatetime(), vehicles
+            )
+            window_start = window_stop
 
+    @traced(kind="influxdb")
+    def _query_trips(self, start, stop, vehicles):
+        query = trips_query(vehicles=vehicles, stop=stop)
+        params = query_params(self.influx_bucket, start, stop=stop, vehicles=vehicles)
+        df = to_frame(self.influx_client.query_api().query_data_frame(query, params=params))
+        if "Duration" in df.columns:
+            df["Duration"] = pd.to_timedelta(df["Duration"], unit="s")
+        return df
+
+    def get_daily_trip_data(self, days=30):
+        return self.get_trip_stats(start=f"-{days}d", every="1d")
+
+    @traced(kind="postgres")
+    @invalidates("vehicles")
     def add_vehicle(self, plate, model):
         sql = """INSERT INTO vehicles (plate_number, model)
-                 VALUES (%s, %s)"""
-        conn = self.create_conn()
-        if conn is None:
-            print("Failed to connect to the database")
-            return
-
-        cur = conn.cursor()
-        cur.execute(sql, (plate, model))
-        conn.commit()
-        cur.close()
-        conn.close()
+                 VALUES (%s, %s)
+                 ON CONFLICT (plate_number) DO UPDATE SET model = EXCLUDED.model"""
+        with self.connection() as conn:
+            if conn is None:
+                return
 
+            with conn.cursor() as cur:
+                cur.execute(sql, (plate, model))
+
+    @traced(kind="postgres")
+    @cached("vehicles")
     def list_vehicles(self):
-        conn = self.create_conn()
-        if conn is None:
-            print("Failed to connect to the database")
-            return
-
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM vehicles")
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        return rows
+        with self.connection() as conn:
+            if conn is None:
+                return
+
+            with conn.cursor() as cur:
+                cur.execute("SELECT * FROM vehicles ORDER BY id")
+                return cur.fetchall()
 
     def write_influx_data(self, data):
-        client = InfluxDBClient(url=self.influx_url, token=self.influx_token, org=self.influx_org)
-        write_api = client.write_api(write_options=SYNCHRONOUS)
-        point = Point("trip_data")
-        for key, value in data.items():
-            point = point.field(key, value)
-        write_api.write(bucket=self.influx_bucket, org=self.influx_org, record=point)
-        client.close()
-
-    def clear_influxdb_data(self, start_date, end_date):
-        client = InfluxDBClient(url=self.influx_url, token=self.influx_token, org=self.influx_org)
-        delete_api = client.delete_api()
-        start = f"{start_date}T00:00:00Z"
-        stop = f"{end_date}T00:00:00Z"
-        delete_api.delete(start, stop, '_measurement="trip_data"', bucket=self.influx_bucket, org=self.influx_org)
-        client.close()
-
-    def clear_sqlite_data(self):
-        conn = self.create_conn()
-        if conn is None:
-            print("Failed to connect to the database")
-            return
-
-        cur = conn.cursor()
-        cur.execute("DELETE FROM daily_data")
-        conn.commit()
-        cur.close()
-        conn.close()
+        if isinstance(data, dict):
+            data = [data]
+        return self.write_trips(data)
+
+    @traced(kind="influxdb", measure=measure_count)
+    @invalidates("trips")
+    def write_trips(self, records):
+        lines = to_line_protocol(records)
+        return self.influx_writer.write(lines)
+
+    def write_trip_chunks(self, chunks):
+        written = 0
+        for chunk in chunks:
+            written += self.write_trips(chunk)
+        return written
+
+    @traced(kind="influxdb")
+    @invalidates("trips")
+    def clear_influxdb_data(self, start_date, end_date, vehicles=None):
+        # Returns a PurgeReport with the trips removed and the time taken.
+        return purge_trips(self, start_date, end_date, vehicles=vehicles)
+
+    @traced(kind="postgres")
+    @invalidates("daily_data")
+    def clear_sqlite_data(self, start_date=None, end_date=None, vehicles=None):
+        return purge_ledger(self, start_date, end_date, vehicles=vehicles)
+
+    def influx_writer_stats(self):
+        return self.influx_writer.stats()
+
+    def rollup_stats(self):
+        refresher = self.rollup_refresher
+        return refresher.stats() if refresher is not None else None
 
     def close_influx_connection(self):
-        pass
+        # The client is shared for the life of the process; a script run only
+        # waits for the trips its own thread queued, not other sessions' uploads.
+        if self._influx_writer is not None:
+            try:
+                self._influx_writer.flush()
+            except (TimeoutError, RuntimeError) as e:
+                print(f"Trips not yet written to InfluxDB: {e}")
 
 
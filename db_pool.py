@@ -0,0 +1,131 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, minconn, maxconn, checkout_timeout=30.0, health_check_interval=30.0, **conn_params):
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **conn_params)
+        # ThreadedConnectionPool raises instead of blocking when exhausted,
+        # so a semaphore sized to maxconn makes callers wait for a free slot.
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.checkouts = 0
+        self.in_use = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @contextmanager
+    def connection(self):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise pool.PoolError(f"Timed out after {self.checkout_timeout}s waiting for a database connection")
+
+        waited = time.perf_counter() - started
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self._checkin(conn)
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def _checkout(self):
+        conn = self._pool.getconn()
+        last_used = self._last_used.get(id(conn))
+        stale = last_used is None or time.monotonic() - last_used > self.health_check_interval
+        if conn.closed or (stale and not self._is_healthy(conn)):
+            self._discard(conn)
+            conn = self._pool.getconn()
+        return conn
+
+    def _checkin(self, conn):
+        if conn.closed:
+            self._discard(conn)
+            return
+        self._last_used[id(conn)] = time.monotonic()
+        self._pool.putconn(conn)
+
+    def _discard(self, conn):
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+        with self._lock:
+            self.discarded += 1
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+                "wait_time_total_s": self.wait_time_total,
+                "wait_time_avg_s": self.wait_time_total / self.checkouts if self.checkouts else 0.0,
+                "wait_time_max_s": self.wait_time_max,
+            }
+
+    def close(self):
+        self._pool.closeall()
+
+
+def get_pool(minconn, maxconn, **conn_params):
+    # One pool per process and database, shared by every DBManager and
+    # Streamlit session so reruns reuse already-open connections.
+    key = tuple(sorted((k, str(v)) for k, v in conn_params.items() if k not in ("checkout_timeout", "health_check_interval")))
+    with _pools_lock:
+        conn_pool = _pools.get(key)
+        if conn_pool is None:
+            conn_pool = ConnectionPool(minconn, maxconn, **conn_params)
+            _pools[key] = conn_pool
+        return conn_pool
+
+
+def close_pools():
+    with _pools_lock:
+        for conn_pool in _pools.values():
+            conn_pool.close()
+        _pools.clear()
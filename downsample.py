@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Roughly the pixel width of a chart: beyond this many points the browser
+# can't show more detail, only receive more JSON.
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "2000"))
+CHART_SCATTER_BINS = int(os.getenv("CHART_SCATTER_BINS", "50"))
+
+
+def should_downsample(size, downsample=None, max_points=CHART_MAX_POINTS):
+    # None means automatic: only frames larger than max_points are reduced.
+    if downsample is None:
+        return size > max_points
+    return bool(downsample)
+
+
+def clip_window(df, column, window):
+    # Drill-down: keep only the rows inside the zoomed (start, end) window so
+    # the point budget is spent on the visible range.
+    if window is None:
+        return df
+    times = df[column]
+    tz = getattr(times.dt, "tz", None)
+    start, end = (_localize(value, tz) if value is not None else None for value in window)
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= times >= start
+    if end is not None:
+        mask &= times <= end
+    return df[mask]
+
+
+def _localize(value, tz):
+    # Window bounds from a widget are naive; compare them in the column's zone.
+    value = pd.Timestamp(value)
+    if tz is not None and value.tzinfo is None:
+        return value.tz_localize(tz)
+    if tz is None and value.tzinfo is not None:
+        return value.tz_convert("UTC").tz_localize(None)
+    return value
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: returns the indexes of the points that
+    # best preserve the visual shape of the series.
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    edges = np.linspace(1, n - 1, threshold - 1).astype("int64")
+    selected = np.empty(threshold, dtype="int64")
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_start, next_stop = stop, edges[bucket + 2] if bucket + 2 < len(edges) else n
+        average_x = x[next_start:next_stop].mean()
+        average_y = y[next_start:next_stop].mean()
+
+        areas = np.abs(
+            (x[previous] - average_x) * (y[start:stop] - y[previous])
+            - (x[previous] - x[start:stop]) * (average_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def lttb_frame(df, x_column, y_columns, threshold=CHART_MAX_POINTS):
+    # The union of each series' LTTB points keeps every line's peaks.
+    if len(df) <= threshold:
+        return df
+    df = df.sort_values(x_column)
+    x = df[x_column]
+    if pd.api.types.is_datetime64_any_dtype(x):
+        x = x.astype("int64")
+    keep = set()
+    for column in y_columns:
+        y = df[column].fillna(0)
+        keep.update(lttb(x.to_numpy(), y.to_numpy(), max(3, threshold // len(y_columns))).tolist())
+    return df.iloc[sorted(keep)]
+
+
+def bin_scatter(df, x_column, y_column, group_column=None, bins=CHART_SCATTER_BINS):
+    # Aggregates points into a bins x bins grid (per group) and returns one
+    # row per occupied cell at the mean position, with a "Trips" count.
+    df = df[df[x_column].notna() & df[y_column].notna()]
+    if df.empty:
+        return df.assign(Trips=pd.Series(dtype="int64"))
+
+    cells = {}
+    for column in (x_column, y_column):
+        values = df[column].astype("float64")
+        low, high = values.min(), values.max()
+        width = (high - low) / bins or 1.0
+        cells[f"_{column}_cell"] = np.minimum(((values - low) / width).astype("int64"), bins - 1)
+
+    keys = list(cells) if group_column is None else [group_column] + list(cells)
+    grouped = df.assign(**cells).groupby(keys, sort=False, observed=True)
+    binned = grouped[[x_column, y_column]].mean()
+    binned["Trips"] = grouped.size()
+    return binned.reset_index().drop(columns=list(cells))
+
+
+def merge_intervals(df, start_column, end_column, group_column, min_gap=None):
+    # Overlapping intervals, or ones separated by less than min_gap (about
+    # one pixel of the time axis), are merged into a single bar per group.
+    df = df[df[start_column].notna() & df[end_column].notna()]
+    if df.empty:
+        return df.assign(Trips=pd.Series(dtype="int64"))
+    if min_gap is None:
+        min_gap = (df[end_column].max() - df[start_column].min()) / CHART_MAX_POINTS
+
+    df = df.sort_values([group_column, start_column])
+    reach = df.groupby(group_column, sort=False, observed=True)[end_column].cummax()
+    previous_reach = reach.groupby(df[group_column], sort=False, observed=True).shift()
+    starts_new = previous_reach.isna() | (df[start_column] > previous_reach + min_gap)
+    segment = starts_new.cumsum()
+
+    merged = df.groupby(segment, sort=False).agg(
+        **{
+            group_column: (group_column, "first"),
+            start_column: (start_column, "min"),
+            end_column: (end_column, "max"),
+            "Trips": (start_column, "size"),
+        }
+    )
+    return merged.reset_index(drop=True)
@@ -0,0 +1,229 @@
+import itertools
+import threading
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+from constants import LEDGER_CATEGORIES
+
+SEASON_LENGTH = 12
+EXPENSE_CATEGORIES = [category for category in LEDGER_CATEGORIES if category != "Revenue"]
+
+# Smoothing parameters tried for every series at once; the best in-sample
+# one-step error wins per series.
+ALPHAS = np.array([0.1, 0.3, 0.5, 0.8])
+BETAS = np.array([0.01, 0.1, 0.3])
+GAMMAS = np.array([0.05, 0.2, 0.5])
+
+_forecaster = None
+_forecaster_lock = threading.Lock()
+
+
+def monthly_panel(rows, complete_through=None, categories=EXPENSE_CATEGORIES):
+    # Monthly ledger totals as a (series, months) matrix, one series per
+    # vehicle and expense category; months without entries count as zero.
+    # The running month is left out so a partial month isn't read as a drop.
+    df = pd.DataFrame(rows or [], columns=["Date", "Vehicle", "Category", "Amount"])
+    df = df[df["Category"].isin(categories)]
+    if complete_through is None:
+        complete_through = pd.Timestamp.today().normalize().replace(day=1)
+    df = df.assign(Date=pd.to_datetime(df["Date"]).dt.to_period("M").dt.to_timestamp())
+    df = df[df["Date"] < complete_through]
+    if df.empty:
+        return [], pd.DatetimeIndex([]), np.zeros((0, 0))
+
+    vehicle_codes, vehicles = pd.factorize(df["Vehicle"], sort=True)
+    category_codes, categories = pd.factorize(df["Category"], sort=True)
+    combined, series_codes = np.unique(vehicle_codes * len(categories) + category_codes, return_inverse=True)
+    keys = [(vehicles[code // len(categories)], categories[code % len(categories)]) for code in combined]
+    months = pd.date_range(df["Date"].min(), df["Date"].max(), freq="MS")
+    month_codes = months.get_indexer(df["Date"])
+    Y = np.zeros((len(keys), len(months)))
+    np.add.at(Y, (series_codes, month_codes), df["Amount"].to_numpy(dtype="float64"))
+    return keys, months, Y
+
+
+def _initial_state(Y, season_length):
+    S, T = Y.shape
+    if season_length > 1:
+        first, second = Y[:, :season_length].mean(axis=1), Y[:, season_length:2 * season_length].mean(axis=1)
+        level = first
+        trend = (second - first) / season_length
+        season = Y[:, :season_length] - first[:, None]
+    else:
+        level = Y[:, 0].copy()
+        trend = Y[:, 1] - Y[:, 0] if T > 1 else np.zeros(S)
+        season = np.zeros((S, 1))
+    return level, trend, season
+
+
+def _smooth(Y, level, trend, season, alpha, beta, gamma, start=0, score_from=0):
+    # Additive Holt-Winters recursion over the time axis only: every array
+    # carries all series (and parameter candidates) in its leading axes, so
+    # the Python loop runs once per month, not once per series.
+    season = season.copy()
+    season_length = season.shape[-1]
+    sse = np.zeros(level.shape)
+    for t in range(Y.shape[-1]):
+        phase = (start + t) % season_length
+        y = Y[..., t]
+        seasonal = season[..., phase]
+        error = y - (level + trend + seasonal)
+        if t >= score_from:
+            sse += error ** 2
+        new_level = alpha * (y - seasonal) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        season[..., phase] = gamma * (y - new_level) + (1 - gamma) * seasonal
+        level = new_level
+    return level, trend, season, sse
+
+
+class ExpenseForecaster:
+    # Fitted state per series is kept between calls: new months are folded
+    # in with the stored parameters, and only series whose history changed
+    # (or that are new) are refitted.
+    def __init__(self, season_length=SEASON_LENGTH):
+        self.season_length = season_length
+        self.keys = []
+        self.months = pd.DatetimeIndex([])
+        self.Y = np.zeros((0, 0))
+        self.seasonal = False
+        self.state = None
+        self.refits = 0
+        self.incremental_updates = 0
+        self._lock = threading.Lock()
+
+    def _fit(self, Y):
+        m = self.season_length if self.seasonal else 1
+        grid = np.array(list(itertools.product(ALPHAS, BETAS, GAMMAS if self.seasonal else [0.0])))
+        alpha, beta, gamma = (grid[:, i][:, None] for i in range(3))
+
+        # Candidates go on a leading axis: arrays are (candidates, series).
+        level, trend, season = (np.broadcast_to(value, (len(grid),) + value.shape) for value in _initial_state(Y, m))
+        warmup = m if m > 1 else 1
+        level, trend, season, sse = _smooth(Y, level, trend, season, alpha, beta, gamma, score_from=warmup)
+
+        best = np.argmin(sse, axis=0)
+        series = np.arange(Y.shape[0])
+        scored = max(Y.shape[1] - warmup, 1)
+        return {
+            "level": level[best, series],
+            "trend": trend[best, series],
+            "season": season[best, series],
+            "alpha": grid[best, 0],
+            "beta": grid[best, 1],
+            "gamma": grid[best, 2],
+            "sse": sse[best, series],
+            "count": np.full(Y.shape[0], scored, dtype="float64"),
+        }
+
+    def _refit_all(self, keys, months, Y):
+        self.keys, self.months, self.Y = keys, months, Y
+        self.seasonal = Y.shape[1] >= 2 * self.season_length
+        self.state = self._fit(Y) if len(keys) else None
+        self.refits += len(keys)
+
+    def update(self, rows, complete_through=None):
+        keys, months, Y = monthly_panel(rows, complete_through)
+        with self._lock:
+            if not len(keys):
+                self._refit_all([], months, Y)
+                return self
+            seasonal = Y.shape[1] >= 2 * self.season_length
+            if (self.state is None or seasonal != self.seasonal or months[0] != self.months[0]
+                    or len(months) < len(self.months)):
+                self._refit_all(keys, months, Y)
+                return self
+
+            old_T = len(self.months)
+            old_index = {key: index for index, key in enumerate(self.keys)}
+            state = {name: np.zeros((len(keys),) + values.shape[1:]) for name, values in self.state.items()}
+            refit, append = [], []
+            for row, key in enumerate(keys):
+                index = old_index.get(key)
+                if index is None or not np.array_equal(Y[row, :old_T], self.Y[index]):
+                    refit.append(row)
+                    continue
+                append.append(row)
+                for name in state:
+                    state[name][row] = self.state[name][index]
+
+            if append and len(months) > old_T:
+                append = np.array(append)
+                level, trend, season, sse = _smooth(
+                    Y[append, old_T:], state["level"][append], state["trend"][append], state["season"][append],
+                    state["alpha"][append], state["beta"][append], state["gamma"][append], start=old_T
+                )
+                state["level"][append], state["trend"][append], state["season"][append] = level, trend, season
+                state["sse"][append] += sse
+                state["count"][append] += len(months) - old_T
+                self.incremental_updates += len(append)
+            if refit:
+                refit = np.array(refit)
+                fitted = self._fit(Y[refit])
+                for name in state:
+                    state[name][refit] = fitted[name]
+                self.refits += len(refit)
+
+            self.keys, self.months, self.Y, self.state = keys, months, Y, state
+        return self
+
+    def forecast(self, horizon=6, level=0.95):
+        # Per-series point forecasts and prediction intervals from the usual
+        # additive Holt-Winters h-step variance.
+        with self._lock:
+            if not self.keys:
+                return pd.DataFrame(columns=["Date", "Vehicle", "Category", "Forecast", "Variance"])
+            state, keys, months = self.state, self.keys, self.months
+
+        m = state["season"].shape[1]
+        T = len(months)
+        steps = np.arange(1, horizon + 1)
+        phases = (T + steps - 1) % m
+        point = state["level"][:, None] + steps[None, :] * state["trend"][:, None] + state["season"][:, phases]
+
+        sigma2 = state["sse"] / np.maximum(state["count"], 1.0)
+        j = np.arange(1, horizon)
+        weights = (
+            state["alpha"][:, None] * (1 + j[None, :] * state["beta"][:, None])
+            + state["gamma"][:, None] * ((j % m == 0) & (m > 1))[None, :]
+        ) ** 2
+        variance = sigma2[:, None] * (1 + np.concatenate([np.zeros((len(keys), 1)), np.cumsum(weights, axis=1)], axis=1))
+
+        dates = pd.date_range(months[-1] + pd.offsets.MonthBegin(1), periods=horizon, freq="MS")
+        index = pd.MultiIndex.from_tuples(keys, names=["Vehicle", "Category"])
+        z = NormalDist().inv_cdf(0.5 + level / 2)
+        df = pd.DataFrame({
+            "Date": np.tile(dates, len(keys)),
+            "Vehicle": np.repeat(index.get_level_values(0), horizon),
+            "Category": np.repeat(index.get_level_values(1), horizon),
+            "Forecast": point.ravel(),
+            "Variance": variance.ravel(),
+        })
+        return df.assign(
+            Lower=np.maximum(df["Forecast"] - z * np.sqrt(df["Variance"]), 0.0),
+            Upper=df["Forecast"] + z * np.sqrt(df["Variance"]),
+        )
+
+    def fleet_forecast(self, horizon=6, level=0.95):
+        # Fleet totals per month; series errors are treated as independent
+        # so their variances add up.
+        df = self.forecast(horizon, level)
+        if df.empty:
+            return pd.DataFrame(columns=["Date", "Forecast", "Lower", "Upper"])
+        totals = df.groupby("Date", as_index=False)[["Forecast", "Variance"]].sum()
+        z = NormalDist().inv_cdf(0.5 + level / 2)
+        spread = z * np.sqrt(totals["Variance"])
+        return totals.assign(Lower=np.maximum(totals["Forecast"] - spread, 0.0), Upper=totals["Forecast"] + spread)
+
+    def history(self):
+        with self._lock:
+            return pd.Series(self.Y.sum(axis=0) if self.Y.size else [], index=self.months, dtype="float64")
+
+
+def get_expense_forecaster():
+    global _forecaster
+    with _forecaster_lock:
+        if _forecaster is None:
+            _forecaster = ExpenseForecaster()
+        return _forecaster
@@ -0,0 +1,67 @@
+import functools
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from dotenv import load_dotenv
+from query_cache import _freeze
+
+load_dotenv()
+
+FIGURE_CACHE_SIZE = int(os.getenv("FIGURE_CACHE_SIZE", "64"))
+
+_figures = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def fingerprint(data):
+    # Identical data hashes identically however it was fetched, so a rerun
+    # that re-queries the same rows still reuses the figure.
+    digest = hashlib.sha1()
+    if isinstance(data, pd.DataFrame):
+        digest.update(repr((list(data.columns), [str(dtype) for dtype in data.dtypes])).encode())
+        try:
+            digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+            return digest.hexdigest()
+        except TypeError:
+            pass
+    digest.update(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    return digest.hexdigest()
+
+
+def memoize_figure(build):
+    # Figures are shared between sessions and must be treated as read-only;
+    # st.plotly_chart and write_image only serialize them.
+    @functools.wraps(build)
+    def wrapper(data=None, **kwargs):
+        key = (build.__name__, fingerprint(data), _freeze(kwargs))
+        with _lock:
+            fig = _figures.get(key)
+            if fig is not None:
+                _figures.move_to_end(key)
+                _stats["hits"] += 1
+                return fig
+            _stats["misses"] += 1
+
+        fig = build(data, **kwargs)
+        if fig is not None:
+            with _lock:
+                _figures[key] = fig
+                while len(_figures) > FIGURE_CACHE_SIZE:
+                    _figures.popitem(last=False)
+        return fig
+    return wrapper
+
+
+def clear_figures():
+    with _lock:
+        _figures.clear()
+
+
+def figure_cache_stats():
+    with _lock:
+        return dict(_stats, entries=len(_figures))
@@ -0,0 +1,210 @@
+import atexit
+import queue
+import threading
+import time
+
+_clients = {}
+_writers = {}
+_lock = threading.Lock()
+
+
+def get_influx_client(url, token, org, timeout=30_000):
+    # InfluxDBClient holds an HTTP connection pool, so one instance per
+    # process is shared by every DBManager and Streamlit session.
+    key = (url, token, org)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            from influxdb_client import InfluxDBClient
+
+            client = InfluxDBClient(url=url, token=token, org=org, timeout=timeout)
+            _clients[key] = client
+        return client
+
+
+def get_batch_writer(client, bucket, org, **options):
+    key = (id(client), bucket, org)
+    with _lock:
+        writer = _writers.get(key)
+        if writer is None or writer.closed:
+            writer = BatchWriter(client, bucket, org, **options)
+            _writers[key] = writer
+        return writer
+
+
+class BatchWriter:
+    def __init__(self, client, bucket, org, batch_size=5000, flush_interval=1.0,
+                 max_pending=100_000, max_retries=5, retry_interval=0.5, put_timeout=60.0, flush_timeout=120.0,
+                 on_write=None):
+        self.bucket = bucket
+        self.org = org
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.put_timeout = put_timeout
+        self.flush_timeout = flush_timeout
+        self.on_write = on_write
+        self.closed = False
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+        self.last_error = None
+        from influxdb_client.client.write_api import SYNCHRONOUS
+
+        self._write_api = client.write_api(write_options=SYNCHRONOUS)
+        # A bounded queue is the backpressure: producers block once
+        # max_pending records are waiting instead of growing memory.
+        self._queue = queue.Queue(maxsize=max_pending)
+        # Records are numbered in queue order; the writer thread consumes them
+        # in that order, so _done is also the highest number written. Each
+        # thread remembers the number of its last record for flush().
+        self._put_lock = threading.Lock()
+        self._enqueued = 0
+        self._done = 0
+        self._done_cond = threading.Condition()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"influx-writer-{bucket}", daemon=True)
+        self._thread.start()
+
+    def write(self, records):
+        if self.closed:
+            raise RuntimeError("BatchWriter is closed")
+        if not self._thread.is_alive():
+            raise RuntimeError("InfluxDB writer thread has stopped")
+        if isinstance(records, (str, bytes, dict)) or not hasattr(records, "__iter__"):
+            records = [records]
+        count = 0
+        for record in records:
+            with self._put_lock:
+                try:
+                    self._queue.put(record, timeout=self.put_timeout)
+                except queue.Full:
+                    raise TimeoutError(f"InfluxDB write queue still full after {self.put_timeout}s")
+                self._enqueued += 1
+                self._local.ticket = self._enqueued
+            count += 1
+        return count
+
+    def flush(self, timeout=None):
+        # Waits only for the records the calling thread queued (and whatever
+        # is ahead of them), not for uploads other sessions queue meanwhile.
+        self._wait_for(getattr(self._local, "ticket", 0), timeout)
+
+    def drain(self, timeout=None):
+        # Waits until everything queued so far, by any thread, is written.
+        with self._put_lock:
+            ticket = self._enqueued
+        self._wait_for(ticket, timeout)
+
+    def _wait_for(self, ticket, timeout):
+        timeout = self.flush_timeout if timeout is None else timeout
+        with self._done_cond:
+            if not self._done_cond.wait_for(lambda: self._done >= ticket or not self._thread.is_alive(), timeout):
+                raise TimeoutError(f"InfluxDB writes still pending after {timeout}s ({self._queue.qsize()} queued)")
+            if self._done < ticket:
+                raise RuntimeError("InfluxDB writer thread has stopped")
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.drain()
+        except (TimeoutError, RuntimeError) as e:
+            print(f"Closing InfluxDB writer with records still queued: {e}")
+        self.closed = True
+        self._stop.set()
+        self._thread.join()
+        self._write_api.close()
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                self.last_error = str(e)
+                print(f"Dropping {len(batch)} InfluxDB records: {e}")
+            finally:
+                with self._done_cond:
+                    self._done += len(batch)
+                    self._done_cond.notify_all()
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _collect(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write_api.write(bucket=self.bucket, org=self.org, record=batch)
+                break
+            except Exception as e:
+                self.last_error = str(e)
+                if attempt == self.max_retries:
+                    self.dropped += len(batch)
+                    print(f"Dropping {len(batch)} InfluxDB records after {self.max_retries} retries: {self.last_error}")
+                    return
+                self.retries += 1
+                time.sleep(self.retry_interval * 2 ** attempt)
+
+        self.written += len(batch)
+        self.batches += 1
+        if self.on_write is not None:
+            # A failing callback (cache invalidation, rollup marking) must not
+            # take the writer thread down with it.
+            try:
+                self.on_write(batch)
+            except Exception as e:
+                print(f"InfluxDB on_write callback failed: {e}")
+
+
+def flush_all():
+    with _lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        if not writer.closed:
+            writer.drain()
+
+
+@atexit.register
+def close_all():
+    with _lock:
+        writers = list(_writers.values())
+        clients = list(_clients.values())
+        _writers.clear()
+        _clients.clear()
+    for writer in writers:
+        writer.close()
+    for client in clients:
+        client.close()
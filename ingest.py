@@ -0,0 +1,114 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+from ingest_cache import file_digest, get_ingest_cache, purged_mask
+from pdf_parser import CSV_CHUNK_SIZE, extract_trip_data
+from trip_metrics import TripMetrics, add_derived_fields, get_trip_metrics
+
+
+@contextmanager
+def _spooled(data, file_type):
+    # Each upload gets its own temporary file, so concurrent sessions never
+    # overwrite each other's input.
+    with tempfile.NamedTemporaryFile(suffix=f".{file_type}", delete=False) as f:
+        f.write(data)
+    try:
+        yield f.name
+    finally:
+        os.remove(f.name)
+
+
+def _parse(path, file_type):
+    if file_type == "csv":
+        yield from extract_trip_data(path, file_type, chunksize=CSV_CHUNK_SIZE)
+        return
+
+    records = extract_trip_data(path, file_type)
+    if records:
+        yield pd.DataFrame(records)
+
+
+def _report(progress, stage, rows, started):
+    if progress is not None:
+        progress(stage, rows, time.perf_counter() - started)
+
+
+def _timed(chunks, progress, stage):
+    # Times each step of a chunk generator, so parsing is measured separately
+    # from the work done on the chunks it yields.
+    chunks = iter(chunks)
+    while True:
+        started = time.perf_counter()
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        _report(progress, stage, len(chunk), started)
+        yield chunk
+
+
+def ingest_upload(db_manager, data, file_type, cache=None, metrics=None, progress=None):
+    # Returns (preview records, duplicate). Uploads are keyed by content
+    # hash: a file that was already written to InfluxDB is answered from the
+    # cache without touching the database, and a cached file whose trips were
+    # purged is replayed from Parquet instead of being parsed again. A replay
+    # only writes and counts the trips the recorded purges deleted; the rest
+    # are still in InfluxDB and in the rebuilt running aggregates. Running
+    # aggregates only take the upload's trips once all of them are written,
+    # so a failed upload that is retried is not counted twice. The records
+    # returned are a preview: the first CSV_CHUNK_SIZE trips.
+    # progress(stage, rows, seconds) is called after every chunk of the
+    # "parse", "normalize" and "write" stages.
+    cache = cache or get_ingest_cache()
+    metrics = metrics or get_trip_metrics()
+    key = file_digest(data)
+
+    if cache.is_ingested(key):
+        preview = cache.get(key, rows=CSV_CHUNK_SIZE)
+        return (preview.to_dict(orient="records") if preview is not None else []), True
+
+    preview = None
+    uploaded = TripMetrics(path=None)
+    if key in cache:
+        purges = cache.purges(key)
+        for chunk in _timed(cache.iter_chunks(key, CSV_CHUNK_SIZE), progress, "parse"):
+            started = time.perf_counter()
+            chunk = add_derived_fields(chunk)
+            _report(progress, "normalize", len(chunk), started)
+            if preview is None:
+                preview = chunk
+            if purges is not None:
+                chunk = chunk[purged_mask(chunk, purges)]
+            started = time.perf_counter()
+            if not chunk.empty:
+                db_manager.write_trips(chunk)
+                uploaded.update(chunk)
+            _report(progress, "write", len(chunk), started)
+    else:
+        with _spooled(data, file_type) as path, cache.writer(key) as sink:
+            for chunk in _timed(_parse(path, file_type), progress, "parse"):
+                # Derived fields are computed once here and stored with the
+                # trips, so summaries and charts never recompute them.
+                started = time.perf_counter()
+                chunk = add_derived_fields(chunk)
+                _report(progress, "normalize", len(chunk), started)
+                if preview is None:
+                    preview = chunk
+                started = time.perf_counter()
+                sink.write(chunk)
+                db_manager.write_trips(chunk)
+                uploaded.update(chunk)
+                _report(progress, "write", len(chunk), started)
+
+    if preview is None:
+        return [], False
+
+    started = time.perf_counter()
+    db_manager.influx_writer.flush()
+    _report(progress, "write", 0, started)
+    cache.mark_ingested(key)
+    metrics.merge(uploaded)
+    metrics.save()
+    return preview.to_dict(orient="records"), False
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGEST_CACHE_DIR = os.getenv("INGEST_CACHE_DIR", ".cache/ingest")
+INGEST_CACHE_MAX_BYTES = int(os.getenv("INGEST_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def file_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _utc(times):
+    # Naive trip times are UTC, as they are when written to InfluxDB.
+    times = pd.to_datetime(times)
+    return times.dt.tz_localize("UTC") if times.dt.tz is None else times.dt.tz_convert("UTC")
+
+
+def purged_mask(df, purges):
+    # Rows of a cached upload that one of the recorded purges deleted.
+    times = _utc(df["Start Time"])
+    mask = pd.Series(False, index=df.index)
+    for purge in purges:
+        hit = (times >= pd.Timestamp(purge["start"])) & (times < pd.Timestamp(purge["stop"]))
+        if purge["vehicles"]:
+            hit &= df["Vehicle Plate Number"].isin(purge["vehicles"])
+        mask |= hit
+    return mask
+
+
+class IngestCache:
+    def __init__(self, directory=INGEST_CACHE_DIR, max_bytes=INGEST_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def _marker(self, key):
+        return os.path.join(self.directory, f"{key}.ingested")
+
+    def _span_path(self, key):
+        return os.path.join(self.directory, f"{key}.span.json")
+
+    def _purges_path(self, key):
+        return os.path.join(self.directory, f"{key}.purged")
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key, rows=None):
+        path = self._path(key)
+        try:
+            # The mtime doubles as the LRU timestamp.
+            os.utime(path)
+            if rows is None:
+                return pq.read_table(path).to_pandas()
+            batch = next(pq.ParquetFile(path).iter_batches(batch_size=rows), None)
+            return batch.to_pandas() if batch is not None else None
+        except (FileNotFoundError, pa.ArrowException):
+            return None
+
+    def iter_chunks(self, key, rows):
+        path = self._path(key)
+        os.utime(path)
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=rows):
+            yield batch.to_pandas()
+
+    @contextmanager
+    def writer(self, key):
+        # Chunks are appended to a temporary file and only published under
+        # the content key once the whole upload parsed successfully.
+        tmp_path = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        sink = _ChunkSink(tmp_path)
+        try:
+            yield sink
+            sink.close()
+            if sink.rows:
+                os.replace(tmp_path, self._path(key))
+                with open(self._span_path(key), "w") as f:
+                    json.dump(sink.span(), f)
+                self.evict()
+        finally:
+            sink.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put(self, key, df):
+        with self.writer(key) as sink:
+            sink.write(df)
+
+    def is_ingested(self, key):
+        return key in self and os.path.exists(self._marker(key))
+
+    def mark_ingested(self, key):
+        with open(self._marker(key), "w"):
+            pass
+        if os.path.exists(self._purges_path(key)):
+            os.remove(self._purges_path(key))
+
+    def span(self, key):
+        # First and last Start Time and the plates of a cached upload; None
+        # for entries cached before spans were recorded.
+        try:
+            with open(self._span_path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def purges(self, key):
+        # Purges that hit a cached upload since it was last fully written,
+        # or None if all of it has to be written (and counted) again.
+        try:
+            with open(self._purges_path(key)) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return None
+
+    def forget(self, start, stop, vehicles=None):
+        # Called after trips that started in [start, stop) were deleted. Only
+        # uploads whose trips overlap the purge lose their ingested marker,
+        # and the purge is recorded so a replay restores just those trips.
+        start, stop = _utc(pd.Series([start, stop]))
+        purge = {"start": start.isoformat(), "stop": stop.isoformat(), "vehicles": sorted(vehicles or [])}
+        forgotten = 0
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if not name.endswith(".parquet"):
+                    continue
+                key = name[:-len(".parquet")]
+                ingested = os.path.exists(self._marker(key))
+                if not (ingested or os.path.exists(self._purges_path(key))) or not self._overlaps(key, purge):
+                    continue
+                with open(self._purges_path(key), "a") as f:
+                    f.write(json.dumps(purge) + "\n")
+                if ingested:
+                    os.remove(self._marker(key))
+                    forgotten += 1
+        return forgotten
+
+    def _overlaps(self, key, purge):
+        span = self.span(key)
+        if span is None:
+            return True
+        before = pd.Timestamp(span["last"]) < pd.Timestamp(purge["start"])
+        after = pd.Timestamp(span["first"]) >= pd.Timestamp(purge["stop"])
+        if before or after:
+            return False
+        return not purge["vehicles"] or bool(set(purge["vehicles"]) & set(span["vehicles"]))
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(".parquet"):
+                    continue
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name[:-len(".parquet")]))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                for path in (self._path(key), self._marker(key), self._span_path(key), self._purges_path(key)):
+                    if os.path.exists(path):
+                        os.remove(path)
+                total -= size
+
+
+class _ChunkSink:
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.failed = False
+        self.first = None
+        self.last = None
+        self.vehicles = set()
+        self._writer = None
+
+    def write(self, df):
+        if self.failed:
+            return
+        try:
+            if self._writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                table = pa.Table.from_pandas(df, schema=self._writer.schema, preserve_index=False)
+            self._writer.write_table(table)
+            self.rows += len(df)
+            times = _utc(df["Start Time"]).dropna()
+            if not times.empty:
+                self.first = times.min() if self.first is None else min(self.first, times.min())
+                self.last = times.max() if self.last is None else max(self.last, times.max())
+            self.vehicles.update(df["Vehicle Plate Number"].dropna().astype(str))
+        except (pa.ArrowException, ValueError) as e:
+            # A chunk whose types don't fit the first chunk's schema only
+            # costs us the cache entry, never the upload itself.
+            print(f"Skipping ingest cache entry: {e}")
+            self.failed = True
+            self.rows = 0
+
+    def span(self):
+        if self.first is None:
+            return None
+        return {"first": self.first.isoformat(), "last": self.last.isoformat(), "vehicles": sorted(self.vehicles)}
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def get_ingest_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = IngestCache()
+        return _cache
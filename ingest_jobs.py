@@ -0,0 +1,130 @@
+import atexit
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from ingest import ingest_upload
+from ingest_cache import file_digest
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_JOB_TTL = float(os.getenv("INGEST_JOB_TTL", "3600"))
+STAGES = ("parse", "normalize", "write")
+
+_executor = None
+_jobs = {}
+_lock = threading.Lock()
+
+
+class IngestJob:
+    # One upload, identified by its content hash: the same file submitted
+    # again (a rerun, another tab) attaches to the job already running.
+    def __init__(self, job_id, file_type, upload_id=None):
+        self.id = job_id
+        self.file_type = file_type
+        self.upload_id = upload_id
+        self.status = "queued"
+        self.stages = {stage: {"rows": 0, "seconds": 0.0} for stage in STAGES}
+        self.result = None
+        self.duplicate = False
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self.status in ("done", "failed")
+
+    def record(self, stage, rows, seconds):
+        with self._lock:
+            self.stages[stage]["rows"] += rows
+            self.stages[stage]["seconds"] += seconds
+
+    def progress(self):
+        # A consistent copy for the UI; throughput is rows per second of time
+        # actually spent in the stage.
+        with self._lock:
+            stages = {
+                stage: dict(values, rate=values["rows"] / values["seconds"] if values["seconds"] else 0.0)
+                for stage, values in self.stages.items()
+            }
+            end = self.finished or time.time()
+            elapsed = end - self.started if self.started else 0.0
+            return {"status": self.status, "elapsed": elapsed, "stages": stages}
+
+    def _run(self, db_manager, data):
+        with self._lock:
+            self.status = "running"
+            self.started = time.time()
+        try:
+            result, duplicate = ingest_upload(db_manager, data, self.file_type, progress=self.record)
+        except Exception as e:
+            print(f"Ingest job {self.id} failed: {e}")
+            with self._lock:
+                self.status, self.error, self.finished = "failed", e, time.time()
+            return
+        with self._lock:
+            self.result, self.duplicate = result, duplicate
+            self.status, self.finished = "done", time.time()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Parsing, Parquet and the Influx client all release the GIL for
+            # their heavy parts, so a small thread pool keeps uploads off the
+            # Streamlit script threads without starving the dashboards.
+            _executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+        return _executor
+
+
+def submit_ingest(db_manager, data, file_type, retry=False, upload_id=None):
+    # upload_id identifies one upload of the file (Streamlit's file_id).
+    # Reruns for the same upload keep showing its finished job; uploading the
+    # file again, e.g. after its trips were purged, starts a new one.
+    cleanup()
+    job_id = file_digest(data)
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None and not job.done():
+            return job
+        # A failed job is only started again when asked to, so a rerun that
+        # shows its error doesn't silently retry it.
+        rerun = upload_id is not None and job is not None and job.upload_id == upload_id
+        if rerun and not (retry and job.status == "failed"):
+            return job
+        job = _jobs[job_id] = IngestJob(job_id, file_type, upload_id)
+    _get_executor().submit(job._run, db_manager, data)
+    return job
+
+
+def get_ingest_job(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def active_jobs():
+    with _lock:
+        return [job for job in _jobs.values() if not job.done()]
+
+
+def cleanup(ttl=INGEST_JOB_TTL):
+    # Finished jobs keep their preview for ttl seconds so reruns of the same
+    # upload can show it.
+    cutoff = time.time() - ttl
+    with _lock:
+        for job_id in [job.id for job in _jobs.values() if job.done() and job.finished < cutoff]:
+            del _jobs[job_id]
+
+
+@atexit.register
+def shutdown():
+    with _lock:
+        executor = _executor
+    if executor is not None:
+        executor.shutdown(wait=True)
@@ -0,0 +1,294 @@
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Port for a Prometheus /metrics endpoint (needs prometheus-client); empty
+# disables it.
+METRICS_PORT = os.getenv("METRICS_PORT", "")
+# Export spans as OpenTelemetry traces (needs opentelemetry-sdk and
+# opentelemetry-exporter-otlp); the exporter reads the usual OTEL_* settings.
+OTEL_TRACES = os.getenv("OTEL_TRACES", "false").lower() in ("1", "true", "yes")
+RUN_MAX_SPANS = int(os.getenv("RUN_MAX_SPANS", "1000"))
+
+_run = contextvars.ContextVar("instrumentation_run", default=None)
+_current = contextvars.ContextVar("instrumentation_span", default=None)
+_totals = {}
+_lock = threading.Lock()
+_exporters = None
+
+
+class Span:
+    def __init__(self, name, kind, parent=None):
+        self.name = name
+        self.kind = kind
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.rows = None
+        self.bytes = None
+        self.error = None
+        self.seconds = None
+        # Time actually spent working, for spans that are suspended in
+        # between (generators); None means wall time.
+        self.busy = None
+        self.started = time.perf_counter()
+        self.otel = _start_otel(name, parent)
+
+    def as_dict(self):
+        return {"name": self.name, "kind": self.kind, "depth": self.depth, "seconds": self.seconds,
+                "rows": self.rows, "bytes": self.bytes, "error": self.error}
+
+
+class Run:
+    # Spans recorded while one Streamlit script run executes; background
+    # threads (ingest, exports, rollups) only count towards the totals.
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.dropped = 0
+        self.seconds = None
+        self.started = time.perf_counter()
+
+    def breakdown(self):
+        return pd.DataFrame([span.as_dict() for span in self.spans],
+                            columns=["name", "kind", "depth", "seconds", "rows", "bytes", "error"])
+
+
+def _setup_exporters():
+    # Optional dependencies are imported on first use and only when enabled;
+    # a missing package disables that exporter instead of failing the app.
+    global _exporters
+    with _lock:
+        if _exporters is not None:
+            return _exporters
+        _exporters = {}
+        if METRICS_PORT:
+            try:
+                from prometheus_client import Counter, Histogram, start_http_server
+
+                labels = ["span", "kind"]
+                _exporters["prometheus"] = {
+                    "seconds": Histogram("roadtrip_span_seconds", "Span duration", labels),
+                    "rows": Counter("roadtrip_span_rows", "Rows returned or processed", labels),
+                    "bytes": Counter("roadtrip_span_bytes", "Bytes read or returned", labels),
+                    "errors": Counter("roadtrip_span_errors", "Spans that raised", labels),
+                }
+                start_http_server(int(METRICS_PORT))
+            except ImportError:
+                print("METRICS_PORT is set but prometheus-client is not installed")
+            except OSError as e:
+                # Another process (or a previous script reload) already serves it.
+                print(f"Prometheus metrics endpoint not started: {e}")
+        if OTEL_TRACES:
+            try:
+                from opentelemetry import trace
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                from opentelemetry.sdk.resources import Resource
+                from opentelemetry.sdk.trace import TracerProvider
+                from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+                provider = TracerProvider(resource=Resource.create({"service.name": "roadtrip-insights"}))
+                provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+                trace.set_tracer_provider(provider)
+                _exporters["otel"] = (trace, trace.get_tracer("roadtrip-insights"))
+            except ImportError:
+                print("OTEL_TRACES is set but the OpenTelemetry SDK or OTLP exporter is not installed")
+        return _exporters
+
+
+def _start_otel(name, parent):
+    otel = (_exporters if _exporters is not None else _setup_exporters()).get("otel")
+    if otel is None:
+        return None
+    trace, tracer = otel
+    context = trace.set_span_in_context(parent.otel) if parent is not None and parent.otel is not None else None
+    return tracer.start_span(name, context=context)
+
+
+def _open(name, kind):
+    parent = _current.get()
+    span = Span(name, kind, parent)
+    run = _run.get()
+    if run is not None:
+        if len(run.spans) < RUN_MAX_SPANS:
+            run.spans.append(span)
+        else:
+            run.dropped += 1
+    return span
+
+
+def _close(span):
+    span.seconds = span.busy if span.busy is not None else time.perf_counter() - span.started
+    with _lock:
+        totals = _totals.setdefault(span.name, {"kind": span.kind, "count": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                                "rows": 0, "bytes": 0, "errors": 0})
+        totals["count"] += 1
+        totals["seconds"] += span.seconds
+        totals["max_seconds"] = max(totals["max_seconds"], span.seconds)
+        totals["rows"] += span.rows or 0
+        totals["bytes"] += span.bytes or 0
+        totals["errors"] += span.error is not None
+
+    prometheus = (_exporters or {}).get("prometheus")
+    if prometheus is not None:
+        labels = (span.name, span.kind)
+        prometheus["seconds"].labels(*labels).observe(span.seconds)
+        prometheus["rows"].labels(*labels).inc(span.rows or 0)
+        prometheus["bytes"].labels(*labels).inc(span.bytes or 0)
+        if span.error is not None:
+            prometheus["errors"].labels(*labels).inc()
+    if span.otel is not None:
+        for key in ("kind", "rows", "bytes", "error"):
+            value = getattr(span, key)
+            if value is not None:
+                span.otel.set_attribute(f"roadtrip.{key}", value)
+        span.otel.end()
+
+
+@contextmanager
+def span(name, kind="custom"):
+    current = _open(name, kind)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        _close(current)
+
+
+def start_run(name="rerun"):
+    run = Run(name)
+    _run.set(run)
+    return run
+
+
+def finish_run(run):
+    run.seconds = time.perf_counter() - run.started
+    _run.set(None)
+    with _lock:
+        totals = _totals.setdefault(f"run.{run.name}", {"kind": "run", "count": 0, "seconds": 0.0,
+                                                        "max_seconds": 0.0, "rows": 0, "bytes": 0, "errors": 0})
+        totals["count"] += 1
+        totals["seconds"] += run.seconds
+        totals["max_seconds"] = max(totals["max_seconds"], run.seconds)
+    return run
+
+
+def measure_result(result):
+    # (rows, bytes) of a return value, using only cheap, shallow sizes.
+    if isinstance(result, pd.DataFrame):
+        return len(result), int(result.memory_usage(index=False).sum())
+    if isinstance(result, (bytes, str)):
+        return None, len(result)
+    if isinstance(result, (list, tuple)):
+        return len(result), None
+    return None, None
+
+
+def measure_input(args, kwargs, result):
+    # Rows of the data a function was given, e.g. the frame behind a chart.
+    data = args[0] if args else kwargs.get("data")
+    try:
+        return (len(data) if data is not None else None), None
+    except TypeError:
+        return None, None
+
+
+def measure_file(args, kwargs, result):
+    # Size of the file a parser read.
+    path = args[0] if args else kwargs.get("file_path")
+    try:
+        return None, os.path.getsize(path)
+    except (OSError, TypeError):
+        return None, None
+
+
+def measure_count(args, kwargs, result):
+    # Writers that return how many records they queued.
+    return (result if isinstance(result, int) else None), None
+
+
+def _apply(target, rows, nbytes):
+    if rows is not None:
+        target.rows = (target.rows or 0) + rows
+    if nbytes is not None:
+        target.bytes = (target.bytes or 0) + nbytes
+
+
+def _traced_generator(current, generator):
+    # The span stays open until the generator is exhausted, but only time
+    # spent producing items counts, not the caller's work between yields;
+    # rows and bytes are summed over the chunks it yields.
+    current.busy = 0.0
+    # Counts supplied by the measure callback (e.g. file size) win over the
+    # ones read off the yielded chunks.
+    count_rows, count_bytes = current.rows is None, current.bytes is None
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                current.busy += time.perf_counter() - started
+            rows, nbytes = measure_result(item)
+            _apply(current, rows if count_rows else None, nbytes if count_bytes else None)
+            yield item
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        _close(current)
+
+
+def traced(name=None, kind="call", measure=None):
+    # measure(args, kwargs, result) may return (rows, bytes) to use instead
+    # of the ones read off the result; None keeps the default.
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            current = _open(span_name, kind)
+            token = _current.set(current)
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as e:
+                current.error = type(e).__name__
+                _close(current)
+                raise
+            finally:
+                _current.reset(token)
+
+            extra = measure(args, kwargs, result) if measure is not None else (None, None)
+            if inspect.isgenerator(result):
+                _apply(current, *extra)
+                return _traced_generator(current, result)
+            rows, nbytes = measure_result(result)
+            current.rows = extra[0] if extra[0] is not None else rows
+            current.bytes = extra[1] if extra[1] is not None else nbytes
+            _close(current)
+            return result
+        return wrapper
+    return decorator
+
+
+def span_stats():
+    with _lock:
+        return {name: dict(totals) for name, totals in _totals.items()}
+
+
+def reset_stats():
+    with _lock:
+        _totals.clear()
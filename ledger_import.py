@@ -0,0 +1,99 @@
+import argparse
+import os
+import time
+
+import pandas as pd
+from constants import LEDGER_CATEGORIES
+
+LEDGER_COLUMNS = ["date", "vehicle", "category", "amount"]
+
+
+class ImportResult:
+    def __init__(self, imported, rejected, elapsed):
+        self.imported = imported
+        self.rejected = rejected
+        self.elapsed = elapsed
+
+
+def read_ledger(source, file_name=None):
+    name = (file_name or getattr(source, "name", None) or str(source)).lower()
+    if name.endswith((".xlsx", ".xls")):
+        df = pd.read_excel(source)
+    else:
+        df = pd.read_csv(source, dtype=str)
+
+    df.columns = [" ".join(str(column).split()).lower() for column in df.columns]
+    missing_columns = set(LEDGER_COLUMNS) - set(df.columns)
+    if missing_columns:
+        raise ValueError(f"Ledger file is missing required columns: {missing_columns}")
+    return df[LEDGER_COLUMNS]
+
+
+def validate_ledger(df, vehicles, categories):
+    # Returns (valid rows, rejected rows with a reason); rows are numbered
+    # as in the spreadsheet, counting the header as row 1.
+    dates = pd.to_datetime(df["date"], errors="coerce")
+    vehicle = df["vehicle"].astype("string").str.strip()
+    canonical = {category.lower(): category for category in categories}
+    category = df["category"].astype("string").str.strip().str.lower().map(canonical)
+    amount = df["amount"]
+    if not pd.api.types.is_numeric_dtype(amount):
+        amount = pd.to_numeric(amount.astype("string").str.replace(",", "", regex=False), errors="coerce")
+
+    reason = pd.Series(pd.NA, index=df.index, dtype="string")
+    for mask, message in (
+        (amount.isna() | (amount < 0), "invalid amount"),
+        (category.isna(), "unknown category"),
+        (~vehicle.isin(list(vehicles)).fillna(False).astype(bool), "unknown vehicle"),
+        (dates.isna(), "invalid date"),
+    ):
+        reason = reason.mask(mask, message)
+
+    valid = reason.isna()
+    cleaned = pd.DataFrame({
+        "date": dates.dt.date,
+        "vehicle": vehicle,
+        "category": category,
+        "amount": amount
+    })[valid]
+
+    rejected = df[~valid].copy()
+    rejected.insert(0, "row", rejected.index + 2)
+    rejected["reason"] = reason[~valid]
+    return cleaned, rejected
+
+
+def import_ledger(db_manager, source, file_name=None, dry_run=False):
+    started = time.perf_counter()
+    df = read_ledger(source, file_name)
+    vehicles = [vehicle[1] for vehicle in db_manager.list_vehicles() or []]
+    categories = db_manager.list_categories() or LEDGER_CATEGORIES
+    valid, rejected = validate_ledger(df, vehicles, categories)
+
+    imported = 0
+    if not dry_run:
+        imported = db_manager.copy_daily_data(valid) or 0
+    return ImportResult(imported, rejected, time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import cashflow entries from a CSV or Excel ledger.")
+    parser.add_argument("path", help="CSV or Excel file with date, vehicle, category and amount columns")
+    parser.add_argument("--dry-run", action="store_true", help="validate the file without loading it")
+    parser.add_argument("--rejected", help="write rejected rows to this CSV file")
+    args = parser.parse_args(argv)
+
+    from db_manager import DBManager
+
+    result = import_ledger(DBManager(), args.path, os.path.basename(args.path), dry_run=args.dry_run)
+    print(f"Imported {result.imported} entries in {result.elapsed:.2f}s, rejected {len(result.rejected)} rows.")
+    if len(result.rejected):
+        if args.rejected:
+            result.rejected.to_csv(args.rejected, index=False)
+        else:
+            print(result.rejected.to_string(index=False))
+    return 1 if len(result.rejected) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,47 +1,134 @@
+from collections import namedtuple
+
 import numpy as np
 
-def gradient_descent(f, df, initial_guess, learning_rate, max_iterations):
-    x = initial_guess
-    loss = None
+# x has the initial guess's shape; loss, iterations and converged hold one
+# entry per model when several models are optimized together.
+OptimizeResult = namedtuple("OptimizeResult", ["x", "loss", "iterations", "converged"])
 
-    for _ in range(max_iterations):
-        grad = df(x)
-        x -= learning_rate * grad
+METHODS = ("gd", "momentum", "adam")
 
-        if loss is None or np.abs(loss - last_loss) < 1e-6:
-            break
 
+def _per_model(mask, x):
+    # Broadcasts a per-model mask of shape (models,) over x's trailing axes.
+    if mask.size == 1:
+        return mask.reshape(())
+    return mask.reshape(mask.shape + (1,) * (x.ndim - 1))
+
+
+def minimize(f, df, initial_guess, learning_rate=0.01, max_iterations=1000, tol=1e-6,
+             method="gd", momentum=0.9, beta1=0.9, beta2=0.999, epsilon=1e-8, patience=None):
+    # Batch gradient descent over a whole array of models at once. f(x)
+    # returns one loss per model (the leading axis of x) or a scalar for a
+    # single model, and df(x) the gradient with x's shape. A model stops
+    # updating once its loss changes by less than tol, or, with patience,
+    # after that many iterations without improving on its best loss, in
+    # which case it is rolled back to its best parameters.
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}; expected one of {METHODS}")
+
+    x = np.array(initial_guess, dtype="float64")
+    loss = np.asarray(f(x), dtype="float64").reshape(-1)
+    models = loss.size
+    if models > 1 and (x.ndim == 0 or x.shape[0] != models):
+        raise ValueError("f must return one loss per row of initial_guess")
+
+    active = np.ones(models, dtype=bool)
+    converged = np.zeros(models, dtype=bool)
+    iterations = np.zeros(models, dtype="int64")
+    best_loss = loss.copy()
+    best_x = x.copy()
+    stale = np.zeros(models, dtype="int64")
+    velocity = np.zeros_like(x)
+    second_moment = np.zeros_like(x)
+
+    for step in range(1, max_iterations + 1):
+        grad = np.asarray(df(x), dtype="float64")
+        if method == "gd":
+            update = learning_rate * grad
+        elif method == "momentum":
+            velocity = momentum * velocity + learning_rate * grad
+            update = velocity
+        else:
+            velocity = beta1 * velocity + (1 - beta1) * grad
+            second_moment = beta2 * second_moment + (1 - beta2) * grad ** 2
+            corrected = velocity / (1 - beta1 ** step)
+            update = learning_rate * corrected / (np.sqrt(second_moment / (1 - beta2 ** step)) + epsilon)
+
+        x = x - np.where(_per_model(active, x), update, 0.0)
         last_loss = loss
+        loss = np.asarray(f(x), dtype="float64").reshape(-1)
+        iterations += active
+
+        settled = active & (np.abs(loss - last_loss) < tol)
+        converged |= settled
+        active &= ~settled
+
+        if patience is not None:
+            improved = loss < best_loss
+            best_loss = np.where(improved, loss, best_loss)
+            best_x = np.where(_per_model(improved, x), x, best_x)
+            stale = np.where(improved, 0, stale + active)
+            stopped = active & (stale >= patience)
+            x = np.where(_per_model(stopped, x), best_x, x)
+            loss = np.where(stopped, best_loss, loss)
+            active &= ~stopped
+
+        if not active.any():
+            break
+
+    if models == 1:
+        return OptimizeResult(x, loss[0], int(iterations[0]), bool(converged[0]))
+    return OptimizeResult(x, loss, iterations, converged)
+
+
+def gradient_descent(f, df, initial_guess, learning_rate, max_iterations, **options):
+    return minimize(f, df, initial_guess, learning_rate, max_iterations, **options).x
+
+
+def least_squares(X, y, mask=None):
+    # Loss and gradient for many independent linear models: X is
+    # (models, samples, features), y is (models, samples), and mask marks
+    # the real samples when models have different sample counts.
+    X = np.asarray(X, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    weights = np.ones_like(y) if mask is None else np.asarray(mask, dtype="float64")
+    counts = np.maximum(weights.sum(axis=1), 1.0)
+
+    def loss(theta):
+        residuals = (np.einsum("msf,mf->ms", X, theta) - y) * weights
+        return (residuals ** 2).sum(axis=1) / counts
+
+    def gradient(theta):
+        residuals = (np.einsum("msf,mf->ms", X, theta) - y) * weights
+        return 2 * np.einsum("msf,ms->mf", X, residuals) / counts[:, None]
+
+    return loss, gradient
 
-    return x
 
 def example_function(x):
     return x**2 + 2*x + 3
 
+
 def example_derivative(x):
     return 2*x + 2
 
-x = 5.0
-result_square = example_function(x)
-print(f"The square of {x} is {result_square}")
-
-result_derivative = example_derivative(x)
-print(f"The derivative of the function {example_function.__name__} at x={x} is {result_derivative}")
 
-initial_guess = 0.01
-learning_rate = 0.01
-max_iterations = 1000
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
 
-solution = gradient_descent(example_function, example_derivative, initial_guess, learning_rate, max_iterations)
-print("The solution is:", solution)
+    x = 5.0
+    print(f"The square of {x} is {example_function(x)}")
+    print(f"The derivative of the function {example_function.__name__} at x={x} is {example_derivative(x)}")
 
-import matplotlib.pyplot as plt
-x_values = np.linspace(-5, 5, 1000)
-y_values = [example_function(x) for x in x_values]
+    result = minimize(example_function, example_derivative, 0.01, learning_rate=0.01, max_iterations=1000)
+    print(f"The solution is: {result.x} after {result.iterations} iterations")
 
-plt.plot(x_values, y_values)
-plt.xlabel('x')
-plt.ylabel('f(x)')
-plt.title('Gradient Descent Solution')
-plt.legend()
-plt.show()
+    x_values = np.linspace(-5, 5, 1000)
+    plt.plot(x_values, example_function(x_values), label="f(x)")
+    plt.scatter([result.x], [example_function(result.x)], color="red", label="solution")
+    plt.xlabel('x')
+    plt.ylabel('f(x)')
+    plt.title('Gradient Descent Solution')
+    plt.legend()
+    plt.show()
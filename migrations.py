@@ -0,0 +1,148 @@
+from constants import LEDGER_CATEGORIES
+
+# Arbitrary key for pg_advisory_lock so concurrent app processes don't
+# apply the same migration twice.
+MIGRATION_LOCK_ID = 7310214
+
+MIGRATIONS = [
+    (1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS vehicles (
+            id SERIAL PRIMARY KEY,
+            plate_number VARCHAR(255) NOT NULL,
+            model VARCHAR(255) NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS daily_data (
+            id SERIAL PRIMARY KEY,
+            date DATE NOT NULL,
+            vehicle VARCHAR(255) NOT NULL,
+            category VARCHAR(255) NOT NULL,
+            amount REAL NOT NULL
+        )
+        """
+    ]),
+    (2, "typed, indexed and monthly partitioned daily_data", [
+        """
+        CREATE TABLE ledger_categories (
+            id SMALLSERIAL PRIMARY KEY,
+            name VARCHAR(64) NOT NULL UNIQUE
+        )
+        """,
+        "INSERT INTO ledger_categories (name) VALUES "
+        + ", ".join("('" + category.replace("'", "''") + "')" for category in LEDGER_CATEGORIES),
+        """
+        INSERT INTO ledger_categories (name)
+        SELECT DISTINCT category FROM daily_data
+        ON CONFLICT (name) DO NOTHING
+        """,
+        """
+        DELETE FROM vehicles a USING vehicles b
+        WHERE a.plate_number = b.plate_number AND a.id > b.id
+        """,
+        "ALTER TABLE vehicles ADD CONSTRAINT vehicles_plate_number_key UNIQUE (plate_number)",
+        """
+        INSERT INTO vehicles (plate_number, model)
+        SELECT DISTINCT vehicle, 'Unknown' FROM daily_data
+        ON CONFLICT (plate_number) DO NOTHING
+        """,
+        "ALTER TABLE daily_data RENAME TO daily_data_legacy",
+        "ALTER SEQUENCE daily_data_id_seq RENAME TO daily_data_legacy_id_seq",
+        "ALTER TABLE daily_data_legacy RENAME CONSTRAINT daily_data_pkey TO daily_data_legacy_pkey",
+        """
+        CREATE TABLE daily_data (
+            id BIGSERIAL,
+            date DATE NOT NULL,
+            vehicle VARCHAR(255) NOT NULL REFERENCES vehicles (plate_number) ON UPDATE CASCADE,
+            category_id SMALLINT NOT NULL REFERENCES ledger_categories (id),
+            amount NUMERIC(14, 2) NOT NULL,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+        """,
+        "CREATE INDEX daily_data_date_vehicle_idx ON daily_data (date, vehicle)",
+        "CREATE INDEX daily_data_category_date_idx ON daily_data (category_id, date)",
+        """
+        CREATE FUNCTION ensure_daily_data_partition(day DATE) RETURNS VOID AS $$
+        DECLARE
+            month_start DATE := date_trunc('month', day)::date;
+            partition_name TEXT := 'daily_data_' || to_char(month_start, 'YYYY_MM');
+        BEGIN
+            IF to_regclass(partition_name) IS NULL THEN
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF daily_data FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, (month_start + INTERVAL '1 month')::date
+                );
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        SELECT ensure_daily_data_partition(month)
+        FROM (SELECT DISTINCT date_trunc('month', date)::date AS month FROM daily_data_legacy) months
+        """,
+        """
+        INSERT INTO daily_data (date, vehicle, category_id, amount)
+        SELECT l.date, l.vehicle, c.id, l.amount
+        FROM daily_data_legacy l
+        JOIN ledger_categories c ON c.name = l.category
+        """,
+        "DROP TABLE daily_data_legacy"
+    ]),
+]
+
+
+def migrate(conn):
+    # Applies every pending migration, each in its own transaction, and
+    # returns the versions that were applied.
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+                """
+            )
+            cur.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cur.fetchall()}
+        conn.commit()
+
+        newly_applied = []
+        for version, name, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            try:
+                with conn.cursor() as cur:
+                    for statement in statements:
+                        cur.execute(statement)
+                    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            newly_applied.append(version)
+        return newly_applied
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+
+
+def main():
+    from db_manager import DBManager
+
+    applied = DBManager(auto_migrate=False).create_tables()
+    if applied is None:
+        print("Migration failed.")
+        return 1
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
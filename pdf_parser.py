@@ -1,23 +1,153 @@
-import PyPDF2
 import pandas as pd
 import re
 import os
+import multiprocessing
+import threading
 from constants import CSV_COLUMNS
-from langchain.agents import create_csv_agent
-from langchain.llms import OpenAI
+from trip_ingest import parse_times
+from trip_schema import compile_mapping
+from concurrent.futures import ProcessPoolExecutor
+from constants import TRIP_STATES
 from dotenv import load_dotenv
+from instrumentation import measure_file, traced
 
 load_dotenv()
 
-def extract_trip_data(file_path, file_type):
+CSV_CHUNK_SIZE = int(os.getenv("CSV_CHUNK_SIZE", "10000"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "8"))
+PDF_LLM_FALLBACK = os.getenv("PDF_LLM_FALLBACK", "false").lower() in ("1", "true", "yes")
+
+_DATETIME = r"\d{4}-\d{2}-\d{2}[ T]\d{1,2}:\d{2}(?::\d{2})?"
+_TRIP_ROW = re.compile(
+    r"^(?P<plate>.+?)\s+"
+    r"(?P<state>" + "|".join(re.escape(state) for state in TRIP_STATES) + r")\s+"
+    r"(?P<start>" + _DATETIME + r")\s+"
+    r"(?P<end>" + _DATETIME + r")\s+"
+    r"(?P<mileage>\d[\d,]*(?:\.\d+)?)\s*(?:km)?\s+"
+    r"(?P<duration>\d+(?::\d{2}){1,2}|\d+(?:\.\d+)?(?:\s*(?:h|hrs?|hours?|m|mins?|minutes?|s|secs?|seconds?)\b)?)"
+    r"\s*(?P<locations>.*)$",
+    re.IGNORECASE
+)
+_COORDINATES = re.compile(r"-?\d{1,3}\.\d+\s*[,.]\s*-?\d{1,3}\.\d+")
+_LOCATION_SEPARATOR = re.compile(r"\s{2,}|\s+(?:->|→|-|to)\s+")
+_executor = None
+_executor_lock = threading.Lock()
+
+@traced(kind="parse", measure=measure_file)
+def extract_trip_data(file_path, file_type, chunksize=None):
     if file_type == "pdf":
         return extract_data_from_pdf(file_path)
     elif file_type == "csv":
+        if chunksize:
+            return iter_csv_chunks(file_path, chunksize)
         return extract_data_from_csv(file_path)
     else:
         raise ValueError("Unsupported file type. Please upload a PDF or CSV file.")
 
-def extract_data_from_pdf(file_path):
+def _split_locations(text):
+    coordinates = _COORDINATES.findall(text)
+    if len(coordinates) >= 2:
+        return coordinates[0], coordinates[-1]
+
+    parts = [part for part in _LOCATION_SEPARATOR.split(text.strip(), maxsplit=1) if part]
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    return text.strip(), ""
+
+def _parse_trip_row(line):
+    match = _TRIP_ROW.match(line)
+    if match is None:
+        return None
+
+    duration = match.group("duration")
+    if re.fullmatch(r"\d+(?:\.\d+)?", duration):
+        duration = f"{duration} min"
+    elif ":" in duration and duration.count(":") == 1:
+        duration = f"{duration}:00"
+    start_location, end_location = _split_locations(match.group("locations"))
+
+    return {
+        "Vehicle Plate Number": match.group("plate").strip(),
+        "Trip State": match.group("state").title(),
+        "Start Time": match.group("start"),
+        "End Time": match.group("end"),
+        "Mileage (km)": float(match.group("mileage").replace(",", "")),
+        "Duration": duration,
+        "Start Location": start_location,
+        "End Location": end_location
+    }
+
+def parse_trip_table(text):
+    # Table cells often wrap onto several text lines, so unmatched lines are
+    # buffered and retried joined with the next few lines.
+    records = []
+    buffer = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        record = _parse_trip_row(line)
+        if record is None and buffer:
+            buffer.append(line)
+            record = _parse_trip_row(" ".join(buffer))
+        elif record is None:
+            buffer = [line]
+
+        if record is not None:
+            records.append(record)
+            buffer = []
+        elif len(buffer) > 4:
+            buffer.pop(0)
+    return records
+
+def _extract_pages(file_path, start, stop):
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(file_path)
+    records = []
+    for page_number in range(start, stop):
+        records.extend(parse_trip_table(reader.pages[page_number].extract_text() or ""))
+    return records
+
+def _get_executor():
+    # Ingest jobs parse PDFs from several threads at once, so the pool is
+    # created under a lock. Workers are spawned rather than forked: forking
+    # the multi-threaded Streamlit process can copy held locks into them.
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def extract_tables_from_pdf(file_path):
+    import PyPDF2
+
+    page_count = len(PyPDF2.PdfReader(file_path).pages)
+
+    if page_count < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS < 2:
+        records = _extract_pages(file_path, 0, page_count)
+    else:
+        step = -(-page_count // PDF_WORKERS)
+        ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        futures = [_get_executor().submit(_extract_pages, file_path, start, stop) for start, stop in ranges]
+        records = [record for future in futures for record in future.result()]
+
+    if not records:
+        return []
+    return coerce_trip_types(pd.DataFrame(records, columns=CSV_COLUMNS)).to_dict(orient="records")
+
+def extract_data_from_pdf(file_path, llm_fallback=PDF_LLM_FALLBACK):
+    trip_data = extract_tables_from_pdf(file_path)
+    if not trip_data and llm_fallback:
+        return extract_data_from_pdf_with_llm(file_path)
+    return trip_data
+
+def extract_data_from_pdf_with_llm(file_path):
+    from langchain.agents import create_csv_agent
+    from langchain.llms import OpenAI
+
     api_key = os.getenv("OPENAI_API_KEY")
     model = os.getenv("OPENAI_MODEL")
     api_url = os.getenv("OPENAI_API_URL")
@@ -50,13 +180,28 @@ def extract_data_from_pdf(file_path):
 
     return trip_data
 
+def coerce_trip_types(df):
+    for column in ("Start Time", "End Time"):
+        df[column] = parse_times(df[column])
+
+    if not pd.api.types.is_timedelta64_dtype(df["Duration"]):
+        df["Duration"] = pd.to_timedelta(df["Duration"], errors="coerce")
+
+    return df
+
+def iter_csv_chunks(file_path, chunksize=CSV_CHUNK_SIZE):
+    # Only one chunk is alive at a time, so memory stays flat regardless of
+    # the export size; the header is mapped once before streaming.
+    mapping = compile_mapping(pd.read_csv(file_path, nrows=0).columns)
+
+    with pd.read_csv(file_path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield coerce_trip_types(mapping.apply(chunk))
+
 def extract_data_from_csv(file_path):
     df = pd.read_csv(file_path)
+    mapping = compile_mapping(df.columns)
 
-    if not set(CSV_COLUMNS).issubset(df.columns):
-        missing_columns = set(CSV_COLUMNS) - set(df.columns)
-        raise ValueError(f"CSV file is missing required columns: {missing_columns}")
-
-    trip_data = df.to_dict(orient="records")
+    trip_data = coerce_trip_types(mapping.apply(df)).to_dict(orient="records")
 
     return trip_data
@@ -0,0 +1,119 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))
+
+
+class QueryCache:
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def set(self, key, value, tags):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, frozenset(tags), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *tags):
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[1] & set(tags)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+_cache = QueryCache()
+
+
+def get_query_cache():
+    return _cache
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+def _copy(value):
+    # Callers get their own container so mutating a result (e.g. set_index
+    # inplace in a chart) can't corrupt the cached copy.
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+def cached(*tags):
+    # The cache is process-wide, so every Streamlit session and rerun shares
+    # results until a write invalidates one of the tags or the TTL expires.
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (method.__name__, _freeze(args), _freeze(kwargs))
+            found, value = _cache.get(key)
+            if found:
+                return _copy(value)
+
+            value = method(self, *args, **kwargs)
+            if value is not None:
+                _cache.set(key, value, tags)
+            return _copy(value)
+        return wrapper
+    return decorator
+
+
+def invalidates(*tags):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                _cache.invalidate(*tags)
+        return wrapper
+    return decorator
@@ -0,0 +1,117 @@
+import atexit
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", ".cache/exports")
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_TTL = float(os.getenv("EXPORT_TTL", "3600"))
+EXPORT_FORMATS = {"png": "image/png", "pdf": "application/pdf", "svg": "image/svg+xml"}
+
+_executor = None
+_jobs = {}
+_lock = threading.Lock()
+
+
+class ExportJob:
+    # The download handle kept in session state between reruns.
+    def __init__(self, owner, name, fmt, path, future):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.name = name
+        self.format = fmt
+        self.path = path
+        self.future = future
+        self.created = time.time()
+
+    @property
+    def file_name(self):
+        return f"{self.name}.{self.format}"
+
+    @property
+    def mime(self):
+        return EXPORT_FORMATS[self.format]
+
+    def done(self):
+        return self.future.done()
+
+    def error(self):
+        return self.future.exception() if self.future.done() else None
+
+    def read(self):
+        self.future.result()
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Kaleido renders in a subprocess, so threads are enough to keep
+            # the Streamlit script thread free.
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="report-export")
+        return _executor
+
+
+def _safe(value):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(value)) or "anonymous"
+
+
+def _render(fig, path, fmt, width, height, scale):
+    tmp_path = f"{path}.tmp"
+    fig.write_image(tmp_path, format=fmt, width=width, height=height, scale=scale)
+    os.replace(tmp_path, path)
+    return path
+
+
+def submit_export(fig, owner, name="report", fmt="png", width=None, height=None, scale=2):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    cleanup()
+
+    directory = os.path.join(EXPORT_DIR, _safe(owner))
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(directory, f"{_safe(name)}-{stamp}-{uuid.uuid4().hex[:8]}.{fmt}")
+
+    future = _get_executor().submit(_render, fig, path, fmt, width, height, scale)
+    job = ExportJob(owner, name, fmt, path, future)
+    with _lock:
+        _jobs[job.id] = job
+    return job
+
+
+def get_export(job_id, owner):
+    with _lock:
+        job = _jobs.get(job_id)
+    if job is None or job.owner != owner:
+        return None
+    return job
+
+
+def cleanup(ttl=EXPORT_TTL):
+    # Finished exports are kept for ttl seconds, long enough to download.
+    cutoff = time.time() - ttl
+    with _lock:
+        expired = [job for job in _jobs.values() if job.done() and job.created < cutoff]
+        for job in expired:
+            del _jobs[job.id]
+    for job in expired:
+        if os.path.exists(job.path):
+            os.remove(job.path)
+
+
+@atexit.register
+def shutdown():
+    with _lock:
+        executor = _executor
+    if executor is not None:
+        executor.shutdown(wait=True)
@@ -0,0 +1,422 @@
+import argparse
+import atexit
+import datetime
+import os
+import re
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+from psycopg2 import sql
+from dotenv import load_dotenv
+from constants import TRIP_MEASUREMENT
+from query_cache import get_query_cache
+from trip_queries import (
+    VEHICLE_TAG, delete_predicate, parse_duration, query_params, to_frame, trip_edge_query, trip_windows_query
+)
+from trip_rollups import delete_rollups
+
+load_dotenv()
+
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+RETENTION_TRIP_STEP = os.getenv("RETENTION_TRIP_STEP", "7d")
+RETENTION_LOCK_TIMEOUT = os.getenv("RETENTION_LOCK_TIMEOUT", "2s")
+# Days of history to keep per store; empty keeps everything.
+TRIP_RETENTION_DAYS = os.getenv("TRIP_RETENTION_DAYS", "")
+LEDGER_RETENTION_DAYS = os.getenv("LEDGER_RETENTION_DAYS", "")
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "86400"))
+RETENTION_REPORTS = int(os.getenv("RETENTION_REPORTS", "50"))
+
+# Arbitrary key for pg_advisory_lock so only one app process applies the
+# retention policies at a time.
+RETENTION_LOCK_ID = 7310215
+EPOCH = datetime.date(1970, 1, 1)
+PARTITION_PATTERN = re.compile(r"^daily_data_(\d{4})_(\d{2})$")
+
+# rows: ledger entries or trips removed; partitions: whole months dropped;
+# batches: DELETE statements or InfluxDB delete calls issued.
+PurgeReport = namedtuple(
+    "PurgeReport", ["store", "start", "stop", "vehicles", "rows", "partitions", "batches", "seconds", "finished_at"]
+)
+
+_reports = deque(maxlen=RETENTION_REPORTS)
+_scheduler = None
+_edge_jobs = []
+_lock = threading.Lock()
+
+
+def _to_date(value):
+    return pd.Timestamp(value).date() if value is not None else None
+
+
+def _to_utc(value):
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return timestamp.to_pydatetime()
+
+
+def _record(report):
+    with _lock:
+        _reports.append(report)
+    print(
+        f"Purged {report.rows} {report.store} rows ({report.partitions} partitions, {report.batches} batches) "
+        f"in {report.seconds:.2f}s"
+    )
+    return report
+
+
+def retention_reports():
+    with _lock:
+        return [report._asdict() for report in reversed(_reports)]
+
+
+def _ledger_partitions(conn):
+    # Monthly partitions created by ensure_daily_data_partition, with their
+    # [start, stop) bounds read back from the naming scheme.
+    with conn.cursor() as cur:
+        cur.execute(
+            """SELECT c.relname FROM pg_inherits i
+               JOIN pg_class c ON c.oid = i.inhrelid
+               WHERE i.inhparent = 'daily_data'::regclass"""
+        )
+        names = [row[0] for row in cur.fetchall()]
+    partitions = []
+    for name in names:
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            month_start = datetime.date(int(match.group(1)), int(match.group(2)), 1)
+            partitions.append((name, month_start, (pd.Timestamp(month_start) + pd.offsets.MonthBegin(1)).date()))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+@contextmanager
+def _transaction(db_manager, conn=None):
+    # One transaction on conn when the caller passes one (the scheduler's,
+    # which holds the advisory lock), otherwise on a pooled connection; None
+    # when the database can't be reached.
+    if conn is None:
+        with db_manager.connection() as pooled:
+            yield pooled
+        return
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _drop_partition(db_manager, name, conn=None):
+    # Dropping needs a brief exclusive lock on daily_data; if a long query
+    # holds it, give up after the lock timeout and delete in batches instead
+    # of queueing every other query behind the drop.
+    try:
+        with _transaction(db_manager, conn) as conn:
+            if conn is None:
+                return None
+            with conn.cursor() as cur:
+                cur.execute("SET LOCAL lock_timeout = %s", (RETENTION_LOCK_TIMEOUT,))
+                cur.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(name)))
+                rows = cur.fetchone()[0]
+                cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+        return rows
+    except psycopg2.errors.LockNotAvailable:
+        print(f"Could not lock {name} for dropping; deleting its rows in batches")
+        return None
+
+
+def purge_ledger(db_manager, start=None, stop=None, vehicles=None, batch_size=RETENTION_BATCH_SIZE,
+                 pause=RETENTION_BATCH_PAUSE, conn=None):
+    # Removes ledger entries dated in [start, stop), optionally for some
+    # vehicles only. Months entirely inside the range are dropped as whole
+    # partitions; the rest is deleted batch_size rows per transaction, each
+    # on its own pooled connection, so the app keeps getting connections and
+    # no long lock is held. Given conn, every transaction runs on it instead.
+    started = time.perf_counter()
+    start, stop = _to_date(start), _to_date(stop)
+    rows = partitions = batches = 0
+
+    if not vehicles:
+        with _transaction(db_manager, conn) as tx:
+            candidates = _ledger_partitions(tx) if tx is not None else []
+        for name, month_start, month_stop in candidates:
+            if (start is None or month_start >= start) and (stop is None or month_stop <= stop):
+                dropped = _drop_partition(db_manager, name, conn)
+                if dropped is not None:
+                    rows += dropped
+                    partitions += 1
+
+    conditions, params = [], []
+    if start is not None:
+        conditions.append(sql.SQL("date >= %s"))
+        params.append(start)
+    if stop is not None:
+        conditions.append(sql.SQL("date < %s"))
+        params.append(stop)
+    if vehicles:
+        conditions.append(sql.SQL("vehicle = ANY(%s)"))
+        params.append(list(vehicles))
+    query = sql.SQL(
+        """DELETE FROM daily_data WHERE (id, date) IN (
+               SELECT id, date FROM daily_data {where} LIMIT %s
+           )"""
+    ).format(where=sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""))
+
+    while True:
+        with _transaction(db_manager, conn) as tx:
+            if tx is None:
+                break
+            with tx.cursor() as cur:
+                cur.execute(query, params + [batch_size])
+                deleted = cur.rowcount
+        rows += deleted
+        batches += 1
+        if deleted < batch_size:
+            break
+        time.sleep(pause)
+
+    get_query_cache().invalidate("daily_data")
+    return _record(PurgeReport(
+        "ledger", start, stop, list(vehicles or []), rows, partitions, batches,
+        time.perf_counter() - started, datetime.datetime.now(datetime.timezone.utc)
+    ))
+
+
+def _trip_windows(db_manager, start, stop, step, vehicles):
+    # Only windows that hold trip points (of any field) are deleted, found
+    # by one pushed-down query.
+    query = trip_windows_query(vehicles=vehicles, stop=stop)
+    params = query_params(db_manager.influx_bucket, start, stop=stop, every=step, vehicles=vehicles)
+    df = to_frame(db_manager.influx_client.query_api().query_data_frame(query, params=params))
+    if df.empty or "_start" not in df.columns:
+        return []
+    return [
+        (max(window_start.to_pydatetime(), start), min(window_stop.to_pydatetime(), stop))
+        for window_start, window_stop in zip(pd.to_datetime(df["_start"], utc=True), pd.to_datetime(df["_stop"], utc=True))
+    ]
+
+
+def purge_trips(db_manager, start=None, stop=None, vehicles=None, step=RETENTION_TRIP_STEP,
+                pause=RETENTION_BATCH_PAUSE):
+    # Removes trips that started in [start, stop), one window of step at a
+    # time, so InfluxDB never has to rewrite years of shards in one request.
+    # Each window's trips are read before it is deleted, which gives the
+    # exact row count and lets the running aggregates subtract them.
+    from trip_metrics import TripMetrics
+
+    started = time.perf_counter()
+    start = _to_utc(start if start is not None else EPOCH)
+    stop = _to_utc(stop if stop is not None else datetime.date.today() + datetime.timedelta(days=1))
+    step = parse_duration(step).to_pytimedelta()
+
+    # Trips queued by any session must land before their windows are deleted.
+    db_manager.influx_writer.drain()
+    windows = _trip_windows(db_manager, start, stop, step, vehicles)
+    delete_api = db_manager.influx_client.delete_api()
+    purged = TripMetrics(path=None)
+    rows = batches = 0
+    for window_start, window_stop in windows:
+        for _, _, chunk in db_manager.iter_trip_chunks(window_start, window_stop, step=step, vehicles=vehicles):
+            rows += len(chunk)
+            purged.update(chunk)
+        for vehicle in vehicles or [None]:
+            delete_api.delete(window_start, window_stop, delete_predicate(TRIP_MEASUREMENT, vehicle),
+                              bucket=db_manager.influx_bucket, org=db_manager.influx_org)
+            batches += 1
+        time.sleep(pause)
+
+    if windows:
+        get_query_cache().invalidate("trips")
+        if db_manager.influx_rollups:
+            # Windows straddling the range boundaries are rebuilt from what
+            # is left of the raw trips.
+            first, last = windows[0][0], windows[-1][1]
+            delete_rollups(db_manager.influx_client, db_manager.influx_org, db_manager.influx_rollups,
+                           first, last, vehicles=vehicles)
+            db_manager.rollup_refresher.mark_range(first, last)
+        _forget_trips(db_manager, start, stop, vehicles, purged)
+
+    return _record(PurgeReport(
+        "trips", start, stop, list(vehicles or []), rows, 0, batches,
+        time.perf_counter() - started, datetime.datetime.now(datetime.timezone.utc)
+    ))
+
+
+def _forget_trips(db_manager, start, stop, vehicles, purged):
+    from ingest_cache import get_ingest_cache
+    from trip_metrics import get_trip_metrics
+
+    # Cached uploads with trips in the purged range may now be only partly
+    # in InfluxDB, so they are allowed to be replayed. The purged trips are
+    # subtracted from the running aggregates, which costs O(purged trips)
+    # rather than a re-read of all history.
+    get_ingest_cache().forget(start, stop, vehicles)
+    metrics = get_trip_metrics()
+    unknown = metrics.subtract(purged)
+    metrics.save()
+    if unknown:
+        # Vehicles that lost their first or last trip get the new one looked
+        # up in the background, off the request thread.
+        job = threading.Thread(target=_refresh_edges, args=(db_manager, metrics, unknown),
+                               name="trip-metrics-edges", daemon=True)
+        with _lock:
+            _edge_jobs[:] = [thread for thread in _edge_jobs if thread.is_alive()] + [job]
+        job.start()
+
+
+def _refresh_edges(db_manager, metrics, vehicles):
+    try:
+        edges = {vehicle: [None, None] for vehicle in vehicles}
+        for index, selector in enumerate(("first", "last")):
+            query = trip_edge_query(selector, vehicles=vehicles)
+            params = query_params(db_manager.influx_bucket, _to_utc(EPOCH), vehicles=vehicles)
+            df = to_frame(db_manager.influx_client.query_api().query_data_frame(query, params=params))
+            if df.empty or VEHICLE_TAG not in df.columns:
+                continue
+            for vehicle, timestamp in zip(df[VEHICLE_TAG], pd.to_datetime(df["_time"], utc=True)):
+                if vehicle in edges:
+                    edges[vehicle][index] = timestamp
+        metrics.set_edges({vehicle: tuple(times) for vehicle, times in edges.items()})
+        metrics.save()
+    except Exception as e:
+        print(f"Failed to refresh first/last trip times: {e}")
+
+
+def wait_for_metrics(timeout=None):
+    # Lets the CLI finish the background first/last trip lookups before exit.
+    with _lock:
+        jobs = list(_edge_jobs)
+    for job in jobs:
+        job.join(timeout)
+
+
+def retention_policies():
+    policies = {}
+    for store, days in (("trips", TRIP_RETENTION_DAYS), ("ledger", LEDGER_RETENTION_DAYS)):
+        if days.strip():
+            policies[store] = int(days)
+    return policies
+
+
+def apply_policies(db_manager, policies=None, today=None, conn=None):
+    # Everything older than each store's retention is purged; runs are
+    # idempotent, so a missed or repeated run only shifts when rows go.
+    # conn, when given, carries the ledger purge.
+    policies = retention_policies() if policies is None else policies
+    today = today or datetime.date.today()
+    reports = []
+    for store, days in policies.items():
+        cutoff = today - datetime.timedelta(days=days)
+        try:
+            if store == "trips":
+                reports.append(purge_trips(db_manager, stop=cutoff))
+            else:
+                reports.append(purge_ledger(db_manager, stop=cutoff, conn=conn))
+        except Exception as e:
+            print(f"Failed to apply {store} retention: {e}")
+    return reports
+
+
+class RetentionScheduler:
+    # Applies the retention policies every interval seconds from a daemon
+    # thread. The advisory lock keeps several app processes from purging the
+    # same rows at the same time.
+    def __init__(self, db_manager, interval=RETENTION_INTERVAL, policies=None):
+        self.db_manager = db_manager
+        self.interval = interval
+        self.policies = policies
+        self.closed = False
+        self.runs = 0
+        self.last_run = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def run_once(self):
+        # The advisory lock belongs to this connection's session, so the
+        # ledger purge runs on it too rather than checking out another one,
+        # which would deadlock a pool of one.
+        with self.db_manager.connection() as conn:
+            if conn is None:
+                return []
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (RETENTION_LOCK_ID,))
+                locked = cur.fetchone()[0]
+            if not locked:
+                return []
+            try:
+                reports = apply_policies(self.db_manager, self.policies, conn=conn)
+            finally:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (RETENTION_LOCK_ID,))
+        self.runs += 1
+        self.last_run = datetime.datetime.now(datetime.timezone.utc)
+        return reports
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._cond.wait_for(lambda: self.closed, timeout=self.interval):
+                    return
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Retention run failed: {e}")
+
+
+def get_retention_scheduler(db_manager):
+    # None when no retention policy is configured.
+    global _scheduler
+    if not retention_policies():
+        return None
+    with _lock:
+        if _scheduler is None or _scheduler.closed:
+            _scheduler = RetentionScheduler(db_manager)
+        return _scheduler
+
+
+@atexit.register
+def close_scheduler():
+    with _lock:
+        scheduler = _scheduler
+    if scheduler is not None:
+        scheduler.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Purge trips or ledger entries, or apply the retention policies.")
+    parser.add_argument("store", choices=["trips", "ledger", "policies"])
+    parser.add_argument("--start", default=None, help="First day to purge (default: the beginning)")
+    parser.add_argument("--stop", default=None, help="Day after the last one to purge (default: tomorrow)")
+    parser.add_argument("--vehicle", action="append", dest="vehicles", help="Only purge this vehicle (repeatable)")
+    args = parser.parse_args(argv)
+
+    from db_manager import DBManager
+
+    db_manager = DBManager(auto_migrate=False)
+    if args.store == "policies":
+        if not retention_policies():
+            print("No retention policies configured; set TRIP_RETENTION_DAYS and/or LEDGER_RETENTION_DAYS")
+            return 1
+        apply_policies(db_manager)
+    else:
+        purge = purge_trips if args.store == "trips" else purge_ledger
+        purge(db_manager, args.start, args.stop, vehicles=args.vehicles)
+    wait_for_metrics()
+    db_manager.close_influx_connection()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,262 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REVENUE_MODEL_DIR = os.getenv("REVENUE_MODEL_DIR", "models/revenue")
+REVENUE_CATEGORY = "Revenue"
+# Bumped whenever build_features changes, so an artifact is never applied to
+# features it wasn't trained on.
+FEATURE_VERSION = 1
+
+TRIP_FEATURES = ["Mileage (km)", "Driving Time (hours)", "Trips"]
+TIME_OF_DAY = [("Night", 0), ("Morning", 6), ("Afternoon", 12), ("Evening", 18)]
+# Night trips are implied by "Trips" minus the other parts of the day.
+PART_FEATURES = [f"{name} Trips" for name, _ in TIME_OF_DAY[1:]]
+WEEKDAYS = ["Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def daily_trip_features(trips):
+    # One row per vehicle and UTC day: distance, driving time, trip count and
+    # trips started in the morning, afternoon and evening.
+    columns = ["date", "vehicle"] + TRIP_FEATURES + PART_FEATURES
+    if trips is None or trips.empty:
+        return pd.DataFrame(columns=columns)
+
+    start = pd.to_datetime(trips["Start Time"], utc=True)
+    if "Trip Duration (hours)" in trips.columns:
+        hours = pd.to_numeric(trips["Trip Duration (hours)"], errors="coerce")
+    else:
+        hours = pd.to_timedelta(trips["Duration"], errors="coerce").dt.total_seconds() / 3600.0
+    part = np.searchsorted([hour for _, hour in TIME_OF_DAY], start.dt.hour.to_numpy(), side="right") - 1
+
+    frame = pd.DataFrame({
+        "date": start.dt.tz_localize(None).dt.normalize(),
+        "vehicle": trips["Vehicle Plate Number"].astype(str),
+        "Mileage (km)": pd.to_numeric(trips["Mileage (km)"], errors="coerce").fillna(0.0),
+        "Driving Time (hours)": hours.fillna(0.0),
+        "Trips": 1.0,
+    })
+    for index, (name, _) in enumerate(TIME_OF_DAY[1:], start=1):
+        frame[f"{name} Trips"] = (part == index).astype("float64")
+    return frame.groupby(["date", "vehicle"], as_index=False).sum()[columns]
+
+
+def revenue_rows(rows):
+    # Rows as returned by DBManager.get_daily_totals(freq="day").
+    df = pd.DataFrame(rows or [], columns=["date", "vehicle", "category", "amount"])
+    df = df[df["category"] == REVENUE_CATEGORY]
+    return pd.DataFrame({
+        "date": pd.to_datetime(df["date"]),
+        "vehicle": df["vehicle"].astype(str),
+        "revenue": df["amount"].astype("float64"),
+    })
+
+
+def join_training_frame(trip_features, revenue):
+    # Every recorded revenue day is a sample; days without trips get zeros.
+    frame = revenue.merge(trip_features, on=["date", "vehicle"], how="left")
+    feature_columns = [column for column in trip_features.columns if column not in ("date", "vehicle")]
+    frame[feature_columns] = frame[feature_columns].fillna(0.0)
+    return frame
+
+
+def feature_names(vehicles):
+    return (
+        ["Intercept"] + TRIP_FEATURES + PART_FEATURES
+        + WEEKDAYS + [f"Vehicle {vehicle}" for vehicle in vehicles]
+    )
+
+
+def build_features(frame, vehicles):
+    # Design matrix in feature_names order. Monday and unknown vehicles are
+    # the baseline absorbed by the intercept.
+    n = len(frame)
+    vehicle_index = {vehicle: index for index, vehicle in enumerate(vehicles)}
+    numeric = TRIP_FEATURES + PART_FEATURES
+
+    X = np.zeros((n, 1 + len(numeric) + len(WEEKDAYS) + len(vehicles)), dtype="float64")
+    X[:, 0] = 1.0
+    X[:, 1:1 + len(numeric)] = frame[numeric].to_numpy(dtype="float64")
+
+    rows = np.arange(n)
+    weekday = pd.to_datetime(frame["date"]).dt.weekday.to_numpy()
+    has_weekday = weekday > 0
+    X[rows[has_weekday], 1 + len(numeric) + weekday[has_weekday] - 1] = 1.0
+
+    offset = 1 + len(numeric) + len(WEEKDAYS)
+    codes = frame["vehicle"].map(vehicle_index).to_numpy(dtype="float64", na_value=np.nan)
+    known = ~np.isnan(codes)
+    X[rows[known], offset + codes[known].astype("int64")] = 1.0
+    return X
+
+
+class NormalEquations:
+    # Sufficient statistics for least squares, accumulated chunk by chunk so
+    # training memory depends on the feature count, not the history length.
+    def __init__(self, features):
+        self.xtx = np.zeros((features, features))
+        self.xty = np.zeros(features)
+        self.yty = 0.0
+        self.rows = 0
+
+    def add(self, X, y):
+        self.xtx += X.T @ X
+        self.xty += X.T @ y
+        self.yty += float(y @ y)
+        self.rows += len(y)
+
+    def solve(self, ridge=1e-3):
+        # Ridge scaled by each feature's own energy is scale-invariant; the
+        # intercept is left unpenalized.
+        penalty = ridge * np.diag(self.xtx).copy()
+        penalty[0] = 0.0
+        return np.linalg.lstsq(self.xtx + np.diag(penalty), self.xty, rcond=None)[0]
+
+    def rmse(self, coef):
+        if not self.rows:
+            return None
+        sse = self.yty - 2 * coef @ self.xty + coef @ self.xtx @ coef
+        return float(np.sqrt(max(sse, 0.0) / self.rows))
+
+
+def _is_holdout(dates, every=5):
+    # Deterministic split on the calendar day so a chunk boundary never
+    # changes which samples are held out.
+    return (pd.to_datetime(dates).to_numpy().astype("datetime64[D]").astype("int64") % every) == 0
+
+
+def train(db_manager, start, stop=None, step="30d", ridge=1e-3, directory=REVENUE_MODEL_DIR):
+    stop = pd.Timestamp(stop) if stop is not None else pd.Timestamp(datetime.date.today() + datetime.timedelta(days=1))
+    vehicles = sorted({vehicle[1] for vehicle in db_manager.list_vehicles() or []})
+    names = feature_names(vehicles)
+    train_stats, test_stats = NormalEquations(len(names)), NormalEquations(len(names))
+
+    started = time.perf_counter()
+    for window_start, window_stop, trips in db_manager.iter_trip_chunks(start, stop, step=step):
+        revenue = revenue_rows(db_manager.get_daily_totals(
+            freq="day",
+            start_date=window_start.date(),
+            end_date=(window_stop - pd.Timedelta(days=1)).date(),
+            categories=[REVENUE_CATEGORY]
+        ))
+        if revenue.empty:
+            continue
+        frame = join_training_frame(daily_trip_features(trips), revenue)
+        X, y = build_features(frame, vehicles), frame["revenue"].to_numpy(dtype="float64")
+        holdout = _is_holdout(frame["date"])
+        train_stats.add(X[~holdout], y[~holdout])
+        test_stats.add(X[holdout], y[holdout])
+
+    if not train_stats.rows:
+        raise ValueError("No revenue entries found in the training range")
+
+    coef = train_stats.solve(ridge)
+    metadata = {
+        "feature_version": FEATURE_VERSION,
+        "trained_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "start": str(pd.Timestamp(start).date()),
+        "stop": str(stop.date()),
+        "train_rows": train_stats.rows,
+        "test_rows": test_stats.rows,
+        "train_rmse": train_stats.rmse(coef),
+        "test_rmse": test_stats.rmse(coef),
+        "ridge": ridge,
+        "training_seconds": time.perf_counter() - started,
+    }
+    model = RevenueModel(coef, vehicles, metadata)
+    model.save(directory)
+    return model
+
+
+class RevenueModel:
+    def __init__(self, coef, vehicles, metadata, version=None):
+        self.coef = np.asarray(coef, dtype="float64")
+        self.vehicles = list(vehicles)
+        self.metadata = metadata
+        self.version = version
+
+    @property
+    def feature_names(self):
+        return feature_names(self.vehicles)
+
+    def predict(self, trip_features):
+        # trip_features as built by daily_trip_features; one matrix product
+        # scores every vehicle and day in the batch.
+        if trip_features.empty:
+            return pd.Series(dtype="float64")
+        return pd.Series(build_features(trip_features, self.vehicles) @ self.coef, index=trip_features.index)
+
+    def predict_trips(self, trips):
+        features = daily_trip_features(trips)
+        return features[["date", "vehicle"]].assign(**{"Predicted Revenue": self.predict(features)})
+
+    def save(self, directory=REVENUE_MODEL_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.version = self.version or datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        path = os.path.join(directory, f"revenue_model-{self.version}.npz")
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, coef=self.coef, vehicles=np.array(self.vehicles, dtype=str),
+                 metadata=np.array(json.dumps(self.metadata)))
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as artifact:
+            metadata = json.loads(str(artifact["metadata"]))
+            if metadata.get("feature_version") != FEATURE_VERSION:
+                raise ValueError(f"{path} was trained on feature version {metadata.get('feature_version')}")
+            version = os.path.basename(path)[len("revenue_model-"):-len(".npz")]
+            return cls(artifact["coef"], artifact["vehicles"].tolist(), metadata, version=version)
+
+
+def latest_artifact(directory=REVENUE_MODEL_DIR):
+    # Versions are UTC timestamps, so the newest sorts last.
+    paths = sorted(glob.glob(os.path.join(directory, "revenue_model-*.npz")))
+    return paths[-1] if paths else None
+
+
+def get_revenue_model():
+    # Loaded once per process; None until a model has been trained.
+    global _model
+    with _model_lock:
+        if _model is None:
+            path = latest_artifact()
+            if path is not None:
+                try:
+                    _model = RevenueModel.load(path)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Failed to load revenue model {path}: {e}")
+        return _model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the revenue model from trips and the daily ledger.")
+    parser.add_argument("--start", required=True, help="First day of training data (YYYY-MM-DD)")
+    parser.add_argument("--stop", default=None, help="Day after the last one (default: tomorrow)")
+    parser.add_argument("--step", default="30d", help="Trips read per chunk (default: 30d)")
+    parser.add_argument("--ridge", type=float, default=1e-3, help="Relative ridge penalty (default: 0.001)")
+    args = parser.parse_args(argv)
+
+    from db_manager import DBManager
+
+    model = train(DBManager(), args.start, args.stop, step=args.step, ridge=args.ridge)
+    print(json.dumps(dict(model.metadata, version=model.version), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
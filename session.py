@@ -8,7 +8,7 @@ load_dotenv()
 
 # Define roles and permissions
 roles_permissions = {
-    "admin": ["Cashflow Tracking", "GPS Reporting", "Analysis", "Management", "Reset"],
+    "admin": ["Cashflow Tracking", "GPS Reporting", "Analysis", "Management", "Reset", "Performance"],
     "manager": ["Cashflow Tracking", "GPS Reporting", "Analysis"],
     "user": ["Cashflow Tracking", "GPS Reporting"]
 }
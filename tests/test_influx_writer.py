@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from influx_writer import BatchWriter
+
+
+class FakeWriteApi:
+    def __init__(self, block=None):
+        self.block = block
+        self.records = []
+
+    def write(self, bucket, org, record, **options):
+        if self.block is not None:
+            self.block.wait(5)
+        self.records.extend(record)
+
+    def close(self):
+        pass
+
+
+class FakeClient:
+    def __init__(self, block=None):
+        self.api = FakeWriteApi(block)
+
+    def write_api(self, write_options=None):
+        return self.api
+
+
+@pytest.fixture
+def writers():
+    created = []
+
+    def make(client, **options):
+        writer = BatchWriter(client, "trips", "org", flush_interval=0.01, **options)
+        created.append(writer)
+        return writer
+
+    yield make
+    for writer in created:
+        writer.close()
+
+
+def test_failing_on_write_callback_does_not_stop_the_writer(writers):
+    def on_write(batch):
+        raise ValueError("callback broke")
+
+    client = FakeClient()
+    writer = writers(client, on_write=on_write)
+    writer.write(["m v=1 1"])
+    writer.flush(timeout=5)
+    writer.write(["m v=2 2"])
+    writer.flush(timeout=5)
+    assert client.api.records == ["m v=1 1", "m v=2 2"]
+    assert writer.stats()["written"] == 2
+
+
+def test_flush_reports_writes_that_do_not_finish(writers):
+    block = threading.Event()
+    writer = writers(FakeClient(block))
+    writer.write(["m v=1 1"])
+    with pytest.raises(TimeoutError):
+        writer.flush(timeout=0.1)
+    block.set()
+    writer.flush(timeout=5)
+
+
+def test_flush_waits_only_for_the_calling_threads_records(writers):
+    block = threading.Event()
+    writer = writers(FakeClient(block))
+    other = threading.Thread(target=writer.write, args=(["m v=1 1"],))
+    other.start()
+    other.join()
+    writer.flush(timeout=0.1)
+    with pytest.raises(TimeoutError):
+        writer.drain(timeout=0.1)
+    block.set()
+    writer.drain(timeout=5)
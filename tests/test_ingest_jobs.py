@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+import ingest_jobs
+from ingest_jobs import submit_ingest
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    # Replaces the real pipeline: counts runs and blocks until released.
+    calls = []
+    release = threading.Event()
+
+    def fake_ingest(db_manager, data, file_type, progress=None):
+        calls.append(data)
+        release.wait(5)
+        if data == b"bad":
+            raise ValueError("unreadable file")
+        return [{"rows": len(data)}], False
+
+    monkeypatch.setattr(ingest_jobs, "ingest_upload", fake_ingest)
+    monkeypatch.setattr(ingest_jobs, "_jobs", {})
+    return calls, release
+
+
+def wait(job):
+    for _ in range(500):
+        if job.done():
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def test_running_job_is_shared_by_every_upload_of_the_file(uploads):
+    calls, release = uploads
+    first = submit_ingest(None, b"trips", "csv", upload_id="a")
+    assert submit_ingest(None, b"trips", "csv", upload_id="b") is first
+    release.set()
+    wait(first)
+    assert len(calls) == 1
+
+
+def test_finished_job_only_answers_reruns_of_the_same_upload(uploads):
+    calls, release = uploads
+    release.set()
+    first = wait(submit_ingest(None, b"trips", "csv", upload_id="a"))
+    assert first.status == "done"
+
+    assert submit_ingest(None, b"trips", "csv", upload_id="a") is first
+    again = wait(submit_ingest(None, b"trips", "csv", upload_id="b"))
+    assert again is not first and again.status == "done"
+    assert wait(submit_ingest(None, b"trips", "csv")) is not again
+    assert len(calls) == 3
+
+
+def test_failed_job_is_only_restarted_on_retry(uploads):
+    calls, release = uploads
+    release.set()
+    failed = wait(submit_ingest(None, b"bad", "csv", upload_id="a"))
+    assert failed.status == "failed" and isinstance(failed.error, ValueError)
+
+    assert submit_ingest(None, b"bad", "csv", upload_id="a") is failed
+    retried = wait(submit_ingest(None, b"bad", "csv", retry=True, upload_id="a"))
+    assert retried is not failed
+    assert len(calls) == 2
@@ -0,0 +1,126 @@
+import os
+
+import pandas as pd
+import pytest
+
+from ingest import ingest_upload
+from ingest_cache import IngestCache, file_digest, purged_mask
+from trip_metrics import TripMetrics, add_derived_fields
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example", "data.csv")
+
+
+class FakeWriter:
+    def flush(self):
+        pass
+
+
+class FakeDBManager:
+    # Records the trips ingest_upload writes instead of sending them to InfluxDB.
+    influx_writer = FakeWriter()
+
+    def __init__(self):
+        self.written = []
+
+    def write_trips(self, chunk):
+        self.written.append(chunk)
+        return len(chunk)
+
+    @property
+    def rows(self):
+        return sum(len(chunk) for chunk in self.written)
+
+
+@pytest.fixture
+def upload(tmp_path):
+    with open(EXAMPLE, "rb") as f:
+        data = f.read()
+    cache = IngestCache(str(tmp_path / "cache"))
+    metrics = TripMetrics(path=str(tmp_path / "metrics.pkl"))
+    db_manager = FakeDBManager()
+    ingest_upload(db_manager, data, "csv", cache=cache, metrics=metrics)
+    return data, cache, metrics, db_manager
+
+
+def trips_counted(metrics):
+    return int(metrics.summary()["Trips"].sum())
+
+
+def test_purges_outside_an_upload_keep_it_ingested(upload):
+    data, cache, metrics, _ = upload
+    key = file_digest(data)
+
+    assert cache.forget("2025-01-01", "2025-02-01") == 0
+    assert cache.forget("2024-11-01", "2024-12-01", vehicles=["KAA 000A"]) == 0
+    assert cache.is_ingested(key)
+    assert cache.purges(key) is None
+
+
+def test_replay_only_restores_purged_trips(upload):
+    data, cache, metrics, db_manager = upload
+    key = file_digest(data)
+    total = db_manager.rows
+    assert trips_counted(metrics) == total
+
+    assert cache.forget(pd.Timestamp("2024-11-01", tz="UTC"), pd.Timestamp("2024-11-15", tz="UTC"),
+                        vehicles=["KEF 231Y", "KFD 378S", "KXO 692N"]) == 1
+    assert not cache.is_ingested(key)
+
+    # What retention does after deleting: subtract the purged trips.
+    trips = cache.get(key)
+    deleted = purged_mask(trips, cache.purges(key))
+    assert 0 < deleted.sum() < total
+    purged = TripMetrics(path=None)
+    purged.update(add_derived_fields(trips[deleted]))
+    metrics.subtract(purged)
+    assert trips_counted(metrics) == total - deleted.sum()
+
+    replay = FakeDBManager()
+    preview, duplicate = ingest_upload(replay, data, "csv", cache=cache, metrics=metrics)
+    assert not duplicate
+    assert len(preview) == total
+    assert replay.rows == deleted.sum()
+    assert trips_counted(metrics) == total
+    assert cache.is_ingested(key) and cache.purges(key) is None
+
+    again = FakeDBManager()
+    assert ingest_upload(again, data, "csv", cache=cache, metrics=metrics)[1]
+    assert again.rows == 0
+    assert trips_counted(metrics) == total
+
+
+def test_purges_accumulate_until_the_upload_is_replayed(upload):
+    data, cache, metrics, _ = upload
+    key = file_digest(data)
+
+    cache.forget("2024-11-01", "2024-11-10")
+    cache.forget("2024-11-20", "2024-12-01")
+    assert [purge["start"][:10] for purge in cache.purges(key)] == ["2024-11-01", "2024-11-20"]
+
+
+class FailingDBManager(FakeDBManager):
+    # Fails the upload after the first chunk has been written.
+    def write_trips(self, chunk):
+        if self.written:
+            raise ConnectionError("influxdb unreachable")
+        return super().write_trips(chunk)
+
+
+def test_failed_upload_is_not_counted_until_a_retry_completes(tmp_path, monkeypatch):
+    import ingest
+
+    monkeypatch.setattr(ingest, "CSV_CHUNK_SIZE", 4)
+    with open(EXAMPLE, "rb") as f:
+        data = f.read()
+    cache = IngestCache(str(tmp_path / "cache"))
+    metrics = TripMetrics(path=str(tmp_path / "metrics.pkl"))
+
+    with pytest.raises(ConnectionError):
+        ingest_upload(FailingDBManager(), data, "csv", cache=cache, metrics=metrics)
+    assert metrics.summary().empty
+
+    db_manager = FakeDBManager()
+    preview, duplicate = ingest_upload(db_manager, data, "csv", cache=cache, metrics=metrics)
+    assert not duplicate
+    assert trips_counted(metrics) == db_manager.rows
+    assert len(preview) == 4 < db_manager.rows
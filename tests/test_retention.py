@@ -0,0 +1,108 @@
+import pandas as pd
+import pytest
+
+import ingest_cache
+import retention
+import trip_metrics
+from retention import purge_trips, wait_for_metrics
+from trip_metrics import TripMetrics
+
+TRIPS = pd.DataFrame({
+    "Vehicle Plate Number": ["KAA 001A", "KAA 001A", "KAA 001A", "KAA 002B"],
+    "Start Time": pd.to_datetime(["2024-01-01 08:00", "2024-01-03 08:00", "2024-01-20 08:00", "2024-01-02 09:00"],
+                                 utc=True),
+    "Duration": pd.to_timedelta(["1h", "2h", "1h", "30min"]),
+    # The second trip has no mileage, like trips whose odometer was not read.
+    "Mileage (km)": [40.0, None, 60.0, 10.0],
+    "Fuel (l)": [4.0, None, 5.0, 1.0],
+})
+
+
+class FakeQueryApi:
+    # Answers the window and first/last trip queries from the trips left in
+    # the fake store.
+    def __init__(self, store):
+        self.store = store
+
+    def query_data_frame(self, query, params=None):
+        start, stop = params["start"], params.get("stop", pd.Timestamp.max.tz_localize("UTC"))
+        trips = self.store.trips
+        trips = trips[(trips["Start Time"] >= start) & (trips["Start Time"] < stop)]
+        if "window(" in query:
+            every = pd.Timedelta(params["every"])
+            starts = sorted(set(trips["Start Time"].dt.floor(every)))
+            return pd.DataFrame({"_start": starts, "_stop": [s + every for s in starts]})
+        times = trips.groupby("Vehicle Plate Number")["Start Time"]
+        times = times.min() if "first(" in query else times.max()
+        return pd.DataFrame({"Vehicle Plate Number": times.index, "_time": times.values})
+
+
+class FakeDeleteApi:
+    def __init__(self, store):
+        self.store = store
+
+    def delete(self, start, stop, predicate, bucket=None, org=None):
+        trips = self.store.trips
+        self.store.trips = trips[(trips["Start Time"] < start) | (trips["Start Time"] >= stop)]
+
+
+class FakeStore:
+    influx_bucket = "trips"
+    influx_org = "org"
+    influx_rollups = []
+
+    def __init__(self, trips):
+        self.trips = trips
+        self.influx_client = self
+        self.influx_writer = self
+
+    def drain(self):
+        pass
+
+    def query_api(self):
+        return FakeQueryApi(self)
+
+    def delete_api(self):
+        return FakeDeleteApi(self)
+
+    def iter_trip_chunks(self, start, stop, step="30d", vehicles=None):
+        trips = self.trips
+        yield start, stop, trips[(trips["Start Time"] >= start) & (trips["Start Time"] < stop)]
+
+
+@pytest.fixture
+def metrics(tmp_path, monkeypatch):
+    metrics = TripMetrics(path=str(tmp_path / "metrics.pkl"))
+    metrics.update(TRIPS)
+    monkeypatch.setattr(trip_metrics, "get_trip_metrics", lambda: metrics)
+    monkeypatch.setattr(ingest_cache, "get_ingest_cache",
+                        lambda: ingest_cache.IngestCache(str(tmp_path / "cache")))
+    return metrics
+
+
+def summary(metrics):
+    return metrics.summary().set_index("Vehicle Plate Number")
+
+
+def test_purge_deletes_trips_without_mileage_and_counts_them(metrics):
+    store = FakeStore(TRIPS)
+    report = purge_trips(store, "2024-01-01", "2024-01-05", step="1d", pause=0)
+    wait_for_metrics(5)
+
+    assert report.rows == 3
+    assert list(store.trips["Start Time"].dt.day) == [20]
+    row = summary(metrics).loc["KAA 001A"]
+    assert row["Trips"] == 1 and row["Mileage (km)"] == 60.0
+    assert row["First Trip"] == row["Last Trip"] == pd.Timestamp("2024-01-20 08:00")
+    assert "KAA 002B" not in summary(metrics).index
+
+
+def test_subtract_matches_aggregates_of_the_remaining_trips():
+    metrics, purged, remaining = TripMetrics(path=None), TripMetrics(path=None), TripMetrics(path=None)
+    metrics.update(TRIPS)
+    purged.update(TRIPS.iloc[[0, 3]])
+    remaining.update(TRIPS.iloc[[1, 2]])
+
+    assert metrics.subtract(purged) == ["KAA 001A"]
+    metrics.set_edges({"KAA 001A": (pd.Timestamp("2024-01-03 08:00", tz="UTC"), None)})
+    pd.testing.assert_frame_equal(metrics.summary(), remaining.summary())
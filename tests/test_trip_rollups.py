@@ -0,0 +1,177 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from constants import TRIP_MEASUREMENT, TRIP_ROLLUP_MEASUREMENT
+from db_manager import DBManager
+from query_cache import get_query_cache
+from trip_rollups import REFRESH_QUERY, RollupRefresher, _ranges, batch_windows, choose_rollup, parse_rollups
+
+DAY_NS = pd.Timedelta(days=1).value
+HOUR_NS = pd.Timedelta(hours=1).value
+
+
+class FakeQueryApi:
+    # Stands in for the InfluxDB query API: records every query and answers
+    # query_data_frame with an empty result, or raises when told to fail.
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.queries = []
+
+    def query(self, query, org=None, params=None):
+        if self.fail:
+            raise ConnectionError("influxdb unreachable")
+        self.queries.append((query, org, params))
+
+    def query_data_frame(self, query, params=None):
+        self.queries.append((query, None, params))
+        return pd.DataFrame()
+
+
+class FakeClient:
+    def __init__(self, fail=False):
+        self.api = FakeQueryApi(fail)
+
+    def query_api(self):
+        return self.api
+
+
+@pytest.fixture
+def refresher_factory():
+    refreshers = []
+
+    def make(client=None, rollups="1h,1d", **options):
+        options.setdefault("refresh_interval", 60)
+        refresher = RollupRefresher(client or FakeClient(), "trips", "org", parse_rollups(rollups, "trips"), **options)
+        refreshers.append(refresher)
+        return refresher
+
+    yield make
+    for refresher in refreshers:
+        refresher.close()
+
+
+def test_parse_rollups_sorts_and_names_buckets():
+    rollups = parse_rollups(" 1d, 1h ,", "trips")
+    assert [rollup.bucket for rollup in rollups] == ["trips_1h", "trips_1d"]
+    assert [rollup.every_ns for rollup in rollups] == [HOUR_NS, DAY_NS]
+    assert parse_rollups("", "trips") == []
+
+
+def test_parse_rollups_rejects_intervals_that_do_not_nest():
+    with pytest.raises(ValueError):
+        parse_rollups("1h,90m", "trips")
+
+
+@pytest.mark.parametrize("every, bucket", [
+    ("1h", "trips_1h"),
+    ("3h", "trips_1h"),
+    ("1d", "trips_1d"),
+    ("7d", "trips_1d"),
+    ("30m", None),
+    ("90m", None),
+])
+def test_choose_rollup_picks_coarsest_tiling_rollup(every, bucket):
+    rollup = choose_rollup(parse_rollups("1h,1d", "trips"), every)
+    assert (rollup.bucket if rollup is not None else None) == bucket
+
+
+def test_choose_rollup_without_rollups():
+    assert choose_rollup([], "1d") is None
+
+
+def test_batch_windows_reads_timestamps_off_line_protocol():
+    lines = [
+        f"trip_data,Vehicle\\ Plate\\ Number=KAA1 Mileage\\ (km)=1.5 {DAY_NS + 5}",
+        f"trip_data,Vehicle\\ Plate\\ Number=KAA1 Mileage\\ (km)=2.0 {DAY_NS + HOUR_NS}".encode(),
+        f"trip_data,Vehicle\\ Plate\\ Number=KAA2 Mileage\\ (km)=3.0 {3 * DAY_NS}",
+        "trip_data Mileage\\ (km)=1.0",
+    ]
+    assert batch_windows(lines, DAY_NS) == {1, 3}
+    assert batch_windows(lines, HOUR_NS) == {24, 25, 72}
+
+
+def test_ranges_coalesce_contiguous_windows_up_to_the_step():
+    assert _ranges({0, 1, 3}, DAY_NS, 30 * DAY_NS) == [[0, 2 * DAY_NS], [3 * DAY_NS, 4 * DAY_NS]]
+    assert _ranges({2, 0, 1, 3, 4}, DAY_NS, 2 * DAY_NS) == [
+        [0, 2 * DAY_NS], [2 * DAY_NS, 4 * DAY_NS], [4 * DAY_NS, 5 * DAY_NS]
+    ]
+    assert _ranges(set(), DAY_NS, DAY_NS) == []
+
+
+def test_mark_batch_and_mark_range_coalesce_pending_windows(refresher_factory):
+    refresher = refresher_factory()
+    assert refresher.unit_ns == DAY_NS
+
+    refresher.mark_batch([f"trip_data v=1 {DAY_NS + 1}", f"trip_data v=1 {DAY_NS + 2 * HOUR_NS}"])
+    refresher.mark_batch([])
+    assert refresher.stats()["pending_windows"] == 1
+
+    start = pd.Timestamp(3 * DAY_NS, tz="UTC")
+    refresher.mark_range(start, start + pd.Timedelta(days=1, hours=1))
+    assert refresher._pending == {1, 3, 4}
+
+
+def test_flush_refreshes_every_rollup_for_each_coalesced_range(refresher_factory):
+    client = FakeClient()
+    refreshed = []
+    refresher = refresher_factory(client, refresh_step="30d", on_refresh=lambda: refreshed.append(True))
+    refresher.mark_windows({0, 1, 3})
+    refresher.flush()
+
+    queries = client.api.queries
+    assert [query for query, _, _ in queries] == [REFRESH_QUERY] * 4
+    assert all(org == "org" for _, org, _ in queries)
+    params = [params for _, _, params in queries]
+    assert [(p["bucket"], p["every"]) for p in params] == [
+        ("trips_1h", datetime.timedelta(hours=1)), ("trips_1d", datetime.timedelta(days=1)),
+    ] * 2
+    assert [(p["start"], p["stop"]) for p in params[::2]] == [
+        (pd.Timestamp(0, tz="UTC"), pd.Timestamp(2 * DAY_NS, tz="UTC")),
+        (pd.Timestamp(3 * DAY_NS, tz="UTC"), pd.Timestamp(4 * DAY_NS, tz="UTC")),
+    ]
+    assert all(p["source"] == "trips" and p["measurement"] == TRIP_MEASUREMENT
+               and p["rollup_measurement"] == TRIP_ROLLUP_MEASUREMENT for p in params)
+    assert refreshed == [True]
+    stats = refresher.stats()
+    assert stats["pending_windows"] == 0 and stats["refreshes"] == 1 and stats["failures"] == 0
+
+
+def test_failed_refresh_keeps_windows_pending(refresher_factory):
+    refresher = refresher_factory(FakeClient(fail=True), refresh_interval=0.05)
+    refresher.mark_windows({5})
+    refresher.flush()
+
+    stats = refresher.stats()
+    assert stats["failures"] >= 1
+    assert stats["refreshes"] == 0
+    assert "unreachable" in stats["last_error"]
+    with refresher._cond:
+        assert 5 in refresher._pending or refresher._busy
+
+
+@pytest.fixture
+def db_manager(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(DBManager, "influx_client", property(lambda self: client))
+    manager = DBManager(auto_migrate=False)
+    manager.influx_bucket = "trips"
+    manager.influx_rollups = parse_rollups("1h,1d", "trips")
+    get_query_cache().clear()
+    yield manager
+    get_query_cache().clear()
+
+
+@pytest.mark.parametrize("every, bucket, measurement", [
+    ("7d", "trips_1d", TRIP_ROLLUP_MEASUREMENT),
+    ("2h", "trips_1h", TRIP_ROLLUP_MEASUREMENT),
+    ("30m", "trips", TRIP_MEASUREMENT),
+])
+def test_get_trip_stats_reads_from_the_chosen_rollup(db_manager, every, bucket, measurement):
+    df = db_manager.get_trip_stats(start="-30d", every=every)
+
+    (_, _, params), = db_manager.influx_client.query_api().queries
+    assert params["bucket"] == bucket
+    assert params["measurement"] == measurement
+    assert list(df.columns) == ["Trip Count", "Mileage (km)"]
@@ -0,0 +1,318 @@
+import math
+import os
+import pickle
+import threading
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from trip_ingest import parse_times
+
+load_dotenv()
+
+TRIP_METRICS_PATH = os.getenv(
+    "TRIP_METRICS_PATH", os.path.join(os.getenv("INGEST_CACHE_DIR", ".cache/ingest"), "trip_metrics.pickle")
+)
+SKETCH_ACCURACY = float(os.getenv("TRIP_METRICS_SKETCH_ACCURACY", "0.01"))
+
+DERIVED_COLUMNS = ["Trip Duration (hours)", "Average Speed (km/h)", "Fuel Consumption (km/l)"]
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = numerator / denominator
+    return values.where(np.isfinite(values))
+
+
+def add_derived_fields(df):
+    # Computed once when trips are ingested; frames that already carry the
+    # derived columns (from the cache or InfluxDB) are returned untouched.
+    if all(column in df.columns for column in DERIVED_COLUMNS):
+        return df
+
+    df = df.copy()
+    for column in ("Start Time", "End Time"):
+        if column in df.columns:
+            df[column] = parse_times(df[column])
+    if "Duration" in df.columns and not pd.api.types.is_timedelta64_dtype(df["Duration"]):
+        df["Duration"] = pd.to_timedelta(df["Duration"], errors="coerce")
+
+    mileage = pd.to_numeric(df["Mileage (km)"], errors="coerce") if "Mileage (km)" in df.columns else None
+    if "Duration" in df.columns:
+        df["Trip Duration (hours)"] = df["Duration"].dt.total_seconds() / 3600.0
+    else:
+        df["Trip Duration (hours)"] = np.nan
+    df["Average Speed (km/h)"] = _ratio(mileage, df["Trip Duration (hours)"]) if mileage is not None else np.nan
+    if mileage is not None and "Fuel (l)" in df.columns:
+        df["Fuel Consumption (km/l)"] = _ratio(mileage, pd.to_numeric(df["Fuel (l)"], errors="coerce"))
+    else:
+        df["Fuel Consumption (km/l)"] = np.nan
+    return df
+
+
+def _naive_utc(value):
+    # Uploads carry naive times and InfluxDB returns UTC ones; both are kept
+    # naive UTC so they compare.
+    if pd.notna(value) and value.tzinfo is not None:
+        return value.tz_convert("UTC").tz_localize(None)
+    return value
+
+
+class QuantileSketch:
+    # Log-bucketed quantile sketch: every quantile is within
+    # relative_accuracy of the true value, and two sketches merge by adding
+    # bucket counts, so per-batch sketches combine into running ones.
+    def __init__(self, relative_accuracy=SKETCH_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, values):
+        values = np.asarray(values, dtype="float64")
+        values = values[np.isfinite(values) & (values >= 0)]
+        if not values.size:
+            return
+        positive = values[values > 0]
+        self.zeros += int(values.size - positive.size)
+        self.count += int(values.size)
+        indexes, counts = np.unique(np.ceil(np.log(positive) / self._log_gamma).astype("int64"), return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def subtract(self, other):
+        # Exact for values that were added to this sketch: they land in the
+        # same buckets.
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot subtract sketches with different accuracy")
+        for index, count in other.buckets.items():
+            remaining = self.buckets.get(index, 0) - count
+            if remaining > 0:
+                self.buckets[index] = remaining
+            else:
+                self.buckets.pop(index, None)
+        self.zeros = max(self.zeros - other.zeros, 0)
+        self.count = max(self.count - other.count, 0)
+
+    def quantile(self, q):
+        if not self.count:
+            return np.nan
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class VehicleAggregate:
+    def __init__(self):
+        self.trips = 0
+        self.mileage = 0.0
+        self.hours = 0.0
+        self.fuel = 0.0
+        self.fueled_mileage = 0.0
+        self.first_trip = None
+        self.last_trip = None
+        self.speed = QuantileSketch()
+        self.trip_mileage = QuantileSketch()
+
+    def update(self, rows):
+        mileage = rows["Mileage (km)"]
+        hours = rows["Trip Duration (hours)"]
+        if "Fuel (l)" in rows.columns:
+            fuel = pd.to_numeric(rows["Fuel (l)"], errors="coerce")
+        else:
+            fuel = pd.Series(np.nan, index=rows.index)
+        fueled = fuel.notna() & (fuel > 0)
+
+        self.trips += len(rows)
+        self.mileage += float(mileage.sum())
+        self.hours += float(hours[mileage.notna()].sum())
+        self.fuel += float(fuel[fueled].sum())
+        self.fueled_mileage += float(mileage[fueled].sum())
+        if "Start Time" in rows.columns:
+            first, last = _naive_utc(rows["Start Time"].min()), _naive_utc(rows["Start Time"].max())
+            if pd.notna(first):
+                self.first_trip = first if self.first_trip is None else min(self.first_trip, first)
+                self.last_trip = last if self.last_trip is None else max(self.last_trip, last)
+        self.speed.add(rows["Average Speed (km/h)"])
+        self.trip_mileage.add(mileage)
+
+    def merge(self, other):
+        self.trips += other.trips
+        self.mileage += other.mileage
+        self.hours += other.hours
+        self.fuel += other.fuel
+        self.fueled_mileage += other.fueled_mileage
+        for attribute, pick in (("first_trip", min), ("last_trip", max)):
+            mine, theirs = getattr(self, attribute), getattr(other, attribute)
+            if theirs is not None:
+                setattr(self, attribute, theirs if mine is None else pick(mine, theirs))
+        self.speed.merge(other.speed)
+        self.trip_mileage.merge(other.trip_mileage)
+
+    def subtract(self, other):
+        # Removes trips that were counted here. First/last trip times that
+        # fell among them become unknown (None) until set_edges fills them in.
+        self.trips = max(self.trips - other.trips, 0)
+        self.mileage -= other.mileage
+        self.hours -= other.hours
+        self.fuel -= other.fuel
+        self.fueled_mileage -= other.fueled_mileage
+        if other.first_trip is not None:
+            if self.first_trip is not None and other.first_trip <= self.first_trip <= other.last_trip:
+                self.first_trip = None
+            if self.last_trip is not None and other.first_trip <= self.last_trip <= other.last_trip:
+                self.last_trip = None
+        self.speed.subtract(other.speed)
+        self.trip_mileage.subtract(other.trip_mileage)
+
+    def row(self):
+        return {
+            "Trips": self.trips,
+            "Mileage (km)": self.mileage,
+            "Driving Time (hours)": self.hours,
+            "Average Speed (km/h)": self.mileage / self.hours if self.hours else np.nan,
+            "Median Speed (km/h)": self.speed.quantile(0.5),
+            "P95 Speed (km/h)": self.speed.quantile(0.95),
+            "Median Trip (km)": self.trip_mileage.quantile(0.5),
+            "Fuel Consumption (km/l)": self.fueled_mileage / self.fuel if self.fuel else np.nan,
+            "First Trip": self.first_trip,
+            "Last Trip": self.last_trip,
+        }
+
+
+class TripMetrics:
+    # Per-vehicle running aggregates; each batch costs O(rows in the batch)
+    # and a summary costs O(vehicles), however much history came before.
+    def __init__(self, path=TRIP_METRICS_PATH):
+        self.path = path
+        self.vehicles = {}
+        self._lock = threading.Lock()
+
+    def update(self, df):
+        df = add_derived_fields(df)
+        if df.empty or "Vehicle Plate Number" not in df.columns:
+            return 0
+        df = df.assign(**{"Mileage (km)": pd.to_numeric(df["Mileage (km)"], errors="coerce")})
+        with self._lock:
+            for vehicle, rows in df.groupby("Vehicle Plate Number", sort=False):
+                aggregate = self.vehicles.get(vehicle)
+                if aggregate is None:
+                    aggregate = self.vehicles[vehicle] = VehicleAggregate()
+                aggregate.update(rows)
+        return len(df)
+
+    def merge(self, other):
+        # Folds in aggregates built separately, e.g. one upload's trips once
+        # the whole upload has been written.
+        with other._lock:
+            vehicles = list(other.vehicles.items())
+        with self._lock:
+            for vehicle, aggregate in vehicles:
+                mine = self.vehicles.get(vehicle)
+                if mine is None:
+                    mine = self.vehicles[vehicle] = VehicleAggregate()
+                mine.merge(aggregate)
+
+    def subtract(self, other):
+        # Takes purged trips back out under the lock, so concurrent merges
+        # are never lost. Returns the vehicles whose first or last trip time
+        # was purged and has to be looked up again.
+        with other._lock:
+            vehicles = list(other.vehicles.items())
+        unknown = []
+        with self._lock:
+            for vehicle, aggregate in vehicles:
+                mine = self.vehicles.get(vehicle)
+                if mine is None:
+                    continue
+                mine.subtract(aggregate)
+                if mine.trips == 0:
+                    del self.vehicles[vehicle]
+                elif mine.first_trip is None or mine.last_trip is None:
+                    unknown.append(vehicle)
+        return unknown
+
+    def set_edges(self, edges):
+        # edges maps vehicle -> (first, last) trip times read back from the
+        # store; known times are only ever widened.
+        with self._lock:
+            for vehicle, (first, last) in edges.items():
+                aggregate = self.vehicles.get(vehicle)
+                if aggregate is None:
+                    continue
+                first, last = _naive_utc(first), _naive_utc(last)
+                if first is not None and pd.notna(first):
+                    aggregate.first_trip = first if aggregate.first_trip is None else min(aggregate.first_trip, first)
+                if last is not None and pd.notna(last):
+                    aggregate.last_trip = last if aggregate.last_trip is None else max(aggregate.last_trip, last)
+
+    def summary(self):
+        with self._lock:
+            rows = [dict(aggregate.row(), **{"Vehicle Plate Number": vehicle})
+                    for vehicle, aggregate in self.vehicles.items()]
+        if not rows:
+            return pd.DataFrame()
+        df = pd.DataFrame(rows).sort_values("Vehicle Plate Number", ignore_index=True)
+        return df[["Vehicle Plate Number"] + [column for column in df.columns if column != "Vehicle Plate Number"]]
+
+    def reset(self):
+        with self._lock:
+            self.vehicles = {}
+
+    def rebuild(self, chunks):
+        # Built aside and swapped in under the lock, so summaries never see a
+        # half-built state.
+        rebuilt = TripMetrics(path=None)
+        for chunk in chunks:
+            rebuilt.update(chunk)
+        with self._lock:
+            self.vehicles = rebuilt.vehicles
+        self.save()
+
+    def save(self):
+        with self._lock:
+            state = pickle.dumps(self.vehicles)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(state)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                vehicles = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Discarding unreadable trip metrics: {e}")
+            return
+        with self._lock:
+            self.vehicles = vehicles
+
+
+def get_trip_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = TripMetrics()
+            _metrics.load()
+        return _metrics
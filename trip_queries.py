@@ -0,0 +1,149 @@
+import datetime
+
+import pandas as pd
+from constants import TRIP_MEASUREMENT
+
+VEHICLE_TAG = "Vehicle Plate Number"
+
+
+def parse_duration(value):
+    # Flux-style durations ("30d", "1h"); pandas wants the day unit upper-case.
+    return pd.Timedelta(value.replace("d", "D") if isinstance(value, str) else value)
+
+
+def to_flux_time(value):
+    # Relative offsets ("-30d", timedelta) and absolute dates/datetimes are
+    # passed as typed query parameters rather than spliced into the Flux text.
+    if value is None or isinstance(value, (datetime.datetime, datetime.timedelta)):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time(), tzinfo=datetime.timezone.utc)
+    if isinstance(value, str):
+        return parse_duration(value).to_pytimedelta()
+    raise TypeError(f"Unsupported Flux time value: {value!r}")
+
+
+def to_flux_duration(value):
+    return parse_duration(value).to_pytimedelta() if isinstance(value, str) else value
+
+
+def _source(bucket_param="bucket", vehicles=None, stop=None):
+    flux = (
+        f"from(bucket: params.{bucket_param})\n"
+        f"  |> range(start: params.start{', stop: params.stop' if stop is not None else ''})\n"
+        "  |> filter(fn: (r) => r._measurement == params.measurement)\n"
+    )
+    if vehicles:
+        flux += f'  |> filter(fn: (r) => contains(value: r["{VEHICLE_TAG}"], set: params.vehicles))\n'
+    return flux
+
+
+def delete_predicate(measurement, vehicle=None):
+    # The delete API takes AND-ed equalities only (no OR, no sets), so a
+    # purge scoped to several vehicles deletes one vehicle per call.
+    predicate = f'_measurement="{measurement}"'
+    if vehicle is not None:
+        value = str(vehicle).replace("\\", "\\\\").replace('"', '\\"')
+        predicate += f' AND "{VEHICLE_TAG}"="{value}"'
+    return predicate
+
+
+def trip_stats_query(vehicles=None, stop=None, group_by_vehicle=False, rollup=False):
+    if rollup:
+        return rollup_stats_query(vehicles=vehicles, stop=stop, group_by_vehicle=group_by_vehicle)
+    group = f'group(columns: ["{VEHICLE_TAG}"])' if group_by_vehicle else "group()"
+    row_key = f'["_time", "{VEHICLE_TAG}"]' if group_by_vehicle else '["_time"]'
+    return (
+        "data = " + _source(vehicles=vehicles, stop=stop)
+        + '  |> filter(fn: (r) => r._field == "Mileage (km)")\n'
+        + f"  |> {group}\n"
+        + "mileage = data\n"
+        + '  |> aggregateWindow(every: params.every, fn: sum, createEmpty: false, timeSrc: "_start")\n'
+        + '  |> set(key: "_field", value: "Mileage (km)")\n'
+        + "trips = data\n"
+        + '  |> aggregateWindow(every: params.every, fn: count, createEmpty: false, timeSrc: "_start")\n'
+        + "  |> toFloat()\n"
+        + '  |> set(key: "_field", value: "Trip Count")\n'
+        + "union(tables: [mileage, trips])\n"
+        + f'  |> pivot(rowKey: {row_key}, columnKey: ["_field"], valueColumn: "_value")\n'
+        + "  |> group()\n"
+        + f'  |> keep(columns: ["_time", "{VEHICLE_TAG}", "Trip Count", "Mileage (km)"])\n'
+        + '  |> sort(columns: ["_time"])\n'
+    )
+
+
+def rollup_stats_query(vehicles=None, stop=None, group_by_vehicle=False):
+    # Rollup buckets already hold per-window trip counts and sums, so both
+    # fields are simply summed up to the requested interval.
+    group = f'["_field", "{VEHICLE_TAG}"]' if group_by_vehicle else '["_field"]'
+    row_key = f'["_time", "{VEHICLE_TAG}"]' if group_by_vehicle else '["_time"]'
+    return (
+        _source(vehicles=vehicles, stop=stop)
+        + '  |> filter(fn: (r) => r._field == "Mileage (km)" or r._field == "Trip Count")\n'
+        + f"  |> group(columns: {group})\n"
+        + '  |> aggregateWindow(every: params.every, fn: sum, createEmpty: false, timeSrc: "_start")\n'
+        + f'  |> pivot(rowKey: {row_key}, columnKey: ["_field"], valueColumn: "_value")\n'
+        + "  |> group()\n"
+        + f'  |> keep(columns: ["_time", "{VEHICLE_TAG}", "Trip Count", "Mileage (km)"])\n'
+        + '  |> sort(columns: ["_time"])\n'
+    )
+
+
+def trip_windows_query(vehicles=None, stop=None):
+    # Windows of params.every that hold any trip point, whatever fields it
+    # carries; counts are field values, so only use them as "non-empty".
+    return (
+        _source(vehicles=vehicles, stop=stop)
+        + '  |> keep(columns: ["_time"])\n'
+        + "  |> group()\n"
+        + "  |> window(every: params.every, createEmpty: false)\n"
+        + '  |> count(column: "_time")\n'
+        + "  |> group()\n"
+        + '  |> keep(columns: ["_start", "_stop"])\n'
+        + '  |> sort(columns: ["_start"])\n'
+    )
+
+
+def trip_edge_query(selector, vehicles=None, stop=None):
+    # First or last trip time per vehicle: selector is "first" or "last",
+    # applied per stored series (already time-ordered) and then per vehicle.
+    return (
+        _source(vehicles=vehicles, stop=stop)
+        + f"  |> {selector}()\n"
+        + f'  |> keep(columns: ["_time", "{VEHICLE_TAG}"])\n'
+        + f'  |> group(columns: ["{VEHICLE_TAG}"])\n'
+        + '  |> sort(columns: ["_time"])\n'
+        + f'  |> {selector}(column: "_time")\n'
+        + "  |> group()\n"
+    )
+
+
+def trips_query(vehicles=None, stop=None):
+    return (
+        _source(vehicles=vehicles, stop=stop)
+        + '  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\n'
+        + "  |> group()\n"
+        + '  |> drop(columns: ["_start", "_stop", "_measurement"])\n'
+        + '  |> rename(columns: {_time: "Start Time"})\n'
+        + '  |> sort(columns: ["Start Time"])\n'
+    )
+
+
+def query_params(bucket, start, stop=None, every=None, vehicles=None, measurement=TRIP_MEASUREMENT):
+    params = {"bucket": bucket, "measurement": measurement, "start": to_flux_time(start)}
+    if stop is not None:
+        params["stop"] = to_flux_time(stop)
+    if every is not None:
+        params["every"] = to_flux_duration(every)
+    if vehicles:
+        params["vehicles"] = list(vehicles)
+    return params
+
+
+def to_frame(result):
+    # query_data_frame returns a list when the result has several tables.
+    if isinstance(result, list):
+        result = pd.concat(result, ignore_index=True) if result else None
+    if result is None:
+        return pd.DataFrame()
+    return result.drop(columns=[c for c in ("result", "table") if c in result.columns])
@@ -0,0 +1,299 @@
+import argparse
+import atexit
+import datetime
+import os
+import threading
+import time
+
+import pandas as pd
+from dotenv import load_dotenv
+from constants import TRIP_MEASUREMENT, TRIP_ROLLUP_FIELDS, TRIP_ROLLUP_MEASUREMENT
+from influx_writer import flush_all
+from trip_queries import VEHICLE_TAG, delete_predicate, parse_duration
+
+load_dotenv()
+
+# Comma separated rollup intervals, e.g. "1h,1d". Empty disables rollups.
+INFLUXDB_ROLLUPS = os.getenv("INFLUXDB_ROLLUPS", "")
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "5"))
+ROLLUP_REFRESH_STEP = os.getenv("ROLLUP_REFRESH_STEP", "30d")
+
+_refreshers = {}
+_lock = threading.Lock()
+
+REFRESH_QUERY = (
+    "data = from(bucket: params.source)\n"
+    "  |> range(start: params.start, stop: params.stop)\n"
+    "  |> filter(fn: (r) => r._measurement == params.measurement)\n"
+    "  |> filter(fn: (r) => "
+    + " or ".join(f'r._field == "{field}"' for field in TRIP_ROLLUP_FIELDS)
+    + ")\n"
+    f'  |> group(columns: ["{VEHICLE_TAG}", "_field"])\n'
+    "sums = data\n"
+    '  |> aggregateWindow(every: params.every, fn: sum, createEmpty: false, timeSrc: "_start")\n'
+    "trips = data\n"
+    '  |> filter(fn: (r) => r._field == "Mileage (km)")\n'
+    '  |> aggregateWindow(every: params.every, fn: count, createEmpty: false, timeSrc: "_start")\n'
+    "  |> toFloat()\n"
+    '  |> set(key: "_field", value: "Trip Count")\n'
+    "union(tables: [sums, trips])\n"
+    "  |> set(key: \"_measurement\", value: params.rollup_measurement)\n"
+    "  |> to(bucket: params.bucket, org: params.org)\n"
+)
+
+
+class Rollup:
+    def __init__(self, every, bucket):
+        self.every = parse_duration(every)
+        self.bucket = bucket
+
+    @property
+    def every_ns(self):
+        return self.every.value
+
+
+def parse_rollups(spec, source_bucket):
+    # Each interval gets its own bucket next to the raw one, e.g. "trips_1h".
+    rollups = []
+    for every in (item.strip() for item in spec.split(",")):
+        if every:
+            rollups.append(Rollup(every, f"{source_bucket}_{every}"))
+    rollups.sort(key=lambda rollup: rollup.every_ns)
+    for finer, coarser in zip(rollups, rollups[1:]):
+        if coarser.every_ns % finer.every_ns:
+            raise ValueError(f"Rollup interval {coarser.every} is not a multiple of {finer.every}")
+    return rollups
+
+
+def choose_rollup(rollups, every):
+    # The coarsest rollup whose windows tile the requested interval exactly;
+    # None means only the raw bucket can answer the query.
+    every_ns = parse_duration(every).value
+    for rollup in reversed(rollups):
+        if every_ns >= rollup.every_ns and every_ns % rollup.every_ns == 0:
+            return rollup
+    return None
+
+
+def batch_windows(lines, unit_ns):
+    # Line protocol ends with the timestamp, so the touched windows can be
+    # read off a written batch without parsing the fields.
+    windows = set()
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode()
+        timestamp = line.rpartition(" ")[2]
+        if timestamp.isdigit():
+            windows.add(int(timestamp) // unit_ns)
+    return windows
+
+
+def _ranges(windows, unit_ns, step_ns):
+    # Contiguous windows are refreshed together, in steps of at most step_ns.
+    ranges = []
+    for window in sorted(windows):
+        start, stop = window * unit_ns, (window + 1) * unit_ns
+        if ranges and ranges[-1][1] == start and stop - ranges[-1][0] <= step_ns:
+            ranges[-1][1] = stop
+        else:
+            ranges.append([start, stop])
+    return ranges
+
+
+def _to_ns(value):
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return timestamp.value
+
+
+def _to_datetime(ns):
+    return pd.Timestamp(ns, tz="UTC").to_pydatetime()
+
+
+class RollupRefresher:
+    def __init__(self, client, source_bucket, org, rollups, refresh_interval=ROLLUP_REFRESH_INTERVAL,
+                 refresh_step=ROLLUP_REFRESH_STEP, on_refresh=None):
+        self.client = client
+        self.source_bucket = source_bucket
+        self.org = org
+        self.rollups = rollups
+        self.refresh_interval = refresh_interval
+        self.on_refresh = on_refresh
+        self.closed = False
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_refresh = None
+        # Windows of the coarsest rollup; every finer rollup tiles them.
+        self.unit_ns = rollups[-1].every_ns
+        self.step_ns = max(parse_duration(refresh_step).value, self.unit_ns)
+        self._pending = set()
+        self._cond = threading.Condition()
+        self._busy = False
+        self._flush_requested = False
+        self._thread = threading.Thread(target=self._run, name=f"influx-rollups-{source_bucket}", daemon=True)
+        self._thread.start()
+
+    def mark_batch(self, lines):
+        self.mark_windows(batch_windows(lines, self.unit_ns))
+
+    def mark_windows(self, windows):
+        if not windows:
+            return
+        with self._cond:
+            self._pending.update(windows)
+            self._cond.notify_all()
+
+    def mark_range(self, start, stop):
+        start_ns, stop_ns = _to_ns(start), _to_ns(stop)
+        self.mark_windows(range(start_ns // self.unit_ns, -(-stop_ns // self.unit_ns)))
+
+    def refresh(self, windows):
+        # Each window is recomputed in full from the raw bucket, so refreshing
+        # twice or out of order always converges on the same aggregates.
+        query_api = self.client.query_api()
+        for start, stop in _ranges(windows, self.unit_ns, self.step_ns):
+            for rollup in self.rollups:
+                params = {
+                    "source": self.source_bucket,
+                    "bucket": rollup.bucket,
+                    "org": self.org,
+                    "measurement": TRIP_MEASUREMENT,
+                    "rollup_measurement": TRIP_ROLLUP_MEASUREMENT,
+                    "start": _to_datetime(start),
+                    "stop": _to_datetime(stop),
+                    "every": rollup.every.to_pytimedelta(),
+                }
+                query_api.query(REFRESH_QUERY, org=self.org, params=params)
+        self.refreshes += 1
+        self.last_refresh = time.time()
+        if self.on_refresh is not None:
+            self.on_refresh()
+
+    def flush(self):
+        # Returns once every pending window is refreshed, or on the first
+        # failed refresh so callers never wait on an unreachable InfluxDB.
+        with self._cond:
+            failures = self.failures
+            self._flush_requested = True
+            self._cond.notify_all()
+            while (self._pending or self._busy) and not self.closed and self.failures == failures:
+                self._cond.wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "rollups": [str(rollup.every) for rollup in self.rollups],
+            "pending_windows": pending,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_refresh": self.last_refresh,
+            "last_error": self.last_error,
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self.closed:
+                    self._cond.wait()
+                if self.closed:
+                    return
+                # Writes keep arriving in batches during an upload; waiting a
+                # moment lets them coalesce into one refresh per window.
+                self._cond.wait_for(lambda: self.closed or self._flush_requested, timeout=self.refresh_interval)
+                self._flush_requested = False
+                windows, self._pending = self._pending, set()
+                self._busy = True
+            try:
+                self.refresh(windows)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                print(f"Failed to refresh trip rollups: {e}")
+                with self._cond:
+                    self._pending.update(windows)
+                time.sleep(self.refresh_interval)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+
+def get_rollup_refresher(client, source_bucket, org, rollups, **options):
+    key = (id(client), source_bucket, org)
+    with _lock:
+        refresher = _refreshers.get(key)
+        if refresher is None or refresher.closed:
+            refresher = RollupRefresher(client, source_bucket, org, rollups, **options)
+            _refreshers[key] = refresher
+        return refresher
+
+
+def ensure_buckets(client, org, rollups):
+    buckets_api = client.buckets_api()
+    created = []
+    for rollup in rollups:
+        if buckets_api.find_bucket_by_name(rollup.bucket) is None:
+            buckets_api.create_bucket(bucket_name=rollup.bucket, org=org)
+            created.append(rollup.bucket)
+    return created
+
+
+def delete_rollups(client, org, rollups, start, stop, vehicles=None):
+    delete_api = client.delete_api()
+    for rollup in rollups:
+        for vehicle in vehicles or [None]:
+            delete_api.delete(start, stop, delete_predicate(TRIP_ROLLUP_MEASUREMENT, vehicle), bucket=rollup.bucket, org=org)
+
+
+@atexit.register
+def close_all():
+    # Registered after the writers' hook, so this runs first: queued trips
+    # are written (and their windows marked) before the refreshers drain.
+    flush_all()
+    with _lock:
+        refreshers = list(_refreshers.values())
+        _refreshers.clear()
+    for refresher in refreshers:
+        refresher.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create the trip rollup buckets and backfill them from raw trips.")
+    parser.add_argument("--start", default="2000-01-01", help="First day to backfill (default: 2000-01-01)")
+    parser.add_argument("--stop", default=None, help="Day after the last one to backfill (default: tomorrow)")
+    args = parser.parse_args(argv)
+
+    from db_manager import DBManager
+
+    db_manager = DBManager(auto_migrate=False)
+    if not db_manager.influx_rollups:
+        print("No rollups configured; set INFLUXDB_ROLLUPS, e.g. INFLUXDB_ROLLUPS=1h,1d")
+        return 1
+
+    created = ensure_buckets(db_manager.influx_client, db_manager.influx_org, db_manager.influx_rollups)
+    for bucket in created:
+        print(f"Created bucket {bucket}")
+
+    stop = args.stop or (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+    refresher = db_manager.rollup_refresher
+    started = time.perf_counter()
+    refresher.mark_range(args.start, stop)
+    refresher.flush()
+    print(f"Backfilled rollups from {args.start} to {stop} in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
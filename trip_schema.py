@@ -0,0 +1,84 @@
+import re
+from functools import lru_cache
+
+import pandas as pd
+from constants import COLUMN_SYNONYMS, CSV_COLUMNS, DISTANCE_UNITS, DURATION_UNITS
+
+_WHITESPACE = re.compile(r"\s+")
+_DUPLICATE_SUFFIX = re.compile(r"[._]\d+$")
+_UNIT = re.compile(r"^(?P<base>.*?)\s*\((?P<unit>[^)]*)\)$")
+
+
+def normalize_header(header):
+    return _WHITESPACE.sub(" ", str(header)).strip()
+
+
+def _resolve(header):
+    # Returns (canonical column, unit) for a normalized header, or None.
+    if header in CSV_COLUMNS or header in COLUMN_SYNONYMS.values():
+        return header, None
+
+    key = header.lower()
+    if key in COLUMN_SYNONYMS:
+        return COLUMN_SYNONYMS[key], None
+
+    match = _UNIT.match(key)
+    if match and match.group("base") in COLUMN_SYNONYMS:
+        return COLUMN_SYNONYMS[match.group("base")], match.group("unit").strip()
+    return None
+
+
+class SchemaMapping:
+    def __init__(self, header):
+        self.rename = {}
+        self.duration_unit = "min"
+        self.distance_factor = 1.0
+
+        for source in header:
+            normalized = normalize_header(source)
+            resolved = _resolve(normalized)
+            if resolved is None and _DUPLICATE_SUFFIX.search(normalized):
+                # pandas (".1") and some exporters ("_1") suffix repeated
+                # headers; the first occurrence wins.
+                continue
+            column, unit = resolved if resolved is not None else (normalized, None)
+            if column in self.rename.values():
+                continue
+            self.rename[source] = column
+
+            if column == "Duration" and unit in DURATION_UNITS:
+                self.duration_unit = DURATION_UNITS[unit]
+            elif column == "Mileage (km)" and unit in DISTANCE_UNITS:
+                self.distance_factor = DISTANCE_UNITS[unit]
+
+        missing_columns = set(CSV_COLUMNS) - set(self.rename.values())
+        if missing_columns:
+            raise ValueError(f"CSV file is missing required columns: {missing_columns}")
+
+    def apply(self, df):
+        df = df[list(self.rename)].rename(columns=self.rename)
+
+        for column in df.columns:
+            if pd.api.types.is_string_dtype(df[column]):
+                df[column] = df[column].str.replace(_WHITESPACE, " ", regex=True).str.strip()
+
+        if pd.api.types.is_numeric_dtype(df["Duration"]):
+            df["Duration"] = pd.to_timedelta(df["Duration"], unit=self.duration_unit, errors="coerce")
+
+        mileage = df["Mileage (km)"]
+        if not pd.api.types.is_numeric_dtype(mileage):
+            mileage = pd.to_numeric(mileage.astype("string").str.replace(",", "", regex=False), errors="coerce")
+        df["Mileage (km)"] = mileage * self.distance_factor if self.distance_factor != 1.0 else mileage
+
+        return df
+
+
+@lru_cache(maxsize=256)
+def _compile_mapping(header):
+    return SchemaMapping(header)
+
+
+def compile_mapping(header):
+    # Built once per header signature; repeated exports from the same
+    # provider go straight to apply().
+    return _compile_mapping(tuple(header))
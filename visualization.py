@@ -1,19 +1,33 @@
 import plotly.express as px
+import plotly.graph_objects as go
 import pandas as pd
 import json
-
-with open('data/sample_data.json') as f:
-    sample_data = json.load(f)
-
+import os
+from functools import lru_cache
+from figure_cache import memoize_figure
+from instrumentation import measure_input, traced
+from expense_forecast import ExpenseForecaster, get_expense_forecaster
+from downsample import bin_scatter, clip_window, lttb_frame, merge_intervals, should_downsample
+from trip_metrics import add_derived_fields
+
+SAMPLE_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sample_data.json")
+
+@lru_cache(maxsize=None)
+def get_sample_data():
+    with open(SAMPLE_DATA_PATH) as f:
+        return json.load(f)
+
+@traced(kind="chart", measure=measure_input)
+@memoize_figure
 def create_financial_chart(data=None):
     if data is None or not data:
-        data = sample_data["financial_data"]
+        data = get_sample_data()["financial_data"]
 
     df = pd.DataFrame(data, columns=["Date", "Vehicle", "Category", "Amount"])
     df["Date"] = pd.to_datetime(df["Date"])
     df.set_index("Date", inplace=True)
 
-    daily_data = df.resample("D").sum()
+    daily_data = df[["Amount"]].resample("D").sum()
 
     fig = px.bar(
         daily_data,
@@ -43,16 +57,25 @@ def create_financial_chart(data=None):
 
     return fig
 
-def create_trip_timeline(data=None):
-    if data is None or not data:
-        data = sample_data["trip_data"]
+@traced(kind="chart", measure=measure_input)
+@memoize_figure
+def create_trip_timeline(data=None, window=None, downsample=None):
+    if data is None or len(data) == 0:
+        data = get_sample_data()["trip_data"]
 
-    if not data:
+    df = pd.DataFrame(data)
+    if df.empty:
         return None
 
-    df = pd.DataFrame(data)
     df["Start Time"] = pd.to_datetime(df["Start Time"])
     df["End Time"] = pd.to_datetime(df["End Time"])
+    df = clip_window(df, "Start Time", window)
+
+    hover_data = None
+    if should_downsample(len(df), downsample):
+        # Thousands of bars collapse into one per busy stretch of each state.
+        df = merge_intervals(df, "Start Time", "End Time", "Trip State")
+        hover_data = ["Trips"]
 
     fig = px.timeline(
         df,
@@ -61,7 +84,8 @@ def create_trip_timeline(data=None):
         y="Trip State",
         color="Trip State",
         title="Trip Timeline",
-        labels={"Trip State": "Trip State"}
+        labels={"Trip State": "Trip State"},
+        hover_data=hover_data
     )
 
     fig.update_layout(
@@ -75,20 +99,15 @@ def create_trip_timeline(data=None):
 
     return fig
 
+@traced(kind="chart", measure=measure_input)
 def create_trip_summary(data=None):
     if data is None or not data:
-        data = sample_data["trip_data"]
+        data = get_sample_data()["trip_data"]
 
     if not data:
         return pd.DataFrame()
 
-    df = pd.DataFrame(data)
-    df["Start Time"] = pd.to_datetime(df["Start Time"])
-    df["End Time"] = pd.to_datetime(df["End Time"])
-    df["Duration"] = pd.to_timedelta(df["Duration"])
-
-    df["Trip Duration (hours)"] = df["Duration"].dt.total_seconds() / 3600.0
-    df["Average Speed (km/h)"] = df["Mileage (km)"] / df["Trip Duration (hours)"]
+    df = add_derived_fields(pd.DataFrame(data))
 
     summary_columns = [
         "Vehicle Plate Number", "Trip State", "Start Time", "End Time",
@@ -98,9 +117,11 @@ def create_trip_summary(data=None):
 
     return df[summary_columns]
 
-def create_daily_trip_mileage_chart(data=None):
+@traced(kind="chart", measure=measure_input)
+@memoize_figure
+def create_daily_trip_mileage_chart(data=None, window=None, downsample=None):
     if data is None:
-        data = pd.DataFrame(sample_data["trip_data"])
+        data = pd.DataFrame(get_sample_data()["trip_data"])
 
     if not isinstance(data, pd.DataFrame):
         data = pd.DataFrame(data)
@@ -108,19 +129,36 @@ def create_daily_trip_mileage_chart(data=None):
     if data.empty:
         return None
 
-    data["_time"] = pd.to_datetime(data["_time"])
-    data.set_index("_time", inplace=True)
-
-    daily_data = data.resample("D").sum()
-
-    fig = px.bar(
-        daily_data,
-        x=daily_data.index,
-        y=["Trip Count", "Mileage (km)"],
-        title="Daily Trip Count vs. Mileage",
-        labels={"index": "Date", "value": "Count/Mileage"},
-        barmode="group"
-    )
+    # Aggregated rows from InfluxDB carry "_time" and "Trip Count"; raw trip
+    # records (e.g. the sample data) are counted here instead.
+    time_column = "_time" if "_time" in data.columns else "Start Time"
+    if "Trip Count" not in data.columns:
+        data = data.assign(**{"Trip Count": 1})
+    columns = ["Trip Count", "Mileage (km)"]
+    data = data.assign(**{time_column: pd.to_datetime(data[time_column])})
+    data = clip_window(data, time_column, window)
+    daily_data = data.set_index(time_column)[columns].resample("D").sum()
+
+    if should_downsample(len(daily_data), downsample):
+        # Years of daily bars are thinner than a pixel; LTTB keeps the shape
+        # of both series with a line per series instead.
+        daily_data = lttb_frame(daily_data.rename_axis("Date").reset_index(), "Date", columns).set_index("Date")
+        fig = px.line(
+            daily_data,
+            x=daily_data.index,
+            y=columns,
+            title="Daily Trip Count vs. Mileage",
+            labels={"index": "Date", "value": "Count/Mileage"}
+        )
+    else:
+        fig = px.bar(
+            daily_data,
+            x=daily_data.index,
+            y=columns,
+            title="Daily Trip Count vs. Mileage",
+            labels={"index": "Date", "value": "Count/Mileage"},
+            barmode="group"
+        )
 
     fig.update_layout(
         xaxis_title="Date",
@@ -140,15 +178,17 @@ def create_daily_trip_mileage_chart(data=None):
 
     return fig
 
+@traced(kind="chart", measure=measure_input)
+@memoize_figure
 def create_expense_vs_revenue_chart(data=None):
     if data is None or not data:
-        data = sample_data["financial_data"]
+        data = get_sample_data()["financial_data"]
 
     df = pd.DataFrame(data, columns=["Date", "Vehicle", "Category", "Amount"])
     df["Date"] = pd.to_datetime(df["Date"])
     df.set_index("Date", inplace=True)
 
-    monthly_data = df.resample("M").sum()
+    monthly_data = df[["Amount"]].resample("MS").sum()
 
     fig = px.bar(
         monthly_data,
@@ -178,31 +218,42 @@ def create_expense_vs_revenue_chart(data=None):
 
     return fig
 
-def create_trip_efficiency_chart(data=None):
-    if data is None or not data:
-        data = sample_data["trip_data"]
-
-    if not data:
-        return None
+@traced(kind="chart", measure=measure_input)
+@memoize_figure
+def create_trip_efficiency_chart(data=None, window=None, downsample=None):
+    if data is None or len(data) == 0:
+        data = get_sample_data()["trip_data"]
 
     df = pd.DataFrame(data)
-    df["Start Time"] = pd.to_datetime(df["Start Time"])
-    df["End Time"] = pd.to_datetime(df["End Time"])
-    df["Duration"] = pd.to_timedelta(df["Duration"])
-
-    df["Trip Duration (hours)"] = df["Duration"].dt.total_seconds() / 3600.0
-    df["Average Speed (km/h)"] = df["Mileage (km)"] / df["Trip Duration (hours)"]
-    df["Fuel Consumption (km/l)"] = df["Mileage (km)"] / df["Fuel (l)"]
+    if df.empty or "Fuel (l)" not in df.columns:
+        return None
 
-    fig = px.scatter(
-        df,
-        x="Mileage (km)",
-        y="Fuel Consumption (km/l)",
-        color="Vehicle Plate Number",
-        title="Trip Efficiency Metrics",
-        labels={"Mileage (km)": "Mileage (km)", "Fuel Consumption (km/l)": "Fuel Consumption (km/l)"},
-        hover_data=["Start Time", "End Time", "Trip Duration (hours)", "Average Speed (km/h)"]
-    )
+    df = add_derived_fields(df)
+    df = clip_window(df, "Start Time", window)
+
+    if should_downsample(len(df), downsample):
+        # One marker per occupied grid cell and vehicle, sized by its trips.
+        df = bin_scatter(df, "Mileage (km)", "Fuel Consumption (km/l)", "Vehicle Plate Number")
+        fig = px.scatter(
+            df,
+            x="Mileage (km)",
+            y="Fuel Consumption (km/l)",
+            color="Vehicle Plate Number",
+            size="Trips",
+            title="Trip Efficiency Metrics",
+            labels={"Mileage (km)": "Mileage (km)", "Fuel Consumption (km/l)": "Fuel Consumption (km/l)"},
+            hover_data=["Trips"]
+        )
+    else:
+        fig = px.scatter(
+            df,
+            x="Mileage (km)",
+            y="Fuel Consumption (km/l)",
+            color="Vehicle Plate Number",
+            title="Trip Efficiency Metrics",
+            labels={"Mileage (km)": "Mileage (km)", "Fuel Consumption (km/l)": "Fuel Consumption (km/l)"},
+            hover_data=["Start Time", "End Time", "Trip Duration (hours)", "Average Speed (km/h)"]
+        )
 
     fig.update_layout(
         xaxis_title="Mileage (km)",
@@ -215,24 +266,47 @@ def create_trip_efficiency_chart(data=None):
 
     return fig
 
-def create_expense_forecast_chart(data=None):
+@traced(kind="chart", measure=measure_input)
+@memoize_figure
+def create_expense_forecast_chart(data=None, horizon=6, level=0.95):
     if data is None or not data:
-        data = sample_data["financial_data"]
-
-    df = pd.DataFrame(data, columns=["Date", "Vehicle", "Category", "Amount"])
-    df["Date"] = pd.to_datetime(df["Date"])
-    df.set_index("Date", inplace=True)
-
-    monthly_data = df.resample("M").sum()
-
-    fig = px.line(
-        monthly_data,
-        x=monthly_data.index,
-        y="Amount",
-        title="Expense Forecasting",
-        labels={"Amount": "Amount (USD)", "index": "Month"},
-        color_discrete_sequence=["#1f77b4"]
-    )
+        data = get_sample_data()["financial_data"]
+        forecaster = ExpenseForecaster()
+    else:
+        # The shared forecaster keeps its fitted parameters between reruns,
+        # so a new month only folds the latest totals into each series.
+        forecaster = get_expense_forecaster()
+    forecaster.update(data)
+
+    history = forecaster.history()
+    if history.empty:
+        return None
+    forecast = forecaster.fleet_forecast(horizon=horizon, level=level)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=list(forecast["Date"]) + list(forecast["Date"])[::-1],
+        y=list(forecast["Upper"]) + list(forecast["Lower"])[::-1],
+        fill="toself",
+        fillcolor="rgba(255, 127, 14, 0.2)",
+        line=dict(color="rgba(255, 127, 14, 0)"),
+        hoverinfo="skip",
+        name=f"{level:.0%} interval"
+    ))
+    fig.add_trace(go.Scatter(
+        x=history.index,
+        y=history.values,
+        mode="lines+markers",
+        line=dict(color="#1f77b4"),
+        name="Expenses"
+    ))
+    fig.add_trace(go.Scatter(
+        x=forecast["Date"],
+        y=forecast["Forecast"],
+        mode="lines+markers",
+        line=dict(color="#ff7f0e", dash="dash"),
+        name="Forecast"
+    ))
 
     fig.update_layout(
         xaxis_title="Month",
@@ -246,6 +320,7 @@ def create_expense_forecast_chart(data=None):
             tickprefix="$"
         ),
         title=dict(
+            text="Expense Forecasting",
             x=0.5,
             xanchor="center"
         )